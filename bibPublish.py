@@ -16,7 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os.path
-from sys import path
+from sys import path, stderr, exit
 from operator import attrgetter
 from optparse import OptionParser
 from glob import glob
@@ -36,10 +36,14 @@ from bibconfig import USER_CACHE, TEMPLATE_PATH, read_config
 def parse_options():
     """ parses the options specified by the user """
     parser = OptionParser()
-    parser.add_option("-o", "--output-dir", dest="output_dir", default=BIB_PUBLISH_OUTPUT_DIR,
-                      help="output directory.")
-    parser.add_option("-t", "--template", dest="template", default=DEFAULT_TEMPLATE,
-                      help="template to use (%s)." % DEFAULT_TEMPLATE)
+    parser.add_option("-o", "--output-dir", dest="output_dir", action="append", default=[],
+                      help="output directory (%s); may be repeated, once per template." % BIB_PUBLISH_OUTPUT_DIR)
+    parser.add_option("-t", "--template", dest="template", action="append", default=[],
+                      help="template to use (%s); may be repeated, once per output directory." % DEFAULT_TEMPLATE)
+    parser.add_option("--job-file", dest="job_file", default=None,
+                      help="CSV file listing 'template, output_dir' pairs to publish in a single run.")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None,
+                      help="number of templates to process concurrently (default: number of CPUs).")
     parser.add_option("--template-path", dest="template_path", default=TEMPLATE_PATH,
                       help="specify another template path (%s)." % (TEMPLATE_PATH))
     parser.add_option("-i", "--input", dest="input", default=BIB_PUBLISH_FILES,
@@ -50,49 +54,160 @@ def parse_options():
                       help="List of blacklisted publications (will not be published).")
     parser.add_option("--blacklist-type", dest="blacklisttype", action="append", default=[],
                       help="Blacklists the given publication type (will not be published).")
+    parser.add_option("-d", "--dedupe", dest="dedupe", action="store_true", default=False,
+                      help="only publish one entry per publication (removes duplicates with different keys).")
+    parser.add_option("-a", "--aux", dest="aux", default=None,
+                      help="only publish the entries cited in the given latex document (read from its .aux file).")
+    parser.add_option("--import-bundle", dest="import_bundle", default=None,
+                      help="add the bibtex files of the given bundle to the cache (instead of parsing them).")
+    parser.add_option("--shard", dest="shard", default=getattr(publishconfig, 'BIB_PUBLISH_SHARDING', None),
+                      help="publish one page per 'type', per 'year' or per 'size' entries and an index page.")
+    parser.add_option("--shard-size", dest="shard_size", type="int", default=getattr(publishconfig, 'BIB_PUBLISH_SHARD_SIZE', DEFAULT_SHARD_SIZE),
+                      help="number of entries per page for --shard=size (%d)." % DEFAULT_SHARD_SIZE)
+    parser.add_option("--stream", dest="stream", action="store_true", default=False,
+                      help="publish large inputs in bounded memory (entries are sorted using temporary files).")
+    parser.add_option("--run-size", dest="run_size", type="int", default=getattr(publishconfig, 'BIB_PUBLISH_RUN_SIZE', DEFAULT_RUN_SIZE),
+                      help="number of entries sorted in memory with --stream (%d)." % DEFAULT_RUN_SIZE)
+    parser.add_option("-w", "--watch", dest="watch", action="store_true", default=False,
+                      help="keep running and republish whenever the input files or the templates change.")
+    parser.add_option("--lint", dest="lint", action="store_true", default=False,
+                      help="check the entries for problems (e.g. missing titles) rather than publishing them.")
 
     (options, args) = parser.parse_args()
-    options.blacklisttype = [ bt.lower() for bt in options.blacklisttype ]
+    options.blacklist     = set( options.blacklist )
+    options.blacklisttype = set( [ bt.lower() for bt in options.blacklisttype ] )
+    if options.shard and not options.shard in SHARD_MODES:
+        parser.error("--shard has to be one of %s." % ", ".join(SHARD_MODES))
+    if options.shard_size < 1:
+        parser.error("--shard-size has to be positive.")
+    options.sharding = (options.shard, options.shard_size) if options.shard else None
+    if options.stream and (options.dedupe or options.shard or options.watch):
+        parser.error("--stream cannot be combined with --dedupe, --shard or --watch.")
+
+    # compose the (template, output_dir) jobs
+    if options.job_file:
+        options.publish_jobs = read_job_file( options.job_file )
+    else:
+        templates   = options.template or [ DEFAULT_TEMPLATE ]
+        output_dirs = options.output_dir or [ BIB_PUBLISH_OUTPUT_DIR ]
+        if len(templates) != len(output_dirs):
+            parser.error("--template and --output-dir have to be specified the same number of times.")
+        options.publish_jobs = zip( templates, output_dirs )
+
+    options.publish_jobs = [ (os.path.join(options.template_path, template), output_dir) for template, output_dir in options.publish_jobs ]
     return options
 
 
-_get_bib = lambda fn:  [ b for b in BibTex(fn) ]
+_get_bib = lambda fn: get_resolved_entries(fn)
+# cached entries carry the path of the file they have been parsed from
+_get_cached_bib = lambda fn: set_path( cacheRetrieve( USER_CACHE, fn, _get_bib ), fn )
+_macros = {}
+
+def _get_macros( fn ):
+    """ returns the (memoized) @string macros defined in fn """
+    if not fn in _macros:
+        _macros[fn] = cacheRetrieve( USER_CACHE, fn, read_macros, MACRO_SUFFIX )
+    return _macros[fn]
+
 
-def get_matching_bibtex_entries( search_terms, bibtex_files ):
+def get_matching_bibtex_entries( search_terms, bibtex_files, get_entries=_get_cached_bib ):
     """ returns a list of all bibtex entries matching the search terms """
     result = []
     for fname in bibtex_files:
-        result += [ b for b in cacheRetrieve( USER_CACHE, fname, _get_bib) if search_terms is None or search_terms in b ]
+        result += [ b for b in get_entries( fname ) if search_terms is None or search_terms in b ]
 
     return result
 
 
-def publish( publish_dir, template_path, bibtex_entries):
-    """ publishes the given bibtex_entries in publish_dir using the template specified in
-        template_path
-    """
-    ts = Template( template_path )
-    ts.recreateTheme( publish_dir)
+def get_cited_bibtex_entries( keys, bibtex_files, get_entries=_get_cached_bib ):
+    """ returns the bibtex entries with the given cited keys (see
+        get_aux_citations); only bibtex files containing cited keys are loaded """
+    key_index = keyIndexRetrieve( USER_CACHE, bibtex_files, lambda fn: summaryRetrieve( USER_CACHE, fn, _get_cached_bib ) )
+    result, missing = key_index.getEntries( keys, get_entries )
+    for key in missing:
+        stderr.write( "Cannot find the cited key '%s'.\n" % key )
+    return result
+
+
+def get_parent_lookup( bibtex_files, get_entries=_get_cached_bib ):
+    """ returns a function returning the (crossref'd) entry with the given key or None
+        - the key index is built on the first lookup and reused by all further
+          lookups of the run; parents are only looked up once """
+    key_index, parents = [], {}
+    def get_parent_entry( key ):
+        if not key in parents:
+            if not key_index:
+                key_index.append( keyIndexRetrieve( USER_CACHE, bibtex_files, lambda fn: summaryRetrieve( USER_CACHE, fn, _get_cached_bib ) ) )
+            entries, _ = key_index[0].getEntries( [key], get_entries )
+            parents[key] = entries[0] if entries else None
+        return parents[key]
+    return get_parent_entry
 
-    # write per file abstract/bibtex (if available)
-    for b in bibtex_entries:
-        b.entry['key'] = b.key
-        entry_discriptor = {'bibtex': os.path.join("bibtex", b.key+".bib") }
 
-        for k in ('eprint', 'url'):
-            if k in b.entry:
-                entry_discriptor[k] = b.entry[k]
+def iter_bibtex_entries( options, get_entries=_get_cached_bib ):
+    """ yields the bibtex entries to publish file by file (duplicates are not removed) """
+    cited = get_aux_citations( options.aux ) if options.aux else []
+    if options.aux and not CITE_ALL in cited:
+        batches = [ get_cited_bibtex_entries( cited, options.input, get_entries ) ]
+    else:
+        # documents citing all entries (\nocite{*}) publish all input files
+        batches = ( get_matching_bibtex_entries( None, [fname], get_entries ) for fname in options.input )
+    get_parent_entry = get_parent_lookup( options.input, get_entries )
+    for entries in batches:
+        entries = resolve_corpus( entries, options.input, _get_macros, get_parent_entry )
+        yield [ e for e in entries if e.key not in options.blacklist and e.type.lower() not in options.blacklisttype ]
 
-        if 'abstract' in b.entry:
-            entry_discriptor['abstract_url'] = os.path.join("abstract", b.key+".html")
-            open( os.path.join(publish_dir, entry_discriptor['abstract_url']), "w").write( ts.getAbstract(b) )
 
-        ts.setDescriptor( b, entry_discriptor )
-        open( os.path.join(publish_dir, entry_discriptor['bibtex']), "w").write( b.getBibTexCitation() )
+def get_bibtex_entries( options, get_entries=_get_cached_bib ):
+    """ returns the bibtex entries to publish """
+    entries = [ e for batch in iter_bibtex_entries( options, get_entries ) for e in batch ]
+    if options.dedupe:
+        entries = dedupe( entries )
+    return entries
 
-    # write index.html
-    open( os.path.join(publish_dir, "index.html"), "w").write( ts.getHtmlFile(entries) )
 
+def report_problems( bibtex_entries, processes=None ):
+    """ checks the bibtex entries (see lint.lint), prints their problems and
+        returns the number of errors """
+    problems = lint( bibtex_entries, processes=processes )
+    for fname, key, severity, rule, message in problems:
+        print "%s: %s: %s: %s [%s]" % (fname, key, severity, message, rule)
+    num_errors = len( [ problem for problem in problems if problem[2] == 'error' ] )
+    print "(%d entries checked, %d errors, %d warnings)" % (len(bibtex_entries), num_errors, len(problems) - num_errors)
+    return num_errors
+
+
+def watch_and_publish( options ):
+    """ publishes the bibtex entries whenever the input files or templates change
+        - the parsed input files and the templates are kept in memory; changed
+          files are reparsed and only the affected jobs are republished
+    """
+    corpus = {}
+    def get_entries( fname ):
+        if not fname in corpus:
+            corpus[fname] = _get_cached_bib( fname )
+        return corpus[fname]
+
+    publisher = Publisher( options.publish_jobs, options.sharding, options.jobs )
+    def republish( changed_files ):
+        for fname in changed_files or ():
+            corpus.pop( fname, None )
+        try:
+            jobs = publisher.update( get_bibtex_entries(options, get_entries), changed_files )
+            print "Published %s." % ", ".join( [ publish_dir for _, publish_dir in jobs ] )
+        except Exception, e:
+            stderr.write( "Cannot publish: %s\n" % e )
+
+    watched = [ os.path.abspath(fname) for fname in options.input ] + [ template_path for template_path, _ in options.publish_jobs ]
+    if options.aux:
+        watched.append( os.path.splitext( os.path.abspath(options.aux) )[0]+".aux" )
+    corpus_files = dict( [ (os.path.abspath(fname), fname) for fname in options.input ] )
+
+    republish( None )
+    try:
+        watch( watched, lambda changed: republish( [ corpus_files.get(fname, fname) for fname in changed ] ) )
+    except KeyboardInterrupt:
+        pass
 
 
 # ===============================================================================
@@ -102,17 +217,44 @@ def publish( publish_dir, template_path, bibtex_entries):
 # ===============================================================================
 
 read_config( LIB_DIR )
+import publishconfig
 from publishconfig import BIB_PUBLISH_OUTPUT_DIR, DEFAULT_TEMPLATE, BIB_PUBLISH_FILES
-from template import Template
-from bibtex import BibTex
+from bibtex import sort_entries, set_path
+from resolve import get_resolved_entries, read_macros, resolve_corpus, MACRO_SUFFIX
 from cache import cacheRetrieve
+from publish import publish_all, publish_stream, read_job_file, Publisher
+from extsort import DEFAULT_RUN_SIZE
+from shard import SHARD_MODES, DEFAULT_SHARD_SIZE
+from dedupe import dedupe
+from summary import summaryRetrieve
+from keyindex import keyIndexRetrieve
+from latex import get_aux_citations, CITE_ALL
+from bundle import import_bundle
+from watch import watch
+from lint import lint
 
 options = parse_options()
-entries = [ e for e in get_matching_bibtex_entries( None, options.input ) if e.key not in options.blacklist and e.type.lower() not in options.blacklisttype ]
+if options.import_bundle:
+    import_bundle( options.import_bundle, USER_CACHE, options.input )
+if options.lint:
+    exit( 1 if report_problems( get_bibtex_entries(options), options.jobs ) else 0 )
+if options.watch:
+    watch_and_publish( options )
+    exit(0)
+
+if options.stream and not options.list:
+    for template_path, publish_dir in options.publish_jobs:
+        publish_stream( publish_dir, template_path, iter_bibtex_entries(options), options.run_size )
+    exit(0)
 
+entries = get_bibtex_entries( options )
 if options.list == True:
-    for e in sorted(entries):
+    for e in sort_entries(entries, ('year', 'month', 'key')):
         print e.key
 else:
-    publish( options.output_dir, os.path.join(options.template_path, options.template), entries )
+    # do not start a long publishing run on entries which cannot be rendered
+    if getattr(publishconfig, 'BIB_PUBLISH_LINT', False) and report_problems( entries, options.jobs ):
+        stderr.write( "Not publishing (run with --lint for the problems only).\n" )
+        exit(1)
+    publish_all( options.publish_jobs, entries, options.jobs, options.sharding )
 
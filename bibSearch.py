@@ -16,10 +16,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os.path
-from sys import path
-from operator import attrgetter
+from sys import path, stdout, stderr, exit
 from optparse import OptionParser
-from glob import glob
 from os import stat
 
 if os.path.islink(__file__):
@@ -29,15 +27,19 @@ else:
 path.append( LIB_DIR )
 from bibconfig import USER_CACHE, read_config
 
-OUTPUT_FORMAT = { 'citation' : 'getCitation',
-                  'coins'    : 'getCoinsCitation',
-                  'wikipedia': 'getWikipediaCitation',
-                  'bibtex'   : 'getBibTexCitation' }
+# output formats selectable by a flag of their own
+OUTPUT_FLAGS = ('citation', 'coins', 'wikipedia', 'bibtex')
 
 
 def parse_options():
     """ parses the options specified by the user """
-    parser = OptionParser()
+    parser = OptionParser( usage="""%prog [options] [search terms]
+
+Search terms are plain strings which have to occur in any field of an entry or
+a query with field scoped terms (author:name, title:words, year:2005..2010,
+type:article, key:prefix), the operators AND, OR, NOT and parentheses; e.g.
+  %prog author:weichselbraun year:2009.. NOT type:misc
+  %prog -- "(title:ontology" OR "title:semantic web)" -type:techreport""" )
     parser.add_option("-b", "--bibtex", dest="bibtex", action="store_true",
                       help="output search results as bibtex snippets.")
     parser.add_option("-c", "--citation", dest="citation", action="store_true",
@@ -46,30 +48,206 @@ def parse_options():
                       help="output search results as wikipedia citations.")
     parser.add_option("-s", "--coins", dest="coins", action="store_true",
                       help="output search results as coins citations.")
+    parser.add_option("-F", "--format", dest="format", default=None,
+                      help="output format (%s)." % ", ".join( sorted(OUTPUT_FORMATS) ))
     parser.add_option("-p", "--path", dest="path", action="append", default=[],
                       help="add additional paths to the default search path.")
+    parser.add_option("-f", "--fuzzy", dest="fuzzy", action="store_true", default=False,
+                      help="approximate search (tolerates misspelled search terms).")
+    parser.add_option("--max-distance", dest="max_distance", type="int", default=None,
+                      help="maximum number of edits per search term in fuzzy mode (default: depends on the term's length).")
+    parser.add_option("-d", "--dedupe", dest="dedupe", action="store_true", default=False,
+                      help="only output one entry per publication (removes duplicates with different keys).")
+    parser.add_option("--ordered", dest="ordered", action="store_true", default=False,
+                      help="output the results in the order of the search path (rather than as soon as they are found).")
+    parser.add_option("--threads", dest="threads", type="int", default=getattr(searchconfig, 'SEARCH_THREADS', DEFAULT_THREADS),
+                      help="number of threads searching the directories of the search path concurrently.")
+    parser.add_option("--timeout", dest="timeout", type="float", default=getattr(searchconfig, 'SEARCH_TIMEOUT', None),
+                      help="skip directories which do not respond within the given number of seconds.")
+    parser.add_option("-k", "--key", dest="keys", action="append", default=[],
+                      help="only output the entries with the given (comma separated) bibtex keys.")
+    parser.add_option("-a", "--aux", dest="aux", default=None,
+                      help="only output the entries cited in the given latex document (read from its .aux file).")
+    parser.add_option("--cache-stats", dest="cache_stats", action="store_true", default=False,
+                      help="print statistics on the cache and exit.")
+    parser.add_option("--cache-prune", dest="cache_prune", action="store_true", default=False,
+                      help="remove stale and least recently used objects from the cache and exit.")
+    parser.add_option("--export-bundle", dest="export_bundle", default=None,
+                      help="write the parsed bibtex files of the search path and their indices to the given bundle file and exit.")
+    parser.add_option("--import-bundle", dest="import_bundle", default=None,
+                      help="add the bibtex files of the given bundle to the cache (instead of parsing them).")
 
 
     (options, args) = parser.parse_args()
 
     # output format 
     try:
-        output = [ opt for opt in OUTPUT_FORMAT.iterkeys() if attrgetter(opt)(options) ][0]
+        output = options.format or [ opt for opt in OUTPUT_FLAGS if getattr(options, opt) ][0]
     except IndexError:
         output = DEFAULT_OUTPUT_FORMAT or 'citation'
+    if not output in OUTPUT_FORMATS:
+        parser.error("unknown output format '%s'." % output)
+
+    return {'output_format': output, 'search_terms': args, 'search_path': DEFAULT_BIB_SEARCH_PATH + options.path,
+            'dedupe': options.dedupe, 'fuzzy': options.fuzzy, 'max_distance': options.max_distance, 'aux': options.aux,
+            'cache_stats': options.cache_stats, 'cache_prune': options.cache_prune,
+            'export_bundle': options.export_bundle, 'import_bundle': options.import_bundle,
+            'ordered': options.ordered, 'threads': options.threads, 'timeout': options.timeout,
+            'keys': [ key.strip() for keys in options.keys for key in keys.split(",") if key.strip() ] }
+
+
+_get_bib = lambda fn: get_resolved_entries(fn)
+# cached entries carry the path of the file they have been parsed from
+_get_cached_bib = lambda fn: set_path( cacheRetrieve( USER_CACHE, fn, _get_bib ), fn )
+_macros = {}
+
+def _get_macros( fn ):
+    """ returns the (memoized) @string macros defined in fn """
+    if not fn in _macros:
+        _macros[fn] = cacheRetrieve( USER_CACHE, fn, read_macros, MACRO_SUFFIX )
+    return _macros[fn]
+
+_get_summary = lambda fn: summaryRetrieve( USER_CACHE, fn, _get_cached_bib )
+
+def get_bibtex_files( search_path ):
+    """ returns all bibtex files in the search path
+        (directories are globbed concurrently and only once) """
+    return executor.glob( search_path )
+
+
+def search_bibtex_files( search_file, search_path, stats=None, matches=None ):
+    """ yields the bibtex entries found by search_file for all bibtex files in the search path
+        - files are searched concurrently (see scatter.ScatterGather)
+        - search_file returns the positions of the matching entries and the
+          file's entries or None for files which have been pruned
+        @param[in] stats    (optional dictionary receiving the number of 'files' and 'pruned' files)
+        @param[in] matches  (optional list receiving a (file, positions) tuple per file with matches)
+    """
+    num_files, num_pruned = 0, 0
+    for fname, result in executor.search( search_path, search_file ):
+        num_files += 1
+        if result is None:
+            num_pruned += 1
+        else:
+            positions, bibtex_entries = result
+            if matches is not None:
+                matches.append( (fname, positions) )
+            yield [ bibtex_entries[pos] for pos in positions ]
+
+    if stats is not None:
+        stats.update( {'files': num_files, 'pruned': num_pruned} )
+
+
+def get_search_path_version( search_path ):
+    """ returns the corpus version (see get_corpus_version) of the search path
+        - the files' validators are computed concurrently, i.e. slow file
+          systems do not require a round trip per file """
+    validation = getCache( USER_CACHE ).validation
+    validators = dict( executor.search( search_path, lambda fname: getValidator(fname, validation) ) )
+    return get_corpus_version( get_bibtex_files(search_path), validation, validators )
+
+
+def search_cached( search_file, search_path, search_key, stats=None ):
+    """ yields the results of search_bibtex_files from the query result cache
+        - results are keyed by search_key and the version of the corpus, i.e.
+          they are reused until a bibtex file of the search path changes
+        - results of searches skipping directories (timeouts) are not cached
+    """
+    results = getResultCache( USER_CACHE, QUERY_RESULT_CACHE )
+    key = "%s %s" % (get_search_path_version( search_path ), search_key)
+    cached = results.get( key )
+    if cached is not None:
+        matches, cached_stats = cached
+        for fname, positions in matches:
+            bibtex_entries = _get_cached_bib( fname )
+            yield [ bibtex_entries[pos] for pos in positions ]
+        if stats is not None:
+            stats.update( cached_stats )
+        return
+
+    matches, search_stats = [], {}
+    for batch in search_bibtex_files( search_file, search_path, search_stats, matches ):
+        yield batch
+    if stats is not None:
+        stats.update( search_stats )
+    if not executor.timed_out:
+        results.put( key, (matches, search_stats) )
 
-    return {'output_format': OUTPUT_FORMAT[output], 'search_terms': args, 'search_path': DEFAULT_BIB_SEARCH_PATH + options.path }
 
+def match_bibtex_file( fname, search_terms, fuzzy=False, max_distance=None ):
+    """ returns the positions of the bibtex entries of fname matching the
+        search terms and the file's entries or None, if the file's summary
+        proves that it cannot contain matches
+        @param[in] fuzzy         use the approximate search based on the file's n-gram index
+        @param[in] max_distance  (optional maximum number of edits per term for the fuzzy search)
+    """
+    if fuzzy:
+        positions = ngramIndexRetrieve( USER_CACHE, fname, _get_cached_bib ).search( search_terms, max_distance )
+        if not positions:
+            return None
+        return sorted(positions), _get_cached_bib( fname )
 
-_get_bib = lambda fn:  [ b for b in BibTex(fn) ]
+    if not _get_summary( fname ).mayContain( search_terms ):
+        return None
+    bibtex_entries = _get_cached_bib( fname )
+    return [ pos for pos, b in enumerate(bibtex_entries) if search_terms in b ], bibtex_entries
 
-def get_matching_bibtex_entries( search_terms, search_path ):
-    """ returns a list of all bibtex entries matching the search terms """
-    result = []
-    for bibdir in search_path:
-        for fname in glob(bibdir+"/*.bib"):
-            result += [ b for b in cacheRetrieve( USER_CACHE, fname, _get_bib) if search_terms in b ]
 
+def iter_matching_bibtex_entries( search_terms, search_path, stats=None, fuzzy=False, max_distance=None ):
+    """ yields the list of bibtex entries matching the search terms for every file
+        (see match_bibtex_file and search_cached) """
+    search_key = repr( ('match', search_terms, fuzzy, max_distance, executor.ordered) )
+    return search_cached( lambda fname: match_bibtex_file(fname, search_terms, fuzzy, max_distance), search_path, search_key, stats )
+
+
+def query_bibtex_file( fname, query ):
+    """ returns the positions of the bibtex entries of fname matching the
+        structured query and the file's entries or None
+        - the query is evaluated against the file's (cached) field index;
+          entries are only loaded if the file contains matches
+    """
+    positions = query.search( fieldIndexRetrieve( USER_CACHE, fname, _get_cached_bib ), lambda: _get_cached_bib(fname) )
+    if not positions:
+        return None
+    return positions, _get_cached_bib( fname )
+
+
+def iter_query_bibtex_entries( query, search_path, stats=None ):
+    """ yields the list of bibtex entries matching the structured query for every file
+        (see query_bibtex_file and search_cached) """
+    search_key = repr( ('query', query.getKey(), executor.ordered) )
+    return search_cached( lambda fname: query_bibtex_file(fname, query), search_path, search_key, stats )
+
+
+def get_parent_lookup( bibtex_files ):
+    """ returns a function returning the (crossref'd) entry with the given key or None
+        - the key index is built on the first lookup and reused by all further
+          lookups of the run; parents are only looked up once """
+    key_index, parents = [], {}
+    def get_parent_entry( key ):
+        if not key in parents:
+            if not key_index:
+                key_index.append( keyIndexRetrieve( USER_CACHE, bibtex_files, _get_summary ) )
+            entries, _ = key_index[0].getEntries( [key], _get_cached_bib )
+            parents[key] = entries[0] if entries else None
+        return parents[key]
+    return get_parent_entry
+
+
+def get_bibtex_entries_by_key( keys, search_path, stats=None ):
+    """ returns the bibtex entries with the given keys (in the order of keys)
+        - only bibtex files containing the requested keys are loaded
+    """
+    bibtex_files = get_bibtex_files( search_path )
+    key_index    = keyIndexRetrieve( USER_CACHE, bibtex_files, _get_summary )
+
+    result, missing = key_index.getEntries( keys, _get_cached_bib )
+    for key in missing:
+        stderr.write( "Cannot find the key '%s'.\n" % key )
+
+    if stats is not None:
+        loaded = set( [ key_index.index[key][0] for key in keys if key in key_index ] )
+        stats.update( {'files': len(bibtex_files), 'pruned': len(bibtex_files) - len(loaded)} )
     return result
 
 
@@ -80,17 +258,79 @@ def get_matching_bibtex_entries( search_terms, search_path ):
 # ===============================================================================
 
 read_config( LIB_DIR )
+import searchconfig
 from searchconfig import DEFAULT_BIB_SEARCH_PATH, DEFAULT_OUTPUT_FORMAT
-from bibtex import BibTex
-from cache import cacheRetrieve
+from resolve import get_resolved_entries, read_macros, resolve_corpus, MACRO_SUFFIX
+from bibtex import set_path
+from cache import cacheRetrieve, getCache, getValidator
+from summary import summaryRetrieve
+from dedupe import dedupe
+from ngram import ngramIndexRetrieve
+from keyindex import keyIndexRetrieve
+from latex import get_aux_citations, CITE_ALL
+from bundle import export_bundle, import_bundle
+from query import Query, is_query, fieldIndexRetrieve
+from output import get_writer, OUTPUT_FORMATS
+from scatter import ScatterGather, DEFAULT_THREADS
+from resultcache import getResultCache, get_corpus_version, QUERY_RESULT_CACHE
+
+# load additional output formats
+for plugin in getattr( searchconfig, 'OUTPUT_FORMAT_PLUGINS', () ):
+    __import__( plugin )
 
 opt = parse_options()
-entries = get_matching_bibtex_entries( opt['search_terms'], opt['search_path'] )
+executor = ScatterGather( opt['threads'], opt['timeout'], opt['ordered'] )
+if opt['cache_stats'] or opt['cache_prune']:
+    cache = getCache( USER_CACHE )
+    if opt['cache_prune']:
+        print "%d objects removed from the cache." % cache.prune()
+    if opt['cache_stats']:
+        print "%(entries)d objects, %(size)d bytes, %(stale)d stale, %(orphans)d orphaned (%(backend)s backend)" % cache.getStatistics()
+    exit(0)
 
-output = attrgetter( opt['output_format'] )
+if opt['export_bundle']:
+    print "%d files exported." % export_bundle( opt['export_bundle'], get_bibtex_files( opt['search_path'] ), _get_cached_bib, opt['search_path'] )
+    exit(0)
+if opt['import_bundle']:
+    import_bundle( opt['import_bundle'], USER_CACHE, get_bibtex_files( opt['search_path'] ) )
 
-for entry in entries:
-    print output(entry)() 
+stats = {}
+if opt['aux'] or opt['keys']:
+    keys    = get_aux_citations( opt['aux'] ) if opt['aux'] else opt['keys']
+    if CITE_ALL in keys:
+        stderr.write( "The document cites all entries (\\nocite{*}); only its explicitly cited keys are listed.\n" )
+        keys = [ key for key in keys if key != CITE_ALL ]
+    batches = [ get_bibtex_entries_by_key( keys, opt['search_path'], stats ) ]
+elif is_query( opt['search_terms'] ) and not opt['fuzzy']:
+    try:
+        query = Query( opt['search_terms'] )
+    except ValueError, e:
+        stderr.write( "%s\n" % e )
+        exit(1)
+    batches = iter_query_bibtex_entries( query, opt['search_path'], stats )
+else:
+    batches = iter_matching_bibtex_entries( opt['search_terms'], opt['search_path'], stats, opt['fuzzy'], opt['max_distance'] )
+
+bibtex_files = get_bibtex_files( opt['search_path'] )
+get_parent_entry = get_parent_lookup( bibtex_files )
+batches = ( resolve_corpus( batch, bibtex_files, _get_macros, get_parent_entry ) for batch in batches )
+if opt['dedupe']:
+    entries = [ b for batch in batches for b in batch ]
+    batches = [ dedupe( entries ) ]
+    stats['duplicates'] = len(entries) - len(batches[0])
 
-print "(%d entries found)" % len(entries)
+# entries are written as soon as they are found (unless duplicates are removed)
+writer = get_writer( opt['output_format'], stdout )
+num_entries = 0
+for batch in batches:
+    for entry in batch:
+        writer.write( entry )
+        num_entries += 1
+writer.close()
 
+# keep machine readable output clean
+summary = stderr if writer.machine_readable else stdout
+if opt['dedupe']:
+    summary.write( "(%d entries found, %d of %d files pruned, %d duplicates removed)\n" % (num_entries, stats['pruned'], stats['files'], stats['duplicates']) )
+else:
+    summary.write( "(%d entries found, %d of %d files pruned)\n" % (num_entries, stats['pruned'], stats['files']) )
@@ -0,0 +1,21 @@
+# bibTexSuite cache config file
+
+# cache backend ('file' stores one file per cached object, 'sqlite' a single
+# database file)
+CACHE_BACKEND = 'file'
+
+# the least recently used objects are removed from the cache, once it exceeds
+# one of the following limits
+CACHE_MAX_SIZE    = 512*1024*1024   # bytes
+CACHE_MAX_ENTRIES = 20000
+
+# cached objects are validated based on
+#  'mtime'  : the modification time of their source file
+#  'content': the size and content hash of their source file (caches stay valid
+#             if files are checked out or copied and can be shared between machines)
+CACHE_VALIDATION = 'mtime'
+
+# maximum number of results (query results and rendered entries) kept in each
+# result cache; the least recently used results are removed first (0 disables
+# the result caches)
+RESULT_CACHE_MAX_ENTRIES = 5000
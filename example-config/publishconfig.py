@@ -13,3 +13,21 @@ BIB_PUBLISH_WHITELIST = ()
 
 BIB_PUBLISH_OUTPUT_DIR = expanduser('~/Public/publications')
 
+
+# the templates' icons and css are only copied if they have been modified;
+# hardlink them (if the output directory is on the same file system) and use
+# multiple threads for copying
+THEME_LINK_FILES   = False
+THEME_COPY_THREADS = 1
+
+# publish large corpora as one page per 'type', per 'year' or per 'size'
+# entries (BIB_PUBLISH_SHARD_SIZE) and an index page (None: a single page)
+BIB_PUBLISH_SHARDING   = None
+BIB_PUBLISH_SHARD_SIZE = 100
+
+# number of entries sorted in memory when publishing with --stream
+BIB_PUBLISH_RUN_SIZE = 10000
+
+# check the entries (see --lint) before publishing them and do not publish
+# if errors are found (not applied with --stream and --watch)
+BIB_PUBLISH_LINT = False
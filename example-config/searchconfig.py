@@ -1,6 +1,16 @@
 # bibSearch example config file
 
-# default output format (citation, bibtex, wikipedia)
+# default output format (citation, bibtex, wikipedia, coins, jsonl, csl-json)
 DEFAULT_OUTPUT_FORMAT = 'citation'
 
 DEFAULT_BIB_SEARCH_PATH = ['/home/albert/data/ac.literature', ]
+
+# number of threads searching the directories of the search path concurrently
+SEARCH_THREADS = 8
+# skip directories (e.g. unavailable network mounts) which do not respond
+# within the given number of seconds (None: wait forever)
+SEARCH_TIMEOUT = None
+
+# modules providing additional output formats (registered with
+# output.register_output_format)
+OUTPUT_FORMAT_PLUGINS = []
@@ -20,6 +20,10 @@ ATTR_TRANSLATION_TABLE = {'booktitle': ' %s',
 # publications to ignore
 PUBLICATION_BLACKLIST = ('walter2002', 'weichselbraun2001', 'walter2003', )
 
+# the order of the entries within a publication type; fields prefixed
+# with '-' are sorted in descending order
+ENTRY_SORT_ORDER = ('-year', '-month', 'key')
+
 # translation of strings (required to translate latex constructs
 # into matching html, etc.
 STR_TRANSLATION_TABLE  = {}
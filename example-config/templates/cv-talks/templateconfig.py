@@ -20,6 +20,10 @@ STR_TRANSLATION_TABLE  = {}
 # publications to ignore
 PUBLICATION_BLACKLIST = ()
 
+# the order of the entries within a publication type; fields prefixed
+# with '-' are sorted in descending order
+ENTRY_SORT_ORDER = ('-year', '-month', 'key')
+
 # translation of the file menu
 FILE_TRANSLATION_TABLE = {'abstract_url': '',
                           'url'         : '',
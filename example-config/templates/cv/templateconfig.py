@@ -19,6 +19,10 @@ ATTR_TRANSLATION_TABLE = {'booktitle': ' %s',
 # publications to ignore
 PUBLICATION_BLACKLIST = ()
 
+# the order of the entries within a publication type; fields prefixed
+# with '-' are sorted in descending order
+ENTRY_SORT_ORDER = ('-year', '-month', 'key')
+
 # translation of strings (required to translate latex constructs
 # into matching html, etc.
 STR_TRANSLATION_TABLE  = {}
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+""" processes many documents concurrently in a pool of worker processes
+    - run_forked maps any function over a list of items in forked worker
+      processes (used for publishing, rendering shards and linting) """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import join, basename, splitext, exists
+from multiprocessing import Pool
+
+from cache import flushCaches
+from resultcache import flushResultCaches
+
+# the function mapped by run_forked (inherited by the worker processes on fork)
+_FORKED = None
+
+
+def read_manifest( fname ):
+    """ returns the documents listed in the manifest (one document per line,
+        empty lines and lines starting with '#' are ignored) """
+    return [ line.strip() for line in open(fname) if line.strip() and not line.strip().startswith("#") ]
+
+
+def get_output_file( document, output_dir, extension ):
+    """ returns the name of the output file for the given document """
+    return join( output_dir, splitext( basename(document) )[0] + extension )
+
+
+def _run_forked_item( item ):
+    """ calls the function of run_forked for a single item in a worker process """
+    try:
+        return _FORKED( item )
+    finally:
+        # worker processes exit without running the atexit handlers, i.e.
+        # cached objects and results would never be indexed
+        flushCaches()
+        flushResultCaches()
+
+
+def run_forked( fn, items, processes=None ):
+    """ returns map( fn, items ) computed by up to processes worker processes
+        - fn (and the data it refers to) is inherited by the worker processes
+          on fork, i.e. only the items and the results are pickled
+        - less than two items or processes=1 are computed in this process
+    """
+    global _FORKED
+    items = list( items )
+    if len(items) < 2 or processes == 1:
+        return map( fn, items )
+
+    previous, _FORKED = _FORKED, fn
+    try:
+        pool = Pool( processes )
+        try:
+            return pool.map( _run_forked_item, items )
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _FORKED = previous
+
+
+def _run_job( job ):
+    """ runs a single job
+        @returns None or an error message """
+    fn, args = job
+    try:
+        fn( *args )
+    except Exception, e:
+        return "%s: %s" % (args[0], e)
+
+
+def run_batch( fn, documents, output_dir, extension, args=(), processes=None ):
+    """ calls fn( document, output_file, *args ) for every document in up to
+        processes worker processes (see run_forked)
+        - fn needs to be a module level function (it is pickled by name)
+        - no document is processed if two documents share the same output file
+        @returns a list of error messages for the documents which failed
+    """
+    if not exists( output_dir ):
+        os.makedirs( output_dir )
+
+    # documents with the same name (e.g. a/main.tex and b/main.tex) would
+    # overwrite each other's output file
+    output_files, errors = {}, []
+    for document in documents:
+        output_file = get_output_file( document, output_dir, extension )
+        if output_file in output_files:
+            errors.append( "%s: output file '%s' is also written by %s" % (document, output_file, output_files[output_file]) )
+        else:
+            output_files[output_file] = document
+    if errors:
+        return errors
+
+    jobs = [ (fn, (document, get_output_file(document, output_dir, extension)) + args) for document in documents ]
+    return filter( None, run_forked( _run_job, jobs, processes ) )
+
+
+
+def _write_upper( document, output_file ):
+    open( output_file, "w" ).write( open(document).read().upper() )
+
+
+def _write_cached_upper( document, output_file, cachedir ):
+    from cache import cacheRetrieve
+    open( output_file, "w" ).write( cacheRetrieve( cachedir, document, lambda fname: open(fname).read().upper() ) )
+
+
+class TestBatch(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir    = mkdtemp()
+        self.documents = [ join(self.tmpdir, "doc%d.tex" % i) for i in range(4) ]
+        for document in self.documents:
+            open( document, "w" ).write( basename(document) )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def testRunBatch(self):
+        """ tests whether every document gets its own output file """
+        output_dir = join( self.tmpdir, "out" )
+        errors = run_batch( _write_upper, self.documents + ["missing.tex"], output_dir, ".txt", processes=2 )
+        assert len(errors) == 1 and errors[0].startswith("missing.tex")
+        for i in range(4):
+            assert open( join(output_dir, "doc%d.txt" % i) ).read() == "DOC%d.TEX" % i
+
+    def testDuplicateOutputFiles(self):
+        """ tests whether documents writing the same output file are rejected """
+        output_dir = join( self.tmpdir, "out" )
+        os.mkdir( join(self.tmpdir, "b") )
+        duplicate = join( self.tmpdir, "b", "doc0.tex" )
+        open( duplicate, "w" ).write( "" )
+        errors = run_batch( _write_upper, self.documents + [duplicate], output_dir, ".txt", processes=2 )
+        assert len(errors) == 1 and errors[0].startswith( duplicate )
+        assert os.listdir( output_dir ) == []
+
+    def testRelativeInputs(self):
+        """ tests whether documents in different directories include their own input files """
+        from latex import finalize
+        documents = []
+        for name in ("a", "b"):
+            os.mkdir( join(self.tmpdir, name) )
+            documents.append( join(self.tmpdir, name, "paper_%s.tex" % name) )
+            open( documents[-1], "w" ).write( "start\n\\input{chapter}\n" )
+            open( join(self.tmpdir, name, "chapter.tex"), "w" ).write( "chapter %s\n" % name )
+        output_dir = join( self.tmpdir, "out" )
+        assert run_batch( finalize, documents, output_dir, ".tex", processes=2 ) == []
+        for name in ("a", "b"):
+            assert open( join(output_dir, "paper_%s.tex" % name) ).read() == "start\nchapter %s\n\n" % name
+
+    def testCachedObjects(self):
+        """ tests whether objects cached by worker processes are indexed """
+        from cache import getCache
+        cachedir = join( self.tmpdir, "cache" )
+        assert run_batch( _write_cached_upper, self.documents, join(self.tmpdir, "out"), ".txt", (cachedir, ), processes=2 ) == []
+        assert getCache( cachedir ).getStatistics()['entries'] == 4
@@ -29,6 +29,13 @@ CONFIG_FILE   = join( USER_PREF_DIR, "publishconfig.py" )
 TEMPLATE_PATH = join( USER_PREF_DIR, "templates" )
 USER_CACHE    = join( USER_PREF_DIR, "cache" )
 
+# default cache settings (overwritten by USER_PREF_DIR/cacheconfig.py)
+CACHE_BACKEND     = 'file'
+CACHE_MAX_SIZE    = 512*1024*1024
+CACHE_MAX_ENTRIES = 20000
+CACHE_VALIDATION  = 'mtime'
+RESULT_CACHE_MAX_ENTRIES = 5000
+
 
 def _create_config( lib_dir ):
     """ copys the config-template to the USER_PREF_DIR """
@@ -20,14 +20,153 @@
 
 import _bibtex
 from operator import and_
+from re import compile as re_compile
+import unicodedata
 from os.path import basename
 from urllib import urlencode
 
 BIBTEX_TEST_FILE = "self.bib"
 
-cleanup = lambda x: x.replace("{", "").replace("}", "").replace("\"", "")
+# characters removed from field values
+CLEANUP_CHARS         = "{}\""
+CLEANUP_UNICODE_TABLE = dict( [ (ord(c), None) for c in CLEANUP_CHARS ] )
+cleanup = lambda x: x.translate(None, CLEANUP_CHARS) if isinstance(x, str) else x.translate(CLEANUP_UNICODE_TABLE)
 get_longest_word = lambda s: max( [ (len(w), w) for w in s.split() ] )[1]
 
+RE_LATEX_ACCENT = re_compile(r"\\[^a-zA-Z\s]")
+RE_NON_ALNUM    = re_compile(r"[^a-z0-9]+")
+
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+RE_NUMBER = re_compile(r"\d+")
+
+# default ordering of entries: fields prefixed with '-' are sorted in descending order
+DEFAULT_SORT_ORDER = ('-year', '-month', 'key')
+
+
+def get_number(s):
+    """ returns the first number contained in s (or 0) """
+    m = RE_NUMBER.search(s)
+    return int(m.group(0)) if m else 0
+
+
+def get_month(s):
+    """ returns the number of the month specified in s (e.g. 'June', '30 jun', '6') or 0 """
+    words = s.lower().split()
+    for w in words:
+        if w[:3] in MONTHS:
+            return MONTHS.index(w[:3]) + 1
+    if len(words) == 1 and 1 <= get_number(words[0]) <= 12:
+        return get_number(words[0])
+    return 0
+
+
+def normalize(text):
+    """ returns a lower case ascii version of text without latex accents,
+        punctuation and surplus whitespace (e.g. 'M{\\"u}ller' -> 'muller') """
+    if isinstance(text, str):
+        text = text.decode("utf-8", "ignore")
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore")
+    text = RE_LATEX_ACCENT.sub("", cleanup(text)).replace("\\", "").replace("'", "").lower()
+    return " ".join( RE_NON_ALNUM.split(text) ).strip()
+
+
+def split_value(native):
+    """ splits a native bibtex value into its '#' concatenated parts """
+    parts, depth, quoted, start = [], 0, False, 0
+    for pos, c in enumerate(native):
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif c == '"' and depth == 0:
+            quoted = not quoted
+        elif c == '#' and depth == 0 and not quoted:
+            parts.append( native[start:pos].strip() )
+            start = pos+1
+    parts.append( native[start:].strip() )
+    return parts
+
+
+def is_macro(part):
+    """ returns True if the part of a native bibtex value refers to a macro """
+    return part != "" and part[0] not in '{"' and not part.isdigit()
+
+
+def refers_to_macro(native):
+    """ returns True if the native bibtex value refers to any macro """
+    # shortcut for the common case of a single braced or quoted value
+    if native[:1] in ('{', '"') and not '#' in native:
+        return False
+    return [ p for p in split_value(native) if is_macro(p) ] != []
+
+
+def create_entries(records, path=""):
+    """ creates the BibTexEntries for a batch of raw _bibtex records
+        - the values of all records are cleaned up by a single translate call
+        @param[in] records  list of records as returned by _bibtex.next
+        @param[in] path     (optional path to the bib file containing the entries)
+        @returns a list of BibTexEntries
+    """
+    get_native = _bibtex.get_native
+    natives = [ [ (field, get_native(value)) for field, value in record[4].iteritems() ] for record in records ]
+    # bibtex values never contain NUL characters
+    values  = iter( cleanup( "\0".join( [ value for native in natives for _, value in native ] ) ).split("\0") )
+
+    result = []
+    for record, native in zip(records, natives):
+        b = BibTexEntry.__new__(BibTexEntry)
+        b._setValues( record[0], record[1], native, [ (field, values.next()) for field, _ in native ], path )
+        result.append( b )
+    return result
+
+
+def set_path(bibtex_entries, path):
+    """ sets the path of the given bibtex entries (cached entries validated by
+        content are shared by all copies of a bib file)
+        @returns bibtex_entries
+    """
+    for b in bibtex_entries:
+        b.path = path
+    return bibtex_entries
+
+
+def sort_entries(bibtex_entries, sort_order=DEFAULT_SORT_ORDER):
+    """ sorts the bibtex entries based on the given sort_order
+        @param[in] bibtex_entries
+        @param[in] sort_order      tuple of field names; fields prefixed with '-'
+                                   are sorted in descending order
+        @returns a sorted list of bibtex entries
+    """
+    fields = [ field.lstrip("-") for field in sort_order ]
+    decorated = [ ([ b.getSortValue(field) for field in fields ], b) for b in bibtex_entries ]
+
+    # stable multi-pass sort (least significant field first)
+    for pos in reversed( range(len(sort_order)) ):
+        decorated.sort( key=lambda d: d[0][pos], reverse=sort_order[pos].startswith("-") )
+    return [ b for _, b in decorated ]
+
+
+class Descending(object):
+    """ reverses the order of the wrapped value (see get_sort_key) """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __cmp__(self, o):
+        return cmp( o.value, self.value )
+
+
+def get_sort_key(bibtex_entry, sort_order=DEFAULT_SORT_ORDER):
+    """ returns a key which sorts the bibtex entries like sort_entries, e.g.
+        to merge entries sorted in separate runs """
+    key = []
+    for field in sort_order:
+        value = bibtex_entry.getSortValue( field.lstrip("-") )
+        if field.startswith("-"):
+            value = -value if isinstance(value, (int, long)) else Descending(value)
+        key.append( value )
+    return tuple( key )
+
 
 class NameFormatter(object):
     """ handles different name formats """
@@ -84,33 +223,87 @@ class BibTexEntry(object):
     def __init__(self, bibtex_entry, path=""):
         """ @param[in] bibtex_entry 
             @param[in] path          (optional path to the bib file containing the entry)
+            (use create_entries to create the entries of a whole file)
+        """
+        key, entry_type, tmp, tmp, entries  = bibtex_entry
+        native = [ (field, _bibtex.get_native(value)) for field, value in entries.iteritems() ]
+        self._setValues( key, entry_type, native, [ (field, cleanup(value)) for field, value in native ], path )
+
+
+    def _setValues(self, key, entry_type, native, cleaned, path):
+        """ @param[in] native   list of (field, native value) tuples
+            @param[in] cleaned  list of (field, cleaned value) tuples
         """
-        self.key, self.type, tmp, tmp, entries  = bibtex_entry
-        self.orig_entry = dict( [ (key, cleanup(_bibtex.get_native(value))) for key, value in entries.iteritems() ] )
-        self.entry = dict( [ (key, cleanup(value)) for key, value in self.orig_entry.iteritems() ] )
+        self.key, self.type, self.path = key, entry_type, path
+        self.orig_entry = dict( cleaned )
+        # cleanup is idempotent, i.e. the entry starts as a copy of orig_entry
+        self._entry = dict( cleaned )
+        # authors are normalized on the first access of entry
+        self._authors_pending = 'author' in self._entry
+        # native values of fields referring to @string macros (see resolve.resolve_entries)
+        self.macros = dict( [ (field, value) for field, value in native if refers_to_macro(value) ] )
 
 
-        self.path  = path
-        if 'author' in self.entry:
-            self.entry['author'] = NameFormatter(self.entry['author']).getBibTexAuthors()
+    @property
+    def entry(self):
+        """ the cleaned up fields of the entry (with normalized authors) """
+        if self._authors_pending:
+            self._entry['author'] = NameFormatter(self._entry['author']).getBibTexAuthors()
+            self._authors_pending = False
+        return self._entry
 
 
+    def __getstate__(self):
+        """ normalizes pending authors before the entry is pickled, i.e.
+            cached entries never pay for the normalization again """
+        self.entry
+        return self.__dict__
+
+
+    def setField(self, field, value):
+        """ sets the value of the given field (e.g. after expanding macros) """
+        self.orig_entry[field] = self.entry[field] = cleanup(value)
+        if field == 'author':
+            self._authors_pending = True
+        self._sort_key = None
+
 
     def __cmp__(self, o):
-        """ sorts bibtex entries based on the publishing year """
-        sy, oy = self.entry.get('year',0), o.entry.get('year', 0)
-        if sy == oy:
-            return 0
-        elif sy > oy:
-            return 1
+        """ sorts bibtex entries based on the publishing year, month and key """
+        return cmp( self.getSortKey(), o.getSortKey() )
+
+
+    def getSortKey(self):
+        """ returns the (precomputed) default sort key (year, month, key) """
+        if getattr(self, '_sort_key', None) is None:
+            self._sort_key = ( self.getSortValue('year'), self.getSortValue('month'), self.getSortValue('key') )
+        return self._sort_key
+
+
+    def getSortValue(self, field):
+        """ returns the value used for sorting the entry by the given field """
+        if field == 'year':
+            return get_number( self.entry.get('year', '') )
+        elif field == 'month':
+            return get_month( self.entry.get('month', '') )
+        elif field == 'key':
+            return self.key.lower()
+        elif field == 'type':
+            return self.type.lower()
+        elif field == 'author':
+            return NameFormatter(self.entry.get('author', '')).getFirstAuthorLastname().lower()
         else:
-            return -1
+            return self.entry.get(field, '').lower()
 
 
     def __contains__(self, search_terms):
         """ returns true if any of the BibTexEntry's fields contains the given string """
-        textRep = " ".join( map(str.lower, self.entry.values()) ) + self.key
+        textRep = self.getTextRepresentation()
         return reduce(and_, [ needle.lower() in textRep for needle in search_terms])
+
+    def getTextRepresentation(self):
+        """ returns the lower case text searched by __contains__ """
+        return " ".join( map(str.lower, self.entry.values()) ) + self.key
     
     def getNumAuthors(self):
         """ returns the number of authors """
@@ -221,6 +414,17 @@ class BibTex(object):
             raise StopIteration
 
 
+    def getEntries(self):
+        """ returns a list of all (remaining) entries using the bulk construction path """
+        records = []
+        while True:
+            record = _bibtex.next(self.fhandle)
+            if record is None:
+                break
+            records.append( record )
+        return create_entries( records, self.path )
+
+
 
       
 
@@ -327,6 +531,41 @@ class TestBibTexEntry(object):
         assert ('albert', 'Anna') not in b 
         assert  ('Julius',) not in b 
 
+    def testPickle(self):
+        """ tests whether pickled entries carry normalized authors """
+        from cPickle import dumps, loads
+        b = BibTexEntry( self.bibtex_entry )
+        assert b._authors_pending
+        copy = loads( dumps(b, -1) )
+        assert not copy._authors_pending and copy.entry == b.entry
+
+
+class TestSortEntries(object):
+
+    def setUp(self):
+        from os.path import dirname, join as os_join
+        self.bibtex_entries = [ b for b in BibTex( os_join( dirname(__file__), "../test", BIBTEX_TEST_FILE ) ) ]
+
+    def testGetMonth(self):
+        """ tests the parsing of month specifications """
+        assert get_month("30 June") == 6
+        assert get_month("10 February") == 2
+        assert get_month("11") == 11
+        assert get_month("") == 0
+
+    def testSortEntries(self):
+        """ tests whether entries are sorted by year, month and key """
+        result = sort_entries( self.bibtex_entries )
+        keys   = [ b.getSortKey() for b in result ]
+        assert [ k[:2] for k in keys ] == sorted( [ k[:2] for k in keys ], reverse=True )
+        assert sort_entries( self.bibtex_entries, ('year', 'month', 'key') ) == sorted( self.bibtex_entries )
+        assert [ b.key for b in sort_entries( self.bibtex_entries, ('key', ) ) ] == sorted( [ b.key for b in self.bibtex_entries ], key=str.lower )
+
+    def testGetSortKey(self):
+        """ tests whether sort keys order the entries like sort_entries """
+        for sort_order in ( DEFAULT_SORT_ORDER, ('type', '-key'), ('-author', 'year') ):
+            assert sorted( self.bibtex_entries, key=lambda b: get_sort_key(b, sort_order) ) == sort_entries( self.bibtex_entries, sort_order )
+
 
 class TestNameFormatter(object):
     """ tests the nameformatter class """
@@ -366,3 +605,60 @@ class TestNameFormatter(object):
  
 
 
+
+
+class TestCreateEntries(object):
+
+    def setUp(self):
+        from os.path import dirname, join as os_join
+        fhandle = _bibtex.open_file( os_join( dirname(__file__), "../test", BIBTEX_TEST_FILE ), 100 )
+        self.records = []
+        record = _bibtex.next( fhandle )
+        while record is not None:
+            self.records.append( record )
+            record = _bibtex.next( fhandle )
+
+    @staticmethod
+    def _create_legacy_entry(record):
+        """ the former construction of BibTexEntries (two cleanup passes and
+            eager author normalization) """
+        legacy_cleanup = lambda x: x.replace("{", "").replace("}", "").replace("\"", "")
+        native = dict( [ (field, _bibtex.get_native(value)) for field, value in record[4].iteritems() ] )
+        orig_entry = dict( [ (field, legacy_cleanup(value)) for field, value in native.iteritems() ] )
+        entry = dict( [ (field, legacy_cleanup(value)) for field, value in orig_entry.iteritems() ] )
+        macros = dict( [ (field, value) for field, value in native.iteritems() if [ p for p in split_value(value) if is_macro(p) ] ] )
+        if 'author' in entry:
+            entry['author'] = NameFormatter(entry['author']).getBibTexAuthors()
+        return entry, orig_entry, macros
+
+    def testCreateEntries(self):
+        """ tests whether bulk created entries equal individually created ones """
+        entries = create_entries( self.records, "lit.bib" )
+        assert [ b.key for b in entries ] == [ record[0] for record in self.records ]
+        for b, record in zip( entries, self.records ):
+            entry, orig_entry, macros = self._create_legacy_entry( record )
+            assert b.orig_entry == orig_entry and b.macros == macros and b.path == "lit.bib"
+            assert b.entry == entry == BibTexEntry( record ).entry
+        assert create_entries( [] ) == []
+
+    def testCleanup(self):
+        """ tests the cleanup of str and unicode values """
+        assert cleanup( 'M{\\"u}ller "x"' ) == 'M\\uller x'
+        assert cleanup( u'{Caf\xe9}' ) == u'Caf\xe9'
+
+
+
+def benchmark_create_entries( number=5 ):
+    """ microbenchmark: bulk construction vs. the former construction of
+        BibTexEntries (run this module as a script) """
+    from timeit import timeit
+    test = TestCreateEntries()
+    test.setUp()
+    records = test.records * 20
+    legacy = timeit( lambda: [ test._create_legacy_entry(record) for record in records ], number=number )
+    bulk   = timeit( lambda: create_entries( records ), number=number )
+    print "legacy: %.3fs, bulk: %.3fs (%.1fx)" % (legacy, bulk, legacy/bulk)
+
+
+if __name__ == '__main__':
+    benchmark_create_entries()
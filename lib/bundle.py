@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+""" exports the parsed bibtex corpus and its search indices into a single
+    bundle file which seeds the caches of other machines without parsing """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from os.path import abspath, basename, relpath, sep
+from cPickle import dumps, loads
+from zlib import compress, decompress
+
+from bibtex import set_path
+from cache import getCache, getValidator, writeAtomic, CACHE_VERSION
+from summary import BibSummary, SUMMARY_SUFFIX
+from ngram import NGramIndex, NGRAM_INDEX_SUFFIX
+
+# increase the version whenever the bundle's format changes
+BUNDLE_VERSION = 1
+BUNDLE_MAGIC   = "bibTexSuite-bundle"
+
+
+def get_relative_path( fname, base_dirs=() ):
+    """ returns fname relative to the first base directory containing it
+        (or the file's basename, if no base directory contains it) """
+    fname = abspath( fname )
+    for base_dir in base_dirs:
+        if fname.startswith( abspath(base_dir).rstrip(sep) + sep ):
+            return relpath( fname, abspath(base_dir) )
+    return basename( fname )
+
+
+def export_bundle( bundle_file, bibtex_files, get_entries, base_dirs=() ):
+    """ writes the entries, summaries and n-gram indices of the given bibtex
+        files to bundle_file
+        - files are stored under their path relative to base_dirs together
+          with their content hash (see cache.getValidator)
+        @param[in] get_entries  returns the bibtex entries of a file
+        @returns the number of exported files
+    """
+    files = {}
+    for fname in bibtex_files:
+        entries = get_entries( fname )
+        files[ get_relative_path(fname, base_dirs) ] = {
+            'validator': getValidator( fname, 'content' ),
+            'entries'  : entries,
+            'summary'  : BibSummary( entries ),
+            'ngram'    : NGramIndex( entries ) }
+
+    header = "%s %d %d\n" % (BUNDLE_MAGIC, BUNDLE_VERSION, CACHE_VERSION)
+    writeAtomic( bundle_file, header + compress( dumps(files, -1) ) )
+    return len(files)
+
+
+def read_bundle( bundle_file ):
+    """ returns a dictionary mapping relative paths to the bundled objects
+        @raises ValueError if the bundle has been created by an incompatible version
+    """
+    data = open( bundle_file, "rb" ).read()
+    header, payload = data.split( "\n", 1 )
+    try:
+        magic, bundle_version, cache_version = header.split( " " )
+        if magic != BUNDLE_MAGIC or int(bundle_version) != BUNDLE_VERSION or int(cache_version) != CACHE_VERSION:
+            raise ValueError
+    except ValueError:
+        raise ValueError( "'%s' is not a bundle or has been created by an incompatible version." % bundle_file )
+    return loads( decompress(payload) )
+
+
+def import_bundle( bundle_file, cachedir, bibtex_files ):
+    """ adds the bundled objects of all bibtex files whose content matches
+        a bundled file to the cache
+        - files are matched by their content hash, so the corpus may be
+          checked out at any location (imported entries refer to the local file)
+        - the key index is built from the imported summaries
+        @returns the number of imported files
+    """
+    bundled = dict( [ (record['validator'], record) for record in read_bundle( bundle_file ).itervalues() ] )
+    cache   = getCache( cachedir )
+    imported = 0
+    for fname in bibtex_files:
+        record = bundled.get( getValidator(fname, 'content') )
+        if record is None:
+            continue
+        # existing cache objects are kept; missing ones are taken from the bundle
+        cache.retrieve( fname, lambda f: set_path(record['entries'], f) )
+        cache.retrieve( fname, lambda f: record['summary'], SUMMARY_SUFFIX )
+        cache.retrieve( fname, lambda f: record['ngram'], NGRAM_INDEX_SUFFIX )
+        imported += 1
+    return imported
+
+
+
+class _Entry(object):
+    def __init__(self, key, text):
+        self.key, self.text, self.entry = key, text, {'title': text}
+    def getTextRepresentation(self):
+        return self.text
+
+
+class TestBundle(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from os import mkdir
+        from os.path import join
+        self.tmpdir = mkdtemp()
+        for d in ("a", "b"):
+            mkdir( join(self.tmpdir, d) )
+            open( join(self.tmpdir, d, "lit.bib"), "w" ).write( "@article{%s}" % d )
+        self.files  = [ join(self.tmpdir, "a", "lit.bib") ]
+        self.bundle = join( self.tmpdir, "corpus.bundle" )
+        self.cachedir = join( self.tmpdir, "cache" )
+
+    def tearDown(self):
+        from shutil import rmtree
+        from cache import _caches
+        _caches.pop( self.cachedir, None )
+        rmtree( self.tmpdir )
+
+    def _get_entries(self, fname):
+        return [ _Entry( basename(fname), "games with a purpose" ) ]
+
+    def _fail(self, fname):
+        assert False
+
+    def testRelativePath(self):
+        """ tests the computation of relative paths """
+        assert get_relative_path( "/data/lit/x/a.bib", ("/data/li", "/data/lit/") ) == "x/a.bib"
+        assert get_relative_path( "/data/lit/x/a.bib" ) == "a.bib"
+
+    def testExportImport(self):
+        """ tests whether imported files are available without parsing """
+        from os.path import join
+        from cache import cacheRetrieve
+        from summary import summaryRetrieve
+        assert export_bundle( self.bundle, self.files, self._get_entries, (self.tmpdir, ) ) == 1
+        assert read_bundle( self.bundle ).keys() == [ join("a", "lit.bib") ]
+
+        # only files with the bundled content are imported
+        files = [ join(self.tmpdir, d, "lit.bib") for d in ("a", "b") ]
+        assert import_bundle( self.bundle, self.cachedir, files ) == 1
+        assert cacheRetrieve( self.cachedir, files[0], self._fail )[0].key == "lit.bib"
+        assert cacheRetrieve( self.cachedir, files[0], self._fail )[0].path == files[0]
+        assert summaryRetrieve( self.cachedir, files[0], self._fail ).keys == [ "lit.bib" ]
@@ -3,49 +3,670 @@
 """ caches and restores data from the cache """
 
 # (C)opyrights 2008 by Albert Weichselbraun <albert@weichselbraun.net>
-# 
+#
 # This program is free software: you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
-# 
+#
 # This program is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
-# 
+#
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __revision__ = "$Revision$"
 
 import os
-from os.path import exists
-from cPickle import dump, load
+import atexit
+from thread import get_ident
+from threading import Lock
+from os.path import exists, join, dirname
+from cPickle import load, dumps, loads, UnpicklingError
 from hashlib import md5
-from stat import ST_MTIME
+from re import compile as re_compile
+from stat import ST_MTIME, ST_SIZE
+from tempfile import mkstemp
+from time import time
 from warnings import warn
+from zlib import crc32
+
+try:
+    from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+    flock = None
+
+from bibconfig import CACHE_BACKEND, CACHE_MAX_SIZE, CACHE_MAX_ENTRIES, CACHE_VALIDATION
+
+# increase the version whenever the format of cached objects changes
+CACHE_VERSION     = 5
+CACHE_MAGIC       = "bibTexSuite-cache"
+CACHE_INDEX_FILE  = "index"
+CACHE_LOCK_DIR    = "locks"
+SQLITE_CACHE_FILE = "cache.sqlite"
+RE_CACHE_FILE     = re_compile( "^[0-9a-f]{32}(\.\w+)?$" )
+TEMP_FILE_PREFIX  = ".tmp-"
+
+# errors indicating a missing or corrupted cache object
+LOAD_ERRORS = (IOError, EOFError, UnpicklingError, ValueError, TypeError, AttributeError, ImportError, IndexError)
+
+# mode of files created by open() (mkstemp creates files readable by the owner only)
+_umask = os.umask( 0 )
+os.umask( _umask )
+FILE_MODE = 0666 & ~_umask
+
+_caches = {}
+_caches_lock = Lock()
+_content_validators = {}
 
-def cacheRetrieve( cachedir, fname, fn ):
-    """ checks whether fname or cache_dir is newer
-        - retrieves the data from the cache if fname is not newer than the data in cachedir
-        - otherwise calls fn with fname """
 
-    if not exists(cachedir):
-        os.makedirs(cachedir) 
+def getCacheName( fname, suffix="" ):
+    """ returns the name of the cache object used for fname """
+    return md5(fname).hexdigest()+suffix
 
-    cacheFile = os.path.join( cachedir, md5(fname).hexdigest() )
+
+def getCacheFile( cachedir, fname, suffix="" ):
+    """ returns the name of the cache file used for fname """
+    return os.path.join( cachedir, getCacheName(fname, suffix) )
+
+
+def _get_mtime( fname ):
+    """ returns the mtime of fname or None if the file does not exist """
     try:
-        if os.stat(cacheFile)[ST_MTIME] >= os.stat(fname)[ST_MTIME]:
-            return load( open(cacheFile) )
+        return os.stat(fname)[ST_MTIME]
+    except OSError:
+        return None
 
-    except OSError,  FOFError:
-        pass
 
-    obj = fn(fname)
+def getValidator( fname, validation=CACHE_VALIDATION ):
+    """ returns a string identifying the current version of fname or None,
+        if fname does not exist
+        @param[in] validation  'mtime' (the file's modification time) or 'content'
+                               (the file's size and content hash, which do not
+                               change if the file is checked out or copied)
+    """
     try:
-        dump( obj, open(cacheFile, "w") )
-    except IOError:
-        warn("Cannot write cache file: '%s'" % cacheFile)
-    return obj
+        st = os.stat( fname )
+    except OSError:
+        return None
+    if validation == 'mtime':
+        return str( st[ST_MTIME] )
+
+    # every file is hashed only once per process and version
+    key = (fname, st[ST_SIZE], st[ST_MTIME])
+    if not key in _content_validators:
+        h, f = md5(), open( fname, "rb" )
+        for block in iter( lambda: f.read(1024*1024), "" ):
+            h.update( block )
+        f.close()
+        _content_validators[key] = "%d:%s" % (st[ST_SIZE], h.hexdigest())
+    return _content_validators[key]
+
+
+def getObjectName( fname, suffix="", validation=CACHE_VALIDATION, validator=None ):
+    """ returns the name of the cache object used for fname
+        - objects validated by content are named after the content, so that
+          caches remain valid if they are copied to other machines or paths
+    """
+    if validation == 'content':
+        return md5( validator or getValidator(fname, validation) ).hexdigest()+suffix
+    return getCacheName( fname, suffix )
+
+
+def writeAtomic( fname, data ):
+    """ writes data to a temporary file which is renamed to fname, so that
+        readers never see partially written files (e.g. published pages) """
+    fd, tmp_file = mkstemp( dir=dirname(fname) or ".", prefix=TEMP_FILE_PREFIX )
+    try:
+        os.chmod( tmp_file, FILE_MODE )
+        f = os.fdopen( fd, "wb" )
+        try:
+            f.write( data )
+        finally:
+            f.close()
+        os.rename( tmp_file, fname )
+    except:
+        os.remove( tmp_file )
+        raise
+
+
+def dumpAtomic( obj, fname ):
+    """ pickles obj into fname (see writeAtomic) """
+    writeAtomic( fname, dumps(obj, -1) )
+
+
+class FileLock(object):
+    """ an exclusive lock on fname (a no-op on platforms without fcntl) """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._file = None
+
+    def acquire(self):
+        """ @raises IOError if the lock file cannot be written """
+        self._file = open( self.fname, "a" )
+        if flock:
+            flock( self._file, LOCK_EX )
+
+    def release(self):
+        if flock:
+            flock( self._file, LOCK_UN )
+        self._file.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+
+class FileCache(object):
+    """ stores every cached object in its own pickle file
+        - cache files start with a header line containing the cache version,
+          the source file's validator (see getValidator) and a checksum of the
+          pickled object; they
+          are written atomically and objects are computed under a per-object
+          lock, so that concurrent processes never read partial files and do
+          not compute the same object twice
+        - an index file records the source files (all copies of a file share
+          the object if it is validated by content), their validator, the
+          object's size and its last access for every cached object
+        - the least recently used objects are evicted once the cache exceeds
+          max_size bytes or max_entries objects
+    """
+
+    def __init__(self, cachedir, max_size=CACHE_MAX_SIZE, max_entries=CACHE_MAX_ENTRIES, validation=CACHE_VALIDATION):
+        self.cachedir    = cachedir
+        self.validation  = validation
+        self.index_file  = join( cachedir, CACHE_INDEX_FILE )
+        self.lock_dir    = join( cachedir, CACHE_LOCK_DIR )
+        self.max_size    = max_size
+        self.max_entries = max_entries
+        self.index       = self._read_index()   # name -> [sources, validator, size, atime]
+        self._touched    = set()
+
+
+    def _read_index(self):
+        try:
+            index = load( open(self.index_file, "rb") )
+        except LOAD_ERRORS:
+            return {}
+        # indices of earlier versions record a single source file
+        for entry in index.itervalues():
+            if isinstance( entry[0], basestring ):
+                entry[0] = [ entry[0] ]
+        return index
+
+
+    def _get_lock(self, name):
+        """ returns the lock of the object name (the lock directory is created on demand)
+            @raises OSError if the lock directory cannot be created """
+        if not exists( self.lock_dir ):
+            try:
+                os.makedirs( self.lock_dir )
+            except OSError:
+                # another process might have created it in the meantime
+                if not exists( self.lock_dir ):
+                    raise
+        return FileLock( join(self.lock_dir, name) )
+
+
+    def _get_validator(self, fname):
+        return getValidator( fname, self.validation )
+
+
+    def _get_sources(self, name, fname):
+        """ returns the source files of the object name including fname """
+        sources = self.index[name][0] if name in self.index else []
+        return sources if fname in sources else sources + [ fname ]
+
+
+    def _get_valid_sources(self, entry):
+        """ returns the source files of the index entry which are still valid """
+        return [ source for source in entry[0] if self._get_validator(source) == entry[1] ]
+
+
+    def _load(self, name, validator):
+        """ returns the pickled object and its size
+            @raises LOAD_ERRORS if the cache file is missing, corrupted or outdated """
+        data = open( join(self.cachedir, name), "rb" ).read()
+        header, payload = data.split( "\n", 1 )
+        magic, version, file_validator, checksum = header.split( " " )
+        if magic != CACHE_MAGIC or int(version) != CACHE_VERSION or file_validator != validator:
+            raise ValueError( "Outdated cache file '%s'." % name )
+        if int( checksum, 16 ) != crc32(payload) & 0xffffffff:
+            raise ValueError( "Corrupted cache file '%s'." % name )
+        return loads( payload ), len(data)
+
+
+    def _store(self, name, obj, validator):
+        """ stores obj and returns the size of its cache file """
+        payload = dumps( obj, -1 )
+        data = "%s %d %s %08x\n%s" % (CACHE_MAGIC, CACHE_VERSION, validator, crc32(payload) & 0xffffffff, payload)
+        writeAtomic( join(self.cachedir, name), data )
+        return len(data)
+
+
+    def _remove(self, name):
+        """ removes the cache file and the lock file of the object name """
+        for fname in ( join(self.cachedir, name), join(self.lock_dir, name) ):
+            try:
+                os.remove( fname )
+            except OSError:
+                pass
+
+
+    def _lookup(self, name, fname, validator):
+        """ returns a tuple (obj, ) with the cached object or None, if it is not available """
+        try:
+            obj, size = self._load( name, validator )
+        except LOAD_ERRORS:
+            return None
+        self.index[name] = [self._get_sources(name, fname), validator, size, time()]
+        self._touched.add( name )
+        return (obj, )
+
+
+    def retrieve(self, fname, fn, suffix=""):
+        """ returns the cached object for fname or calls fn with fname, if
+            fname has been modified since the object has been cached """
+        validator = self._get_validator( fname )
+        if validator is None:
+            return fn(fname)
+        name = getObjectName( fname, suffix, self.validation, validator )
+
+        cached = self._lookup( name, fname, validator )
+        if cached:
+            return cached[0]
+
+        try:
+            lock = self._get_lock( name )
+            lock.acquire()
+        except (IOError, OSError):
+            # e.g. read-only cache directories
+            warn("Cannot lock cache file: '%s'" % join(self.lock_dir, name))
+            return fn(fname)
+
+        try:
+            # another process might have created the object in the meantime
+            cached = self._lookup( name, fname, validator )
+            if cached:
+                return cached[0]
+
+            obj = fn(fname)
+            try:
+                self.index[name] = [self._get_sources(name, fname), validator, self._store(name, obj, validator), time()]
+                self._touched.add( name )
+            except (IOError, OSError):
+                warn("Cannot write cache file: '%s'" % join(self.cachedir, name))
+            return obj
+        finally:
+            lock.release()
+
+
+    def _evict(self, index):
+        """ removes the least recently used objects until the cache fits its budget
+            @returns the number of removed objects """
+        size, removed = sum( [ e[2] for e in index.itervalues() ] ), 0
+        for name, entry in sorted( index.items(), key=lambda x: x[1][3] ):
+            if size <= self.max_size and len(index) <= self.max_entries:
+                break
+            self._remove( name )
+            del index[name]
+            size -= entry[2]
+            removed += 1
+        return removed
+
+
+    def flush(self):
+        """ merges the accessed objects into the index file and evicts objects
+            exceeding the cache's budget """
+        if not self._touched:
+            return
+
+        # merge with changes of concurrent processes
+        with self._get_lock( CACHE_INDEX_FILE ):
+            index = self._read_index()
+            for name in list( self._touched ):
+                if name in self.index:
+                    entry = list( self.index[name] )
+                    if name in index and index[name][1] == entry[1]:
+                        entry[0] = entry[0] + [ source for source in index[name][0] if not source in entry[0] ]
+                    index[name] = entry
+            self._evict( index )
+            try:
+                dumpAtomic( index, self.index_file )
+            except (IOError, OSError):
+                warn("Cannot write cache index: '%s'" % self.index_file)
+        self.index, self._touched = index, set()
+
+
+    def getStatistics(self):
+        """ returns a dictionary with statistics on the cache """
+        orphans = [ name for name in os.listdir(self.cachedir) if RE_CACHE_FILE.match(name) and not name in self.index ]
+        stale   = [ name for name, entry in self.index.iteritems() if not self._get_valid_sources(entry) ]
+        return { 'backend': 'file',
+                 'entries': len(self.index),
+                 'size'   : sum( [ e[2] for e in self.index.itervalues() ] ),
+                 'stale'  : len(stale),
+                 'orphans': len(orphans) }
+
+
+    def prune(self):
+        """ removes stale objects (whose source files have all been changed or
+            removed), orphaned cache files and objects exceeding the cache's budget
+            @returns the number of removed objects
+        """
+        with self._get_lock( CACHE_INDEX_FILE ):
+            index = self._read_index()
+            index.update( self.index )
+            removed = 0
+            for name, entry in index.items():
+                entry[0] = self._get_valid_sources( entry )
+                if not entry[0]:
+                    self._remove( name )
+                    del index[name]
+                    removed += 1
+
+            for name in os.listdir( self.cachedir ):
+                if RE_CACHE_FILE.match(name) and not name in index:
+                    self._remove( name )
+                    removed += 1
+                # temporary files left behind by killed processes
+                elif name.startswith( TEMP_FILE_PREFIX ) and _get_mtime( join(self.cachedir, name) ) < time()-3600:
+                    self._remove( name )
+
+            # lock files of objects which are no longer cached
+            for name in os.listdir( self.lock_dir ) if exists( self.lock_dir ) else ():
+                if RE_CACHE_FILE.match(name) and not name in index and _get_mtime( join(self.lock_dir, name) ) < time()-3600:
+                    self._remove( name )
+
+            removed += self._evict( index )
+            dumpAtomic( index, self.index_file )
+        self.index, self._touched = index, set()
+        return removed
+
+
+
+class SqliteCache(object):
+    """ stores all cached objects in a single sqlite database
+        - sqlite provides atomic writes and locking
+        - every process and thread uses its own connection
+        - the least recently used objects are evicted once the cache exceeds
+          max_size bytes or max_entries objects
+    """
+
+    def __init__(self, cachedir, max_size=CACHE_MAX_SIZE, max_entries=CACHE_MAX_ENTRIES, validation=CACHE_VALIDATION):
+        self.db_file     = join( cachedir, SQLITE_CACHE_FILE )
+        self.validation  = validation
+        self.max_size    = max_size
+        self.max_entries = max_entries
+        self._connections = {}    # (pid, thread) -> connection
+        self._accessed    = {}
+
+
+    def _get_db(self):
+        """ returns the database connection (connections are neither shared
+            with forked processes nor with other threads) """
+        connection_id = (os.getpid(), get_ident())
+        if not connection_id in self._connections:
+            import sqlite3
+            db = sqlite3.connect( self.db_file, timeout=60 )
+            db.text_factory = str
+            if db.execute( "PRAGMA user_version" ).fetchone()[0] != CACHE_VERSION:
+                db.execute( "DROP TABLE IF EXISTS cache" )
+                db.execute( "PRAGMA user_version=%d" % CACHE_VERSION )
+            db.execute( "CREATE TABLE IF NOT EXISTS cache (name TEXT PRIMARY KEY, source TEXT, validator TEXT, size INTEGER, atime REAL, data BLOB)" )
+            db.commit()
+            self._connections[connection_id] = db
+        return self._connections[connection_id]
+
+
+    def retrieve(self, fname, fn, suffix=""):
+        """ returns the cached object for fname or calls fn with fname, if
+            fname has been modified since the object has been cached """
+        from sqlite3 import Binary
+        validator = getValidator( fname, self.validation )
+        if validator is None:
+            return fn(fname)
+        name = getObjectName( fname, suffix, self.validation, validator )
+        db   = self._get_db()
+        row  = db.execute( "SELECT validator, data, source FROM cache WHERE name=?", (name, ) ).fetchone()
+        if row is not None and row[0] == validator:
+            try:
+                obj = loads( str(row[1]) )
+                self._accessed[name] = time()
+                # sources are stored as a newline separated list
+                if not fname in row[2].split("\n"):
+                    db.execute( "UPDATE cache SET source=? WHERE name=?", (row[2] + "\n" + fname, name) )
+                    db.commit()
+                return obj
+            except LOAD_ERRORS:
+                pass
+
+        obj  = fn(fname)
+        data = dumps( obj, -1 )
+        db.execute( "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)", (name, fname, validator, len(data), time(), Binary(data)) )
+        db.commit()
+        return obj
+
+
+    def _get_valid_sources(self, sources, validator):
+        """ returns the (newline separated) sources which are still valid """
+        return [ source for source in sources.split("\n") if getValidator(source, self.validation) == validator ]
+
+
+    def _evict(self):
+        """ removes the least recently used objects until the cache fits its budget
+            @returns the number of removed objects """
+        db = self._get_db()
+        removed, (entries, size) = 0, db.execute( "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache" ).fetchone()
+        for name, obj_size in db.execute( "SELECT name, size FROM cache ORDER BY atime" ).fetchall():
+            if size <= self.max_size and entries <= self.max_entries:
+                break
+            db.execute( "DELETE FROM cache WHERE name=?", (name, ) )
+            size, entries, removed = size-obj_size, entries-1, removed+1
+        db.commit()
+        return removed
+
+
+    def flush(self):
+        """ records the last access of all retrieved objects and evicts objects
+            exceeding the cache's budget """
+        if not self._connections:
+            return
+        db = self._get_db()
+        db.executemany( "UPDATE cache SET atime=? WHERE name=?", [ (atime, name) for name, atime in self._accessed.iteritems() ] )
+        db.commit()
+        self._accessed = {}
+        self._evict()
+
+
+    def getStatistics(self):
+        """ returns a dictionary with statistics on the cache """
+        db = self._get_db()
+        entries, size = db.execute( "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache" ).fetchone()
+        stale = [ name for name, sources, validator in db.execute( "SELECT name, source, validator FROM cache" ) if not self._get_valid_sources(sources, validator) ]
+        return { 'backend': 'sqlite', 'entries': entries, 'size': size, 'stale': len(stale), 'orphans': 0 }
+
+
+    def prune(self):
+        """ removes stale objects (whose source files have all been changed or
+            removed) and objects exceeding the cache's budget
+            @returns the number of removed objects
+        """
+        db = self._get_db()
+        stale = []
+        for name, sources, validator in db.execute( "SELECT name, source, validator FROM cache" ).fetchall():
+            valid_sources = self._get_valid_sources( sources, validator )
+            if not valid_sources:
+                stale.append( (name, ) )
+            elif len( valid_sources ) < len( sources.split("\n") ):
+                db.execute( "UPDATE cache SET source=? WHERE name=?", ("\n".join(valid_sources), name) )
+        db.executemany( "DELETE FROM cache WHERE name=?", stale )
+        db.commit()
+        removed = len(stale) + self._evict()
+        db.execute( "VACUUM" )
+        return removed
+
+
+CACHE_BACKENDS = { 'file': FileCache, 'sqlite': SqliteCache }
+
+
+def getCache( cachedir ):
+    """ returns the cache used for cachedir
+        - the backend, the cache's budget and the validation mode are configured
+          in cacheconfig.py (CACHE_BACKEND, CACHE_MAX_SIZE, CACHE_MAX_ENTRIES,
+          CACHE_VALIDATION); missing settings default to the values in bibconfig
+    """
+    # caches are shared by all threads
+    with _caches_lock:
+        if not cachedir in _caches:
+            try:
+                import cacheconfig
+            except ImportError:
+                cacheconfig = None
+
+            if not exists(cachedir):
+                os.makedirs(cachedir)
+            backend = CACHE_BACKENDS[ getattr(cacheconfig, 'CACHE_BACKEND', CACHE_BACKEND) ]
+            _caches[cachedir] = backend( cachedir,
+                                         getattr(cacheconfig, 'CACHE_MAX_SIZE', CACHE_MAX_SIZE),
+                                         getattr(cacheconfig, 'CACHE_MAX_ENTRIES', CACHE_MAX_ENTRIES),
+                                         getattr(cacheconfig, 'CACHE_VALIDATION', CACHE_VALIDATION) )
+        return _caches[cachedir]
+
+
+def flushCaches():
+    """ writes the changes of all caches """
+    for cachedir, cache in _caches.iteritems():
+        try:
+            cache.flush()
+        except (IOError, OSError), e:
+            warn("Cannot update the cache '%s': %s" % (cachedir, e))
+
+atexit.register( flushCaches )
+
+
+def cacheRetrieve( cachedir, fname, fn, suffix="" ):
+    """ checks whether fname or cache_dir is newer
+        - retrieves the data from the cache if fname is not newer than the data in cachedir
+        - otherwise calls fn with fname
+        @param[in] suffix  (optional suffix distinguishing different data derived from fname) """
+    return getCache( cachedir ).retrieve( fname, fn, suffix )
+
+
+
+class TestCache(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.source = join( self.tmpdir, "source.bib" )
+        open( self.source, "w" ).write( "data" )
+        self.calls  = []
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def _fn(self, fname):
+        self.calls.append( fname )
+        return open(fname).read()
+
+    def _check_backend(self, backend):
+        cachedir = join( self.tmpdir, backend )
+        os.mkdir( cachedir )
+        cache = CACHE_BACKENDS[backend]( cachedir, max_size=1000, max_entries=2 )
+        assert cache.retrieve( self.source, self._fn ) == "data"
+        assert cache.retrieve( self.source, self._fn ) == "data"
+        assert len(self.calls) == 1
+
+        # the index survives new instances
+        cache.flush()
+        cache = CACHE_BACKENDS[backend]( cachedir, max_size=1000, max_entries=2 )
+        assert cache.retrieve( self.source, self._fn ) == "data"
+        assert len(self.calls) == 1
+
+        # lru eviction
+        for suffix in (".a", ".b", ".c"):
+            cache.retrieve( self.source, self._fn, suffix )
+        cache.flush()
+        assert cache.getStatistics()['entries'] == 2
+
+        # pruning of stale entries
+        os.remove( self.source )
+        assert cache.getStatistics()['stale'] == 2
+        assert cache.prune() == 2
+        assert cache.getStatistics()['entries'] == 0
+        if backend == 'file':
+            # lock files are removed together with their objects
+            assert os.listdir( cache.lock_dir ) == [ CACHE_INDEX_FILE ]
+
+    def testFileCache(self):
+        """ tests the file backend """
+        self._check_backend( 'file' )
+
+    def testSqliteCache(self):
+        """ tests the sqlite backend """
+        self._check_backend( 'sqlite' )
+
+    def testContentValidation(self):
+        """ tests whether objects validated by content survive mtime changes and copies """
+        cachedir = join( self.tmpdir, "file" )
+        os.mkdir( cachedir )
+        cache = FileCache( cachedir, validation='content' )
+        cache.retrieve( self.source, self._fn )
+        os.utime( self.source, (0, 0) )
+        copy = join( self.tmpdir, "copy.bib" )
+        open( copy, "w" ).write( "data" )
+        assert cache.retrieve( self.source, self._fn ) == "data"
+        assert cache.retrieve( copy, self._fn ) == "data"
+        assert len(self.calls) == 1
+
+        # the object is kept as long as one of its sources is unchanged
+        open( self.source, "w" ).write( "new data" )
+        assert cache.retrieve( self.source, self._fn ) == "new data"
+        assert len(self.calls) == 2
+        cache.flush()
+        assert cache.getStatistics()['stale'] == 0
+        assert cache.prune() == 0
+        assert cache.retrieve( copy, self._fn ) == "data"
+        assert len(self.calls) == 2
+
+    def testWriteAtomic(self):
+        """ tests whether atomically written files get the default mode """
+        from stat import S_IMODE
+        fname = join( self.tmpdir, "page.html" )
+        writeAtomic( fname, "<html>" )
+        assert open( fname ).read() == "<html>"
+        assert S_IMODE( os.stat(fname).st_mode ) == FILE_MODE
+
+    def testCorruptedCacheFile(self):
+        """ tests whether truncated cache files are detected """
+        cachedir = join( self.tmpdir, "file" )
+        os.mkdir( cachedir )
+        cache = FileCache( cachedir )
+        cache.retrieve( self.source, self._fn )
+        cacheFile = join( cachedir, getCacheName(self.source) )
+        data = open( cacheFile ).read()
+        open( cacheFile, "w" ).write( data[:-2] )
+        assert FileCache( cachedir ).retrieve( self.source, self._fn ) == "data"
+        assert len(self.calls) == 2
 
+    def testUnlockableCache(self):
+        """ tests whether objects are computed (with a warning) if they cannot be locked """
+        from warnings import catch_warnings, simplefilter
+        cachedir = join( self.tmpdir, "file" )
+        os.mkdir( cachedir )
+        cache = FileCache( cachedir )
+        # lock files cannot be created below a regular file
+        open( cache.lock_dir, "w" ).close()
+        with catch_warnings( record=True ) as warnings:
+            simplefilter( "always" )
+            assert cache.retrieve( self.source, self._fn ) == "data"
+        assert len(self.calls) == 1 and "Cannot lock" in str( warnings[0].message )
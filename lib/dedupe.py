@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+""" detects duplicate bibtex entries (i.e. the same publication stored
+    under different keys) across bibtex files """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+
+from bibtex import NameFormatter, normalize, get_number
+
+# titles with fewer words are only merged if they are identical
+MIN_PREFIX_WORDS = 4
+
+
+def get_fingerprint( bibtex_entry ):
+    """ returns the normalized fingerprint (title, year, first author's lastname, type)
+        of the given entry or None, if the entry has no title
+        (the type keeps e.g. talks apart from the corresponding papers) """
+    entry = bibtex_entry.entry
+    title = normalize( entry.get('title', '') )
+    if not title:
+        return None
+
+    names = entry.get('author', '') or entry.get('editor', '')
+    lastname = normalize( NameFormatter(names).getFirstAuthorLastname() ) if names.strip() else ''
+    return ( title, get_number( entry.get('year', '') ), lastname, bibtex_entry.type.lower() )
+
+
+def _is_same_title( t1, t2 ):
+    """ returns true if both titles are equal or one title extends the other one
+        (e.g. by a subtitle) """
+    if t1 == t2:
+        return True
+    shorter, longer = sorted( (t1, t2), key=len )
+    return len( shorter.split() ) >= MIN_PREFIX_WORDS and longer.startswith( shorter+" " )
+
+
+def find_duplicates( bibtex_entries ):
+    """ returns a list of clusters (lists of at least two entries) describing
+        the same publication
+        - entries are blocked by (year, first author's lastname, type) and identical
+          titles are hashed, so only entries within a block with different
+          titles are compared with each other
+    """
+    blocks = defaultdict( lambda: defaultdict(list) )
+    for pos, b in enumerate( bibtex_entries ):
+        fingerprint = get_fingerprint( b )
+        if fingerprint is None:
+            continue
+        blocks[ fingerprint[1:] ][ fingerprint[0] ].append( pos )
+
+    clusters = []
+    for titles in blocks.itervalues():
+        groups = titles.values()
+        if len(groups) > 1:
+            groups = _merge_groups( titles )
+        clusters.extend( [ sorted(g) for g in groups if len(g) > 1 ] )
+
+    return [ [ bibtex_entries[pos] for pos in cluster ] for cluster in sorted(clusters) ]
+
+
+def _merge_groups( titles ):
+    """ merges the title groups of a block whose titles refer to the same publication """
+    parent = dict( [ (t, t) for t in titles ] )
+
+    def find( t ):
+        while parent[t] != t:
+            t = parent[t]
+        return t
+
+    keys = sorted( titles, key=len )
+    for i, t1 in enumerate( keys ):
+        for t2 in keys[i+1:]:
+            if _is_same_title( t1, t2 ):
+                parent[ find(t2) ] = find(t1)
+
+    groups = defaultdict( list )
+    for t, positions in titles.iteritems():
+        groups[ find(t) ].extend( positions )
+    return groups.values()
+
+
+def dedupe( bibtex_entries ):
+    """ removes duplicates from the given list of bibtex entries
+        - the most complete entry of every cluster is kept at the position of
+          the cluster's first entry
+        @returns the list of unique entries
+    """
+    keep, drop = {}, set()
+    for cluster in find_duplicates( bibtex_entries ):
+        keep[ id(cluster[0]) ] = max( cluster, key=lambda b: (len(b.entry), -cluster.index(b)) )
+        drop.update( [ id(b) for b in cluster[1:] ] )
+
+    return [ keep.get( id(b), b ) for b in bibtex_entries if id(b) not in drop ]
+
+
+
+class TestDedupe(object):
+
+    class Entry(object):
+        def __init__(self, key, type='article', **entry):
+            self.key, self.type, self.entry = key, type, entry
+
+    ENTRIES = ( Entry('scharl2012', title='Leveraging the {W}isdom of the Crowds', author='Arno Scharl and Albert Weichselbraun', year='2012'),
+                Entry('scharl12', title='Leveraging the wisdom of the crowds: a case study', author='Scharl, Arno', year='2012', note='x'),
+                Entry('scharl2011', title='Leveraging the Wisdom of the Crowds', author='Arno Scharl', year='2011'),
+                Entry('mueller2010', title='On Search', author='M{\\"u}ller, Hans', year='2010'),
+                Entry('muller2010', title='On search.', author='Hans Muller', year='2010'),
+                Entry('muller2010b', title='On search engines', author='Hans Muller', year='2010'),
+                Entry('notitle', author='Hans Muller', year='2010'),
+                Entry('muller2010t', 'unpublished', title='On search', author='Hans Muller', year='2010'), )
+
+    def testGetFingerprint(self):
+        """ tests the normalization of fingerprints """
+        assert get_fingerprint( self.ENTRIES[3] ) == ('on search', 2010, 'muller', 'article')
+        assert get_fingerprint( self.ENTRIES[3] ) == get_fingerprint( self.ENTRIES[4] )
+        assert get_fingerprint( self.ENTRIES[6] ) is None
+
+    def testFindDuplicates(self):
+        """ tests the clustering of duplicates """
+        clusters = [ [ b.key for b in c ] for c in find_duplicates( self.ENTRIES ) ]
+        assert clusters == [ ['scharl2012', 'scharl12'], ['mueller2010', 'muller2010'] ]
+
+    def testDedupe(self):
+        """ tests whether the most complete entry is kept """
+        keys = [ b.key for b in dedupe( self.ENTRIES ) ]
+        assert keys == ['scharl12', 'scharl2011', 'mueller2010', 'muller2010b', 'notitle', 'muller2010t']
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+""" sorts more items than fit into memory
+    - items are sorted in runs of a fixed size which are spilled to temporary
+      files and merged (heapq.merge) when the items are read """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from cPickle import dump, load
+from heapq import merge
+from tempfile import TemporaryFile
+
+DEFAULT_RUN_SIZE = 10000    # number of items sorted in memory
+
+
+def _read_run( f ):
+    """ yields the records of a spilled run """
+    f.seek( 0 )
+    while True:
+        try:
+            yield load( f )
+        except EOFError:
+            return
+
+
+class ExternalSorter(object):
+    """ a stable sort of arbitrarily many items in bounded memory
+        - at most run_size items are kept in memory while adding items; reading
+          the sorted items keeps one item per run in memory
+        - items need to be picklable
+    """
+
+    def __init__(self, key, run_size=DEFAULT_RUN_SIZE, tmpdir=None):
+        """ @param[in] key       function returning the sort key of an item
+            @param[in] run_size  number of items per run
+            @param[in] tmpdir    (optional) directory of the temporary files
+        """
+        self.key      = key
+        self.run_size = max( run_size, 1 )
+        self.tmpdir   = tmpdir
+        self._buffer  = []
+        self._runs    = []
+        self._count   = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    def add(self, item):
+        """ adds an item to the sorter """
+        # the sequence number keeps the sort stable and items are never compared
+        self._buffer.append( (self.key(item), self._count, item) )
+        self._count += 1
+        if len( self._buffer ) >= self.run_size:
+            self._spill()
+
+
+    def _spill(self):
+        """ writes the sorted buffer to a temporary file """
+        self._buffer.sort()
+        f = TemporaryFile( dir=self.tmpdir )
+        for record in self._buffer:
+            dump( record, f, -1 )
+        self._runs.append( f )
+        self._buffer = []
+
+
+    def __iter__(self):
+        """ yields the items in sorted order """
+        self._buffer.sort()
+        runs = [ _read_run(f) for f in self._runs ] + [ iter(self._buffer) ]
+        for _, _, item in merge( *runs ):
+            yield item
+
+
+    def close(self):
+        """ removes the temporary files """
+        for f in self._runs:
+            f.close()
+        self._runs, self._buffer = [], []
+
+
+
+class TestExternalSorter(object):
+
+    def testSort(self):
+        """ tests the sort with multiple runs """
+        from random import Random
+        items = [ (Random(i).randint(0, 50), i) for i in xrange(1000) ]
+        for run_size in (1, 7, 1000, 5000):
+            sorter = ExternalSorter( lambda item: item[0], run_size )
+            for item in items:
+                sorter.add( item )
+            assert len( sorter ) == 1000
+            # stable (items with equal keys keep their order)
+            assert list( sorter ) == sorted( items, key=lambda item: item[0] )
+            sorter.close()
+
+    def testEmpty(self):
+        """ tests sorting no items """
+        assert list( ExternalSorter( lambda item: item ) ) == []
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+""" maps bibtex keys to the file and position of their entries """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import join, exists
+from cPickle import load
+from collections import defaultdict
+from stat import ST_MTIME
+from warnings import warn
+
+from cache import dumpAtomic, LOAD_ERRORS
+
+KEY_INDEX_FILE = "keyindex"
+
+
+class KeyIndex(object):
+    """ maps bibtex keys to (file, position) tuples
+        - the index is built from the keys stored in the files' summaries, so
+          only files containing requested keys need to be loaded
+        - the first file listing a key wins
+    """
+
+    def __init__(self, bibtex_files, get_summary, file_keys=None):
+        """ @param[in] bibtex_files  the bibtex files to index
+            @param[in] get_summary   function returning the summary of a bibtex file
+            @param[in] file_keys     (optional dictionary fname -> (mtime, keys) of a
+                                     previous index; only changed files are reread)
+        """
+        self.file_keys = file_keys if file_keys is not None else {}
+        self.modified  = False
+        self.index     = {}
+        for fname in bibtex_files:
+            for pos, key in enumerate( self._get_keys(fname, get_summary) ):
+                self.index.setdefault( key, (fname, pos) )
+
+
+    def _get_keys(self, fname, get_summary):
+        """ returns the keys of the given file (reusing the keys of unchanged files) """
+        mtime = os.stat( fname )[ST_MTIME]
+        if fname in self.file_keys and self.file_keys[fname][0] == mtime:
+            return self.file_keys[fname][1]
+
+        keys = get_summary( fname ).keys
+        self.file_keys[fname] = (mtime, keys)
+        self.modified = True
+        return keys
+
+
+    def __contains__(self, key):
+        return key in self.index
+
+
+    def getEntries(self, keys, get_entries):
+        """ returns the entries for the given keys
+            @param[in] keys         the requested bibtex keys
+            @param[in] get_entries  function returning the (cached) entries of a bibtex file
+            @returns a tuple (entries, missing_keys); entries are returned in the order of keys
+        """
+        per_file = defaultdict( list )
+        for key in keys:
+            if key in self.index:
+                fname, pos = self.index[key]
+                per_file[fname].append( (key, pos) )
+
+        found = {}
+        for fname, positions in per_file.iteritems():
+            bibtex_entries = get_entries( fname )
+            for key, pos in positions:
+                found[key] = bibtex_entries[pos]
+
+        return [ found[key] for key in keys if key in found ], [ key for key in keys if not key in found ]
+
+
+
+def keyIndexRetrieve( cachedir, bibtex_files, get_summary ):
+    """ returns the key index of the given bibtex files
+        - the index is stored in cachedir and only updated for changed files
+    """
+    index_file = join( cachedir, KEY_INDEX_FILE )
+    try:
+        file_keys = load( open(index_file) )
+    except LOAD_ERRORS:
+        file_keys = {}
+
+    key_index = KeyIndex( bibtex_files, get_summary, file_keys )
+    if key_index.modified:
+        try:
+            if not exists( cachedir ):
+                os.makedirs( cachedir )
+            dumpAtomic( key_index.file_keys, index_file )
+        except (IOError, OSError):
+            warn("Cannot write key index: '%s'" % index_file)
+    return key_index
+
+
+
+class TestKeyIndex(object):
+
+    class Summary(object):
+        def __init__(self, keys):
+            self.keys = keys
+
+    FILES = { 'a.bib': ['k1', 'k2'], 'b.bib': ['k3', 'k1'] }
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.files  = [ join(self.tmpdir, fname) for fname in sorted(self.FILES) ]
+        for fname in self.files:
+            open( fname, "w" ).close()
+
+        self.loaded = []
+        self.index  = KeyIndex( self.files, self._get_summary )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def _get_summary(self, fname):
+        return self.Summary( self.FILES[ os.path.basename(fname) ] )
+
+    def _get_entries(self, fname):
+        fname = os.path.basename( fname )
+        self.loaded.append( fname )
+        return [ "%s:%s" % (fname, key) for key in self.FILES[fname] ]
+
+    def testGetEntries(self):
+        """ tests the retrieval of entries by key """
+        entries, missing = self.index.getEntries( ['k3', 'k1', 'x'], self._get_entries )
+        assert entries == ['b.bib:k3', 'a.bib:k1']
+        assert missing == ['x']
+        assert sorted( self.loaded ) == ['a.bib', 'b.bib']
+
+    def testLoadOnlyRequiredFiles(self):
+        """ tests whether only files containing requested keys are loaded """
+        self.index.getEntries( ['k2'], self._get_entries )
+        assert self.loaded == ['a.bib']
+
+    def testKeyIndexRetrieve(self):
+        """ tests whether the persistent index only rereads changed files """
+        keyIndexRetrieve( self.tmpdir, self.files, self._get_summary )
+        key_index = keyIndexRetrieve( self.tmpdir, self.files, lambda fname: None )
+        assert not key_index.modified
+        assert key_index.index['k1'] == (self.files[0], 0)
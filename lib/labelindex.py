@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+""" indexes the label definitions and references of a latex project """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from re import compile as re_compile
+from os.path import abspath, exists
+from collections import defaultdict
+
+from cache import cacheRetrieve
+from latex import get_tex_file_name, RE_LABEL
+
+RE_REF     = re_compile( r"\\(?:ref|eqref|pageref|autoref|nameref|vref|cref|Cref)\*?\{([^}]+)\}" )
+RE_INCLUDE = re_compile( r"\\(?:input|include)\{([^}]+)\}" )
+RE_COMMENT = re_compile( r"(?<!\\)%.*" )
+
+LABEL_SCAN_SUFFIX = ".labelscan"
+
+
+def scan_labels( fname ):
+    """ scans a latex file for label definitions, references and included files
+        @returns a tuple (labels, refs, includes); labels and refs are lists
+                 of (name, line number) tuples
+    """
+    labels, refs, includes = [], [], []
+    for lineno, line in enumerate( open(fname) ):
+        line = RE_COMMENT.sub( "", line )
+        labels.extend( [ (label, lineno+1) for label in RE_LABEL.findall(line) ] )
+        for ref in RE_REF.findall(line):
+            refs.extend( [ (r.strip(), lineno+1) for r in ref.split(",") ] )
+        includes.extend( RE_INCLUDE.findall(line) )
+    return labels, refs, includes
+
+
+class LabelIndex(object):
+    """ the label definitions and references of a latex document and all
+        the files it includes (with their file:line positions) """
+
+    def __init__(self, document, cachedir=None):
+        """ @param[in] document  the main latex document
+            @param[in] cachedir  (optional directory caching the scans of unchanged files)
+        """
+        self.cachedir = cachedir
+        self.files    = []
+        self.labels   = defaultdict( list )
+        self.refs     = defaultdict( list )
+        self._add_file( document )
+
+
+    def _scan(self, fname):
+        """ returns the (cached) scan of the given file """
+        if self.cachedir:
+            return cacheRetrieve( self.cachedir, abspath(fname), scan_labels, LABEL_SCAN_SUFFIX )
+        return scan_labels( fname )
+
+
+    def _add_file(self, fname):
+        """ adds fname and the files it includes to the index """
+        pending, seen = [ fname ], set( self.files )
+        while pending:
+            fname = get_tex_file_name( pending.pop() )
+            if fname in seen or not exists( fname ):
+                continue
+            seen.add( fname )
+            self.files.append( fname )
+
+            labels, refs, includes = self._scan( fname )
+            for label, lineno in labels:
+                self.labels[label].append( (fname, lineno) )
+            for ref, lineno in refs:
+                self.refs[ref].append( (fname, lineno) )
+            pending.extend( reversed(includes) )
+
+
+    def getUnusedLabels(self):
+        """ returns a sorted list of (label, positions) for labels which are never referenced """
+        return sorted( [ (label, pos) for label, pos in self.labels.iteritems() if not label in self.refs ] )
+
+
+    def getDanglingRefs(self):
+        """ returns a sorted list of (ref, positions) for references to undefined labels """
+        return sorted( [ (ref, pos) for ref, pos in self.refs.iteritems() if not ref in self.labels ] )
+
+
+    def getDuplicateLabels(self):
+        """ returns a sorted list of (label, positions) for labels defined more than once """
+        return sorted( [ (label, pos) for label, pos in self.labels.iteritems() if len(pos) > 1 ] )
+
+
+
+class TestLabelIndex(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from os.path import join
+        self.tmpdir   = mkdtemp()
+        self.document = join( self.tmpdir, "main.tex" )
+        self.chapter  = join( self.tmpdir, "chapter.tex" )
+        open( self.document, "w" ).write( "\\label{sec:intro}\n\\include{%s}\nsee \\ref{fig:a} and \\cref{tab:x,sec:intro}\n%% \\ref{sec:gone}\n" % self.chapter[:-4] )
+        open( self.chapter, "w" ).write( "\\label{fig:a}\n\\label{fig:unused}\n\\label{fig:a}\n" )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def testLabelIndex(self):
+        """ tests the detection of unused labels, dangling and duplicate references """
+        index = LabelIndex( self.document )
+        assert index.files == [ self.document, self.chapter ]
+        assert index.getUnusedLabels() == [ ('fig:unused', [(self.chapter, 2)]) ]
+        assert index.getDanglingRefs() == [ ('tab:x', [(self.document, 3)]) ]
+        assert index.getDuplicateLabels() == [ ('fig:a', [(self.chapter, 1), (self.chapter, 3)]) ]
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+""" processes latex documents
+    - finalizes documents for publication by merging input files and the
+      bibliography into a single output stream
+    - lists the labels used in documents """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from re import compile as re_compile
+from os.path import splitext, exists, abspath, join, dirname
+from collections import defaultdict
+
+from cache import cacheRetrieve
+
+RE_INPUT  = re_compile( r"\input{([^}]+)}" )
+RE_FIGURE = re_compile( r"newlabel{fig:(\S+)}{{(\d+)}" )
+RE_HREF   = re_compile( ".href{[^}]+?}{([^}]+?)}" )
+RE_LABEL  = re_compile( "\\label\{([^\}]+)\}" )
+RE_CITATION = re_compile( r"\\citation\{([^}]+)\}" )
+RE_AUX_INPUT = re_compile( r"\\@input\{([^}]+)\}" )
+
+LABEL_GROUPS = { 'sec': 'Sections', 'eq': 'Equations', 'fig': 'Figures', 'tab': 'Tables' }
+
+SCAN_SUFFIX = ".texscan"
+CITE_ALL    = "*"          # the key cited by \nocite{*}
+
+# items of a scanned latex file
+TEXT, INPUT, BIBLIOGRAPHY = range(3)
+
+latexComand = lambda x: "\n"+x if x.startswith("\\") else x
+getLinkText = lambda x: x.group(1)
+
+
+def get_tex_file_name( fname ):
+    """ returns the name of the latex file (adds the .tex extension if necessary) """
+    if not splitext( fname )[1] and not exists( fname ):
+        fname += ".tex"
+    return fname
+
+
+def scan_file( fname ):
+    """ scans a latex file
+        @returns a list of (TEXT, text), (INPUT, fname) and (BIBLIOGRAPHY, None) items
+                 (comments and \\bibliographystyle are removed; consecutive text
+                 lines are merged into a single item)
+    """
+    items, text = [], []
+    for line in open( fname ):
+        # skip comments
+        if line.startswith("%"):
+            continue
+
+        m = RE_INPUT.search(line)
+        if m:
+            item = (INPUT, m.group(1))
+        elif line.startswith(r"\bibliographystyle"):
+            continue
+        elif line.startswith(r"\bibliography"):
+            item = (BIBLIOGRAPHY, None)
+        else:
+            text.append( line )
+            continue
+
+        if text:
+            items.append( (TEXT, "".join(text)) )
+            text = []
+        items.append( item )
+
+    if text:
+        items.append( (TEXT, "".join(text)) )
+    return items
+
+
+def iter_bbl_file( fname ):
+    """ yields the content of the bbl file with links removed
+        - every logical line (starting with a latex command) is processed
+          as soon as it is complete """
+    fname = splitext( fname )[0]+".bbl"
+    logical_line, first = [], True
+    for line in open(fname):
+        line = line.strip()
+        part = latexComand( line+" " if not line.endswith("%") else line[:-1] )
+        if part.startswith("\n"):
+            yield ("" if first else "\n") + RE_HREF.sub( getLinkText, "".join(logical_line) )
+            logical_line, first = [], False
+            part = part[1:]
+        logical_line.append( part )
+
+    yield ("" if first else "\n") + RE_HREF.sub( getLinkText, "".join(logical_line) )
+
+
+class TexFinalizer(object):
+    """ finalizes a single latex document
+        - the output is produced as a stream of text chunks
+        - input files are scanned only once per run (and only if they changed
+          since the last run, if a cachedir is given)
+    """
+
+    def __init__(self, document, cachedir=None):
+        """ @param[in] document  the main latex document
+            @param[in] cachedir  (optional directory caching scanned input files between runs)
+        """
+        self.document      = document
+        self.cachedir      = cachedir
+        self.fig_num_table = {}
+        self._scanned      = {}
+        self._aux_files    = set()
+
+
+    def getScannedFile(self, fname):
+        """ returns the (memoized) scan of the given latex file """
+        fname = abspath( fname )
+        if not fname in self._scanned:
+            if self.cachedir:
+                self._scanned[fname] = cacheRetrieve( self.cachedir, fname, scan_file, SCAN_SUFFIX )
+            else:
+                self._scanned[fname] = scan_file( fname )
+        return self._scanned[fname]
+
+
+    def readAuxFile(self, fname):
+        """ reads the aux file required to replace labels with figure numbers """
+        fname = splitext( fname )[0]+".aux"
+        if fname in self._aux_files or not exists( fname ):
+            return
+        self._aux_files.add( fname )
+
+        for line in open( fname ):
+            m = RE_FIGURE.search(line)
+            if m:
+                key = r"\ref{fig:%s}" % m.group(1)
+                self.fig_num_table[ key ] = m.group(2)
+
+
+    def __iter__(self):
+        """ yields the finalized document as a sequence of text chunks """
+        return self._expand( self.document, () )
+
+
+    def _expand(self, fname, stack):
+        """ yields the expanded content of fname
+            @param[in] stack  the files currently being expanded (used to detect include cycles)
+        """
+        fname = get_tex_file_name( fname )
+        if abspath(fname) in stack:
+            raise ValueError( "Include cycle detected: %s" % " -> ".join( stack + (abspath(fname), ) ) )
+        stack = stack + (abspath(fname), )
+
+        self.readAuxFile( fname )
+        for kind, value in self.getScannedFile( fname ):
+            if kind == TEXT:
+                yield value
+            elif kind == INPUT:
+                # relative input files are resolved against the including document
+                for chunk in self._expand( join(dirname(fname), value), stack ):
+                    yield chunk
+            elif kind == BIBLIOGRAPHY:
+                for chunk in iter_bbl_file( self.document ):
+                    yield chunk
+
+
+
+def _read_aux_citations( aux_file, document_dir, keys, cited, seen ):
+    """ appends the keys cited in aux_file (and the aux files it includes,
+        at the point of their inclusion) to keys
+        @param[in] document_dir  the directory of the main document """
+    if aux_file in seen or not exists( aux_file ):
+        return
+    seen.add( aux_file )
+
+    for line in open( aux_file ):
+        matches = [ (m.start(), 'citation', m.group(1)) for m in RE_CITATION.finditer( line ) ] + \
+                  [ (m.start(), 'input', m.group(1)) for m in RE_AUX_INPUT.finditer( line ) ]
+        for _, kind, value in sorted( matches ):
+            if kind == 'input':
+                # included aux files are relative to the main document
+                _read_aux_citations( join( document_dir, value ), document_dir, keys, cited, seen )
+                continue
+            for key in [ key.strip() for key in value.split(",") ]:
+                if not key in cited:
+                    cited.add( key )
+                    keys.append( key )
+
+
+def get_aux_citations( fname ):
+    """ returns the keys cited in the document's aux file (and the aux files
+        it includes) in the order of their first citation
+        - the keys contain CITE_ALL if the document cites all entries (\nocite{*})
+    """
+    keys = []
+    _read_aux_citations( splitext( fname )[0]+".aux", dirname( fname ), keys, set(), set() )
+    return keys
+
+
+def finalize( document, output_file, cachedir=None ):
+    """ writes the finalized document to output_file """
+    if abspath( output_file ) == abspath( get_tex_file_name(document) ):
+        raise ValueError( "Refusing to overwrite the input document '%s'." % document )
+
+    out = open( output_file, "w" )
+    try:
+        out.writelines( TexFinalizer( document, cachedir ) )
+        out.write( "\n" )
+    except:
+        out.close()
+        os.remove( output_file )
+        raise
+    out.close()
+
+
+def extract_labels( fname ):
+    """ extract all labels from the text """
+    labels=[]
+    for line in open( fname ):
+        labels.extend( RE_LABEL.findall(line) )
+
+    return labels
+
+
+def group_labels( labels ):
+    """ groups labels based on their qualifiers """
+    res = defaultdict( list )
+    for label in labels:
+        if ":" in label:
+            grp, lbl = label.split(":", 1) 
+        else:
+            grp, lbl = '', label
+
+        if grp in LABEL_GROUPS:
+            res[ LABEL_GROUPS[grp] ].append(label)
+        else:
+            res['Unknown'].append(label)
+
+    return res
+
+
+def get_label_listing( labels ):
+    """ returns the listing of the given labels grouped by their qualifiers """
+    return "".join( [ group.upper()+":\n" + "  "+"\n  ".join( sorted(label) ) + "\n"
+                      for group, label in group_labels( labels ).iteritems() ] )
+
+
+def write_label_listing( document, output_file ):
+    """ writes the listing of the document's labels to output_file """
+    open( output_file, "w" ).write( get_label_listing( extract_labels(document) ) )
+
+
+
+class TestTexFinalizer(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from os.path import join
+        self.tmpdir = mkdtemp()
+        self.document = join( self.tmpdir, "main.tex" )
+        open( self.document, "w" ).write( "%% comment\nstart\n\\input{%s}\n\\bibliographystyle{plain}\n\\bibliography{lit}\nend\n" % join(self.tmpdir, "chapter") )
+        open( join(self.tmpdir, "chapter.tex"), "w" ).write( "chapter text\n" )
+        open( join(self.tmpdir, "main.bbl"), "w" ).write( "\\begin{thebibliography}\n\\bibitem{a} A. Author,\n\\href{http://x}{Title}%\n.\n\\end{thebibliography}\n" )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def testFinalize(self):
+        """ tests the expansion of input files and the bibliography """
+        assert "".join( TexFinalizer( self.document ) ) == \
+            "start\nchapter text\n\n\\begin{thebibliography} \n\\bibitem{a} A. Author, \nTitle. \n\\end{thebibliography} end\n"
+
+    def testGetAuxCitations(self):
+        """ tests the extraction of citations from aux files """
+        from os.path import join
+        open( join(self.tmpdir, "main.aux"), "w" ).write( "\\citation{b,a}\n\\@input{%s}\n\\citation{c}\n" % join(self.tmpdir, "chapter.aux") )
+        open( join(self.tmpdir, "chapter.aux"), "w" ).write( "\\citation{a,d}\n" )
+        assert get_aux_citations( self.document ) == ['b', 'a', 'd', 'c']
+
+    def testGetNestedAuxCitations(self):
+        """ tests whether nested aux files are relative to the main document and \nocite{*} is kept """
+        from os.path import join
+        os.mkdir( join(self.tmpdir, "chapters") )
+        open( join(self.tmpdir, "main.aux"), "w" ).write( "\\citation{a}\n\\@input{chapters/chapter.aux}\n" )
+        open( join(self.tmpdir, "chapters", "chapter.aux"), "w" ).write( "\\citation{b}\n\\@input{chapters/section.aux}\n" )
+        open( join(self.tmpdir, "chapters", "section.aux"), "w" ).write( "\\citation{*}\n\\citation{c}\n" )
+        assert get_aux_citations( self.document ) == ['a', 'b', CITE_ALL, 'c']
+
+    def testIncludeCycle(self):
+        """ tests whether include cycles are detected """
+        open( self.document, "a" ).write( "\\input{%s}\n" % self.document )
+        try:
+            "".join( TexFinalizer( self.document ) )
+        except ValueError:
+            return
+        assert False
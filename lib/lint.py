@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+""" checks bibtex entries for problems which break or degrade publishing
+    (e.g. missing titles or author names which cannot be split)
+    - every rule is a function returning a message or None for an entry;
+      additional rules are added with register_lint_rule
+    - entries without errors are rendered (citation, coins, filename) to
+      catch the remaining failures
+    - entries are checked in chunks by a pool of worker processes (see
+      batch.run_forked) """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from batch import run_forked
+from bibtex import get_number
+from template import get_artifacts
+
+LINT_RULES = []               # (name, severity, rule) tuples
+DEFAULT_CHUNK_SIZE = 500      # number of entries checked per task
+
+
+def register_lint_rule( name, rule, severity='error' ):
+    """ registers a rule returning a message (or None) for a bibtex entry
+        @param[in] severity  'error' (the entry cannot be published) or 'warning'
+    """
+    LINT_RULES.append( (name, severity, rule) )
+
+
+def check_title( bibtex_entry ):
+    if not 'title' in bibtex_entry.entry:
+        return "missing title"
+    if not bibtex_entry.entry['title'].split():
+        return "empty title"
+
+
+def check_author( bibtex_entry ):
+    # COinS splits the first author at the first ', ' or ' '
+    if 'author' in bibtex_entry.entry:
+        first_author = bibtex_entry.entry['author'].split("and")[0].strip()
+        if not ", " in first_author and not " " in first_author:
+            return "cannot split the first author '%s' into first and last name" % first_author
+
+
+def check_year( bibtex_entry ):
+    year = bibtex_entry.entry.get('year', '')
+    if not year:
+        return "missing year"
+    if not get_number( year ):
+        return "invalid year '%s'" % year
+
+
+def check_rendering( bibtex_entry ):
+    """ renders the template independent artifacts and the filename of the entry """
+    try:
+        get_artifacts( bibtex_entry )
+        bibtex_entry.getIEEEFilename()
+    except Exception, e:
+        return "cannot be rendered (%s: %s)" % (e.__class__.__name__, e)
+
+
+register_lint_rule( 'title',  check_title )
+register_lint_rule( 'author', check_author )
+register_lint_rule( 'year',   check_year, 'warning' )
+
+
+def lint_entry( bibtex_entry, rules=None ):
+    """ returns the (path, key, severity, rule, message) problems of the given entry """
+    problems = []
+    for name, severity, rule in LINT_RULES if rules is None else rules:
+        try:
+            message = rule( bibtex_entry )
+        except Exception, e:
+            message = "rule failed (%s: %s)" % (e.__class__.__name__, e)
+        if message:
+            problems.append( (bibtex_entry.path, bibtex_entry.key, severity, name, message) )
+
+    if not [ problem for problem in problems if problem[2] == 'error' ]:
+        message = check_rendering( bibtex_entry )
+        if message:
+            problems.append( (bibtex_entry.path, bibtex_entry.key, 'error', 'render', message) )
+    return problems
+
+
+def get_duplicate_keys( bibtex_entries ):
+    """ returns the problems of entries whose key has already been used by
+        a preceding entry (position -> problem) """
+    problems, paths = {}, {}
+    for pos, b in enumerate( bibtex_entries ):
+        if b.key in paths:
+            problems[pos] = (b.path, b.key, 'error', 'duplicate-key', "duplicate key (also defined in %s)" % paths[b.key])
+        else:
+            paths[b.key] = b.path
+    return problems
+
+
+def lint( bibtex_entries, rules=None, processes=None, chunk_size=DEFAULT_CHUNK_SIZE ):
+    """ checks all bibtex entries
+        @param[in] rules      (optional list of (name, severity, rule) tuples; default: LINT_RULES)
+        @param[in] processes  number of worker processes (None: one per CPU)
+        @returns the list of (path, key, severity, rule, message) problems in
+                 the order of the entries
+    """
+    lint_chunk = lambda start: [ lint_entry(b, rules) for b in bibtex_entries[start:start+chunk_size] ]
+    results = run_forked( lint_chunk, xrange(0, len(bibtex_entries), chunk_size), processes )
+
+    duplicates, problems = get_duplicate_keys( bibtex_entries ), []
+    for pos, entry_problems in enumerate( [ entry_problems for result in results for entry_problems in result ] ):
+        problems.extend( entry_problems )
+        if pos in duplicates:
+            problems.append( duplicates[pos] )
+    return problems
+
+
+
+class _Entry(object):
+    def __init__(self, key, path="lit.bib", **entry):
+        self.key, self.type, self.path, self.entry, self.orig_entry = key, 'article', path, entry, entry
+    def getIEEEFilename(self):
+        return self.entry['title'].split()[0]
+    def getCitation(self):
+        return self.entry['title']
+    def getCoinsCitation(self):
+        return ""
+    def getBibTexCitation(self):
+        return ""
+
+
+class TestLint(object):
+
+    def setUp(self):
+        self.entries = [ _Entry('ok', title='Games', author='Scharl, Arno and Albert Weichselbraun', year='2012'),
+                         _Entry('notitle', author='Weichselbraun, Albert', year='2012'),
+                         _Entry('noyear', title=' ', author='Weichselbraun'),
+                         _Entry('ok', path="other.bib", title='Games', year='2012') ]
+
+    def _get_problems(self, **kwargs):
+        return [ (path, key, rule) for path, key, _, rule, _ in lint( self.entries, **kwargs ) ]
+
+    def testLint(self):
+        """ tests the rules and the detection of duplicate keys """
+        expected = [ ('lit.bib', 'notitle', 'title'), ('lit.bib', 'noyear', 'title'), ('lit.bib', 'noyear', 'author'),
+                     ('lit.bib', 'noyear', 'year'), ('other.bib', 'ok', 'duplicate-key') ]
+        assert self._get_problems() == expected
+        assert self._get_problems( processes=2, chunk_size=1 ) == expected
+
+    def testRendering(self):
+        """ tests whether failures of entries passing all rules are reported """
+        problems = lint( self.entries[1:2], rules=[] )
+        assert [ (rule, severity) for _, _, severity, rule, _ in problems ] == [ ('render', 'error') ]
+        assert "KeyError" in problems[0][4]
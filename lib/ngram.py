@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+""" approximate (fuzzy) search based on a trigram index over the cleaned
+    fields of bibtex entries """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import defaultdict
+
+from bibtex import normalize
+from cache import cacheRetrieve
+
+NGRAM_INDEX_SUFFIX = ".ngram"
+NGRAM_SIZE         = 3
+PADDING            = " " * (NGRAM_SIZE-1)
+# a single edit (including transpositions) destroys at most NGRAM_SIZE+1 n-grams
+NGRAMS_PER_EDIT    = NGRAM_SIZE + 1
+
+
+def get_default_max_distance( term ):
+    """ returns the default number of edits allowed for the given term """
+    if len(term) < 4:
+        return 0
+    elif len(term) < 8:
+        return 1
+    return 2
+
+
+def get_padded_ngrams( token ):
+    """ returns the set of n-grams of the padded token """
+    token = PADDING + token + PADDING
+    return set( [ token[i:i+NGRAM_SIZE] for i in xrange(len(token)-NGRAM_SIZE+1) ] )
+
+
+def get_edit_distance( s1, s2, max_distance ):
+    """ returns the edit distance (levenshtein distance counting transpositions
+        as a single edit) between s1 and s2 or max_distance+1, if the distance
+        exceeds max_distance """
+    if abs( len(s1)-len(s2) ) > max_distance:
+        return max_distance+1
+
+    before, previous = None, range( len(s2)+1 )
+    for i, c1 in enumerate( s1 ):
+        current = [ i+1 ]
+        for j, c2 in enumerate( s2 ):
+            d = min( previous[j+1]+1, current[j]+1, previous[j]+(c1 != c2) )
+            if i and j and c1 == s2[j-1] and s1[i-1] == c2:
+                d = min( d, before[j-1]+1 )
+            current.append( d )
+        if min(current) > max_distance:
+            return max_distance+1
+        before, previous = previous, current
+    return min( previous[-1], max_distance+1 )
+
+
+class NGramIndex(object):
+    """ maps n-grams to the tokens containing them and tokens to the
+        positions of the entries containing them """
+
+    def __init__(self, bibtex_entries):
+        token_ids = {}
+        postings  = defaultdict( list )
+        for pos, b in enumerate( bibtex_entries ):
+            text = normalize( " ".join( b.entry.values() ) + " " + b.key )
+            for token in set( text.split() ):
+                postings[ token_ids.setdefault( token, len(token_ids) ) ].append( pos )
+
+        ngrams = defaultdict( list )
+        for token, token_id in token_ids.iteritems():
+            for ngram in get_padded_ngrams( token ):
+                ngrams[ngram].append( token_id )
+
+        self.tokens   = [ token for token, _ in sorted( token_ids.iteritems(), key=lambda x: x[1] ) ]
+        self.postings = [ postings[token_id] for token_id in xrange(len(self.tokens)) ]
+        self.ngrams   = dict( ngrams )
+
+
+    def getMatchingTokens(self, term, max_distance):
+        """ returns the ids of all tokens within max_distance edits of term
+            - candidates need to share at least |ngrams(term)| - max_distance*NGRAMS_PER_EDIT
+              n-grams with the term (count filter) and are verified afterwards
+            - all tokens are verified if the count filter cannot exclude any
+              token (large distances for short terms)
+        """
+        ngrams     = get_padded_ngrams( term )
+        min_shared = len(ngrams) - max_distance*NGRAMS_PER_EDIT
+
+        if min_shared < 1:
+            candidates = xrange( len(self.tokens) )
+        else:
+            counts = defaultdict( int )
+            for ngram in ngrams:
+                for token_id in self.ngrams.get( ngram, () ):
+                    counts[token_id] += 1
+            candidates = [ token_id for token_id, count in counts.iteritems() if count >= min_shared ]
+
+        return [ token_id for token_id in candidates
+                 if get_edit_distance( term, self.tokens[token_id], max_distance ) <= max_distance ]
+
+
+    def search(self, search_terms, max_distance=None):
+        """ returns the positions of all entries approximately matching all search terms
+            @param[in] max_distance  maximum number of edits per term (default: depends on the term's length)
+        """
+        result = None
+        for term in search_terms:
+            for word in normalize( term ).split():
+                distance  = get_default_max_distance( word ) if max_distance is None else max_distance
+                positions = set()
+                for token_id in self.getMatchingTokens( word, distance ):
+                    positions.update( self.postings[token_id] )
+                result = positions if result is None else result & positions
+                if not result:
+                    return set()
+        return result or set()
+
+
+def ngramIndexRetrieve( cachedir, fname, fn ):
+    """ returns the (cached) n-gram index of fname
+        - fn is called with fname to obtain the bibtex entries, if the index
+          needs to be rebuilt """
+    return cacheRetrieve( cachedir, fname, lambda f: NGramIndex( fn(f) ), NGRAM_INDEX_SUFFIX )
+
+
+
+class TestNGramIndex(object):
+
+    class Entry(object):
+        def __init__(self, key, **entry):
+            self.key, self.entry = key, entry
+
+    def setUp(self):
+        self.index = NGramIndex( [ self.Entry('weichselbraun2011', author='Weichselbraun, Albert', title='Optimizing Queries'),
+                                   self.Entry('mueller2010', author='M\\uller, Hans', title='On Search'),
+                                   self.Entry('scharl2012', author='Scharl, Arno and Weichselbraun, Albert', title='Games') ] )
+
+    def testEditDistance(self):
+        """ tests the bounded edit distance """
+        assert get_edit_distance( "weichselbraun", "weichselbraun", 2 ) == 0
+        assert get_edit_distance( "weichselbraun", "weichelbraun", 2 ) == 1
+        assert get_edit_distance( "weichselbraun", "wiechslbraun", 2 ) == 2
+        assert get_edit_distance( "weichselbraun", "wiechslbrauen", 2 ) == 3
+        assert get_edit_distance( "abc", "abcdef", 2 ) == 3
+
+    def testSearch(self):
+        """ tests the approximate search """
+        assert self.index.search( ('Weichelbraun', ) ) == set( [0, 2] )
+        assert self.index.search( ('Weichelbraun', 'optimising') ) == set( [0] )
+        assert self.index.search( ('M{\\"u}ller', ) ) == set( [1] )
+        assert self.index.search( ('Mueller', ) ) == set( [1] )
+        assert self.index.search( ('Schral', 'Games') ) == set( [2] )
+        assert self.index.search( ('Arnold', ), 0 ) == set()
+        # distances exceeding the count filter fall back to verifying every token
+        assert self.index.search( ('Arnold', ), 2 ) == set( [2] )
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+""" output formats for bibtex entries
+    - every format is a writer class which writes one record per entry as
+      soon as the entry is available (i.e. in constant memory)
+    - additional formats are added with register_output_format """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from json import dumps
+
+from bibtex import get_month, get_number
+
+OUTPUT_FORMATS = {}
+
+# bibtex types -> CSL types
+CSL_TYPES = { 'article'      : 'article-journal',
+              'book'         : 'book',
+              'booklet'      : 'pamphlet',
+              'inbook'       : 'chapter',
+              'incollection' : 'chapter',
+              'inproceedings': 'paper-conference',
+              'conference'   : 'paper-conference',
+              'manual'       : 'book',
+              'mastersthesis': 'thesis',
+              'phdthesis'    : 'thesis',
+              'proceedings'  : 'book',
+              'techreport'   : 'report',
+              'unpublished'  : 'manuscript' }
+
+# bibtex fields -> CSL variables
+CSL_VARIABLES = { 'title'    : 'title',
+                  'journal'  : 'container-title',
+                  'booktitle': 'container-title',
+                  'publisher': 'publisher',
+                  'address'  : 'publisher-place',
+                  'pages'    : 'page',
+                  'volume'   : 'volume',
+                  'number'   : 'issue',
+                  'doi'      : 'DOI',
+                  'url'      : 'URL',
+                  'isbn'     : 'ISBN',
+                  'issn'     : 'ISSN',
+                  'abstract' : 'abstract',
+                  'note'     : 'note',
+                  'keywords' : 'keyword' }
+
+
+def register_output_format( name, writer_class ):
+    """ registers a writer class for the given output format name """
+    OUTPUT_FORMATS[name] = writer_class
+
+
+def get_writer( name, out ):
+    """ returns a writer for the given output format writing to out """
+    return OUTPUT_FORMATS[name]( out )
+
+
+def to_unicode( s ):
+    """ decodes (utf-8) byte strings """
+    return s.decode("utf-8", "replace") if isinstance(s, str) else s
+
+
+class MethodWriter(object):
+    """ writes the text returned by a method of the bibtex entries """
+    machine_readable = False
+    method = None
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, bibtex_entry):
+        self.out.write( getattr(bibtex_entry, self.method)() + "\n" )
+
+    def close(self):
+        pass
+
+
+class CitationWriter(MethodWriter):
+    method = 'getCitation'
+
+class CoinsWriter(MethodWriter):
+    method = 'getCoinsCitation'
+
+class WikipediaWriter(MethodWriter):
+    method = 'getWikipediaCitation'
+
+class BibTexWriter(MethodWriter):
+    method = 'getBibTexCitation'
+
+
+class JsonLinesWriter(object):
+    """ writes one JSON object (key, type, file and fields) per line """
+    machine_readable = True
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, bibtex_entry):
+        fields = dict( [ (field, to_unicode(value)) for field, value in bibtex_entry.entry.iteritems() if not field.startswith("_") ] )
+        record = { 'key': to_unicode(bibtex_entry.key), 'type': bibtex_entry.type.lower(),
+                   'file': to_unicode(bibtex_entry.path), 'fields': fields }
+        self.out.write( dumps(record, sort_keys=True) + "\n" )
+
+    def close(self):
+        pass
+
+
+def get_csl_names( names ):
+    """ converts a bibtex name list ('last, first and ...') into CSL names """
+    result = []
+    for name in to_unicode( names ).split(" and "):
+        if ", " in name:
+            family, given = name.split(", ", 1)
+            result.append( {'family': family.strip(), 'given': given.strip()} )
+        elif name.strip():
+            result.append( {'literal': name.strip()} )
+    return result
+
+
+def get_csl_record( bibtex_entry ):
+    """ returns the CSL-JSON record of the given bibtex entry """
+    entry  = bibtex_entry.entry
+    record = { 'id': to_unicode(bibtex_entry.key), 'type': CSL_TYPES.get( bibtex_entry.type.lower(), 'article' ) }
+    for field, variable in CSL_VARIABLES.iteritems():
+        if field in entry and not variable in record:
+            record[variable] = to_unicode( entry[field] )
+    for field in ('author', 'editor'):
+        if field in entry:
+            record[field] = get_csl_names( entry[field] )
+    if get_number( entry.get('year', '') ):
+        date_parts = [ get_number(entry['year']) ]
+        if get_month( entry.get('month', '') ):
+            date_parts.append( get_month(entry['month']) )
+        record['issued'] = {'date-parts': [ date_parts ]}
+    return record
+
+
+class CslJsonWriter(object):
+    """ writes a CSL-JSON array with one record per line """
+    machine_readable = True
+
+    def __init__(self, out):
+        self.out, self._separator = out, "[\n"
+
+    def write(self, bibtex_entry):
+        self.out.write( self._separator + dumps( get_csl_record(bibtex_entry), sort_keys=True ) )
+        self._separator = ",\n"
+
+    def close(self):
+        self.out.write( "[]\n" if self._separator == "[\n" else "\n]\n" )
+
+
+register_output_format( 'citation',  CitationWriter )
+register_output_format( 'coins',     CoinsWriter )
+register_output_format( 'wikipedia', WikipediaWriter )
+register_output_format( 'bibtex',    BibTexWriter )
+register_output_format( 'jsonl',     JsonLinesWriter )
+register_output_format( 'csl-json',  CslJsonWriter )
+
+
+
+class TestOutput(object):
+
+    class Entry(object):
+        def __init__(self, key, type, **entry):
+            self.key, self.type, self.path, self.entry = key, type, "lit.bib", entry
+        def getCitation(self):
+            return "[%s]" % self.key
+
+    def setUp(self):
+        self.entries = [ self.Entry('scharl2012', 'INPROCEEDINGS', author='Scharl, Arno and Weichselbraun, Albert',
+                                    title='Games', booktitle='LREC', year='2012', month='May', _title='x'),
+                         self.Entry('m2010', 'misc', title='M\xc3\xbcller') ]
+
+    def _write(self, name):
+        from StringIO import StringIO
+        out = StringIO()
+        writer = get_writer( name, out )
+        for entry in self.entries:
+            writer.write( entry )
+        writer.close()
+        return out.getvalue()
+
+    def testMethodWriter(self):
+        """ tests the writers based on BibTexEntry methods """
+        assert self._write( 'citation' ) == "[scharl2012]\n[m2010]\n"
+
+    def testJsonLines(self):
+        """ tests the JSON lines writer """
+        from json import loads
+        records = [ loads(line) for line in self._write('jsonl').splitlines() ]
+        assert records[0]['key'] == 'scharl2012' and records[0]['type'] == 'inproceedings'
+        assert not '_title' in records[0]['fields']
+        assert records[1]['fields']['title'] == u'M\xfcller'
+
+    def testCslJson(self):
+        """ tests the CSL-JSON writer """
+        from json import loads
+        records = loads( self._write('csl-json') )
+        assert records[0]['type'] == 'paper-conference' and records[0]['container-title'] == 'LREC'
+        assert records[0]['author'] == [ {'family': 'Scharl', 'given': 'Arno'}, {'family': 'Weichselbraun', 'given': 'Albert'} ]
+        assert records[0]['issued'] == {'date-parts': [[2012, 5]]}
+        assert records[1]['type'] == 'article'
+
+        self.entries = []
+        assert loads( self._write('csl-json') ) == []
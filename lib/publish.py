@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+""" publishes bibtex entries using one or more templates """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os.path
+from csv import reader
+
+from bibconfig import USER_CACHE
+from template import Template, get_artifacts
+from batch import run_forked
+from resultcache import getResultCache, RENDER_RESULT_CACHE
+from shard import publish_shards, read_shard_digests, SHARD_DIGEST_FILE
+from extsort import ExternalSorter, DEFAULT_RUN_SIZE
+
+# synchronization of the templates' assets (see Template.recreateTheme)
+try:
+    import publishconfig
+except ImportError:
+    publishconfig = None
+THEME_LINK_FILES   = getattr( publishconfig, 'THEME_LINK_FILES', False )
+THEME_COPY_THREADS = getattr( publishconfig, 'THEME_COPY_THREADS', 1 )
+
+
+def read_job_file( fname ):
+    """ reads a job file with one 'template, output_dir' pair per line
+        @returns a list of (template, output_dir) tuples
+    """
+    jobs = []
+    for row in reader( open(fname) ):
+        if not row or row[0].strip().startswith("#"):
+            continue
+        template, output_dir = [ col.strip() for col in row[:2] ]
+        jobs.append( (template, os.path.expanduser(output_dir)) )
+    return jobs
+
+
+def get_shared_artifacts( bibtex_entries ):
+    """ computes the template independent artifacts (citation, coins, bibtex)
+        of all bibtex_entries
+        @returns a dictionary bibtex key -> artifacts
+    """
+    artifacts = {}
+    for b in bibtex_entries:
+        b.entry['key'] = b.key
+        artifacts[b.key] = get_artifacts(b)
+    return artifacts
+
+
+def write_entry_files( publish_dir, ts, b, artifacts ):
+    """ writes the abstract (if available) and the bibtex file of the given
+        entry and sets its descriptor """
+    entry_discriptor = {'bibtex': os.path.join("bibtex", b.key+".bib") }
+
+    for k in ('eprint', 'url'):
+        if k in b.entry:
+            entry_discriptor[k] = b.entry[k]
+
+    if 'abstract' in b.entry:
+        entry_discriptor['abstract_url'] = os.path.join("abstract", b.key+".html")
+        open( os.path.join(publish_dir, entry_discriptor['abstract_url']), "w").write( ts.getAbstract(b) )
+
+    ts.setDescriptor( b, entry_discriptor )
+    open( os.path.join(publish_dir, entry_discriptor['bibtex']), "w").write( artifacts['bibtex'] )
+
+
+def publish( publish_dir, template_path, bibtex_entries, artifacts=None, template=None, sharding=None, processes=1 ):
+    """ publishes the given bibtex_entries in publish_dir using the template specified in
+        template_path
+        @param[in] template   (optional Template instance for template_path)
+        @param[in] sharding   (optional (mode, size) tuple; publishes the entries
+                              as several pages, see shard.publish_shards)
+        @param[in] processes  number of processes rendering shards
+    """
+    if artifacts is None:
+        artifacts = get_shared_artifacts( bibtex_entries )
+
+    if template is None:
+        ts = Template( template_path, artifacts )
+    else:
+        ts = template
+        ts.setArtifacts( artifacts )
+    ts.setRenderCache( getResultCache(USER_CACHE, RENDER_RESULT_CACHE) )
+    # unchanged shards of previous runs are kept
+    keep = [ SHARD_DIGEST_FILE ] + read_shard_digests( publish_dir ).keys() if sharding else ()
+    ts.recreateTheme( publish_dir, THEME_LINK_FILES, THEME_COPY_THREADS, keep )
+
+    # write per file abstract/bibtex (if available)
+    for b in bibtex_entries:
+        write_entry_files( publish_dir, ts, b, artifacts[b.key] )
+
+    if sharding:
+        publish_shards( publish_dir, ts, template_path, bibtex_entries, artifacts, sharding[0], sharding[1], processes )
+        return
+
+    # write index.html
+    open( os.path.join(publish_dir, "index.html"), "w").write( ts.getHtmlFile(bibtex_entries) )
+
+
+def publish_stream( publish_dir, template_path, batches, run_size=DEFAULT_RUN_SIZE, tmpdir=None ):
+    """ publishes arbitrarily many bibtex entries in bounded memory
+        - the entries are read batch by batch (e.g. file by file); their
+          abstract and bibtex files are written right away
+        - the entries of every type are sorted with an external sort (runs of
+          run_size entries are spilled to temporary files in tmpdir) and
+          rendered while the runs are merged
+        @param[in] batches  iterable of lists of bibtex entries
+        @returns the number of published entries
+    """
+    ts = Template( template_path )
+    ts.setRenderCache( getResultCache(USER_CACHE, RENDER_RESULT_CACHE) )
+    ts.recreateTheme( publish_dir, THEME_LINK_FILES, THEME_COPY_THREADS )
+
+    # artifacts are kept together with their entry rather than in the template
+    def set_artifacts( items ):
+        for b, artifacts in items:
+            ts.setArtifacts( {b.key: artifacts} )
+            yield b
+
+    sorters = {}
+    try:
+        for batch in batches:
+            for b in batch:
+                if not ts.isPublished( b ):
+                    continue
+                b.entry['key'] = b.key
+                artifacts = get_artifacts( b )
+                ts.setArtifacts( {b.key: artifacts} )
+                write_entry_files( publish_dir, ts, b, artifacts )
+                if not b.type in sorters:
+                    sorters[b.type] = ExternalSorter( lambda item: ts.getSortKey(item[0]), run_size, tmpdir )
+                sorters[b.type].add( (b, artifacts) )
+
+        listing = [ (tp, set_artifacts(sorters[tp])) for tp in ts.getTypeOrder() if tp in sorters ]
+        f = open( os.path.join(publish_dir, "index.html"), "w" )
+        for pos, html in enumerate( ts.iterHtml(listing) ):
+            f.write( "\n" + html if pos else html )
+        f.close()
+    finally:
+        for sorter in sorters.itervalues():
+            sorter.close()
+    return sum( [ len(sorter) for sorter in sorters.itervalues() ] )
+
+
+def publish_all( jobs, bibtex_entries, processes=None, sharding=None ):
+    """ publishes the bibtex_entries for every (template_path, publish_dir) job
+        - template independent artifacts are computed only once
+        - jobs are processed concurrently in up to processes worker processes
+          (see batch.run_forked; the shards of a single job are rendered
+          concurrently)
+        @param[in] sharding  (optional (mode, size) tuple, see publish)
+    """
+    artifacts = get_shared_artifacts( bibtex_entries )
+    shard_processes = processes if len(jobs) == 1 else 1
+
+    def publish_job( job ):
+        template_path, publish_dir = job
+        publish( publish_dir, template_path, bibtex_entries, artifacts, sharding=sharding, processes=shard_processes )
+    run_forked( publish_job, jobs, processes )
+
+
+
+class Publisher(object):
+    """ publishes the bibtex entries for a list of (template_path, publish_dir)
+        jobs repeatedly (e.g. whenever the input files change)
+        - templates are kept in memory and only reloaded after they changed
+        - artifacts are only recomputed for new or changed bibtex entries
+    """
+
+    def __init__(self, jobs, sharding=None, processes=1):
+        """ @param[in] sharding   (optional (mode, size) tuple, see publish)
+            @param[in] processes  number of processes rendering shards
+        """
+        self.jobs       = jobs
+        self.sharding   = sharding
+        self.processes  = processes
+        self._templates = {}    # template_path -> Template
+        self._artifacts = {}    # bibtex key -> (bibtex entry, artifacts)
+
+
+    def _get_template(self, template_path):
+        if not template_path in self._templates:
+            self._templates[template_path] = Template( template_path )
+        return self._templates[template_path]
+
+
+    def _get_artifacts(self, bibtex_entries):
+        """ returns the artifacts of all bibtex_entries, reusing the artifacts
+            of entries which have not been reparsed """
+        cached, artifacts = self._artifacts, {}
+        self._artifacts = {}
+        for b in bibtex_entries:
+            b.entry['key'] = b.key
+            if b.key in cached and cached[b.key][0] is b:
+                artifacts[b.key] = cached[b.key][1]
+            else:
+                artifacts[b.key] = get_artifacts(b)
+            self._artifacts[b.key] = (b, artifacts[b.key])
+        return artifacts
+
+
+    def update(self, bibtex_entries, changed_files=None):
+        """ publishes the bibtex_entries for all jobs affected by the changed files
+            @param[in] changed_files  changed files; changes to files outside of
+                                      the template directories affect all jobs
+                                      (None: publish all jobs)
+            @returns the list of published jobs
+        """
+        jobs = self.jobs
+        if changed_files is not None:
+            in_template  = lambda template_path, fname: fname.startswith( os.path.abspath(template_path) + os.sep )
+            changed_jobs = [ job for job in self.jobs if any( [ in_template(job[0], fname) for fname in changed_files ] ) ]
+            for template_path, _ in changed_jobs:
+                self._templates.pop( template_path, None )
+
+            # changes to the input files affect all jobs
+            if all( [ any( [ in_template(job[0], fname) for job in self.jobs ] ) for fname in changed_files ] ):
+                jobs = changed_jobs
+
+        artifacts = self._get_artifacts( bibtex_entries )
+        for template_path, publish_dir in jobs:
+            publish( publish_dir, template_path, bibtex_entries, artifacts, self._get_template(template_path), self.sharding, self.processes )
+        return jobs
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+""" structured queries with field scoped terms (e.g. author:weichselbraun,
+    year:2005..2010, type:article, key:scharl), the operators AND, OR, NOT
+    (or -term) and parentheses, which are evaluated against per-field indices """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from re import compile as re_compile
+
+from bibtex import normalize, get_number
+from cache import cacheRetrieve
+
+FIELD_INDEX_SUFFIX = ".fields"
+OPERATORS          = ('AND', 'OR', 'NOT', '(', ')')
+
+RE_FIELD_TERM = re_compile( r"^([A-Za-z_]+):(.+)$" )
+# fields supported by field scoped terms (other 'name:value' arguments such
+# as urls or 'doi:10.1000/182' are plain search terms)
+QUERY_FIELDS  = frozenset( ('key', 'type', 'year', 'author', 'editor', 'title', 'booktitle', 'journal', 'series',
+                            'publisher', 'school', 'institution', 'organization', 'address', 'keywords', 'abstract', 'note') )
+RE_YEAR_RANGE = re_compile( r"^(\d*)\.\.(\d*)$" )
+
+
+class FieldIndex(object):
+    """ maps the normalized words of every field to the positions of the
+        entries containing them
+        - keys and types are indexed as a whole (lower case)
+        - years are indexed numerically to support range queries
+    """
+
+    def __init__(self, bibtex_entries):
+        words = defaultdict( lambda: defaultdict(set) )
+        years = defaultdict( set )
+        for pos, b in enumerate( bibtex_entries ):
+            words['key'][b.key.lower()].add( pos )
+            words['type'][b.type.lower()].add( pos )
+            for field, value in b.entry.iteritems():
+                for word in normalize( value ).split():
+                    words[field.lower()][word].add( pos )
+            if 'year' in b.entry:
+                years[ get_number(b.entry['year']) ].add( pos )
+
+        self.size  = len( bibtex_entries )
+        self.words = dict( [ (field, dict(postings)) for field, postings in words.iteritems() ] )
+        self.sorted_words = dict( [ (field, sorted(postings)) for field, postings in self.words.iteritems() ] )
+        self.years = dict( years )
+        self.sorted_years = sorted( years )
+
+
+    def getPrefixMatches(self, field, prefix):
+        """ returns the positions of all entries with a word starting with prefix in field """
+        words, positions = self.sorted_words.get( field, [] ), set()
+        for word in words[ bisect_left(words, prefix): ]:
+            if not word.startswith( prefix ):
+                break
+            positions.update( self.words[field][word] )
+        return positions
+
+
+    def getYearMatches(self, first, last):
+        """ returns the positions of all entries published between first and last (inclusive) """
+        positions = set()
+        for year in self.sorted_years[ bisect_left(self.sorted_years, first):bisect_right(self.sorted_years, last) ]:
+            positions.update( self.years[year] )
+        return positions
+
+
+    def lookup(self, field, value):
+        """ returns the positions of all entries matching field:value """
+        field = field.lower()
+        if field == 'year':
+            m = RE_YEAR_RANGE.match( value.strip() )
+            if m:
+                return self.getYearMatches( int(m.group(1) or 0), int(m.group(2) or 9999) )
+            return self.getYearMatches( get_number(value), get_number(value) )
+        elif field == 'type':
+            return set( self.words['type'].get( value.strip().lower(), () ) ) if self.size else set()
+        elif field == 'key':
+            return self.getPrefixMatches( 'key', value.strip().lower() )
+
+        result = None
+        for word in normalize( value ).split():
+            positions = self.getPrefixMatches( field, word )
+            result = positions if result is None else result & positions
+        return result or set()
+
+
+
+class FieldTerm(object):
+    """ field:value (evaluated using the field index) """
+    indexed = True
+
+    def __init__(self, field, value):
+        self.field, self.value = field, value
+
+    def evaluate(self, index, get_entries, candidates):
+        positions = index.lookup( self.field, self.value )
+        return positions if candidates is None else positions & candidates
+
+
+class TextTerm(object):
+    """ a string contained in any field of the entry (evaluated by scanning
+        the candidate entries) """
+    indexed = False
+
+    def __init__(self, needle):
+        self.needle = needle.lower()
+
+    def evaluate(self, index, get_entries, candidates):
+        entries = get_entries()
+        if candidates is None:
+            candidates = xrange( len(entries) )
+        return set( [ pos for pos in candidates if self.needle in entries[pos].getTextRepresentation() ] )
+
+
+class And(object):
+
+    def __init__(self, children):
+        self.children = children
+        self.indexed  = any( [ child.indexed for child in children ] )
+
+    def evaluate(self, index, get_entries, candidates):
+        # indexed terms restrict the candidates for the remaining terms
+        for child in sorted( self.children, key=lambda child: not child.indexed ):
+            candidates = child.evaluate( index, get_entries, candidates )
+            if not candidates:
+                break
+        return candidates
+
+
+class Or(object):
+
+    def __init__(self, children):
+        self.children = children
+        self.indexed  = all( [ child.indexed for child in children ] )
+
+    def evaluate(self, index, get_entries, candidates):
+        result = set()
+        for child in self.children:
+            result.update( child.evaluate( index, get_entries, candidates ) )
+        return result
+
+
+class Not(object):
+    indexed = False
+
+    def __init__(self, child):
+        self.child = child
+
+    def evaluate(self, index, get_entries, candidates):
+        if candidates is None:
+            candidates = set( xrange(index.size) )
+        return candidates - self.child.evaluate( index, get_entries, candidates )
+
+
+
+def tokenize( args ):
+    """ splits the command line arguments into query tokens
+        - every argument is a single term (which may contain spaces); leading
+          '(' and unbalanced trailing ')' are separate tokens
+        - '-term' is a shortcut for 'NOT term'
+    """
+    tokens = []
+    for arg in args:
+        arg = arg.strip()
+        while arg.startswith("("):
+            tokens.append( "(" )
+            arg = arg[1:].lstrip()
+        closing = 0
+        while arg.endswith(")") and arg.count(")") > arg.count("("):
+            closing += 1
+            arg = arg[:-1].rstrip()
+        if arg.startswith("-") and len(arg) > 1:
+            tokens.extend( ['NOT', arg[1:]] )
+        elif arg:
+            tokens.append( arg )
+        tokens.extend( [")"] * closing )
+    return tokens
+
+
+def get_field_term( token ):
+    """ returns the (field, value) tuple of a field scoped term or None """
+    m = RE_FIELD_TERM.match( token )
+    if m and m.group(1).lower() in QUERY_FIELDS:
+        return m.groups()
+    return None
+
+
+def is_query( args ):
+    """ returns True if args use the structured query syntax rather than a
+        list of plain search terms """
+    return [ token for token in tokenize(args) if token in OPERATORS or get_field_term(token) ] != []
+
+
+class Query(object):
+    """ a parsed structured query
+
+        query    := and_expr ('OR' and_expr)*
+        and_expr := not_expr (['AND'] not_expr)*
+        not_expr := 'NOT' not_expr | '(' query ')' | term
+    """
+
+    def __init__(self, args):
+        """ @param[in] args  the query as list of command line arguments
+            @raises ValueError for malformed queries
+        """
+        self._tokens, self._pos = tokenize( args ), 0
+        if not self._tokens:
+            raise ValueError( "Empty query." )
+        self.root = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise ValueError( "Unexpected '%s' in query." % self._tokens[self._pos] )
+
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError( "Unexpected end of query." )
+        self._pos += 1
+        return token
+
+
+    def _parse_or(self):
+        children = [ self._parse_and() ]
+        while self._peek() == 'OR':
+            self._next()
+            children.append( self._parse_and() )
+        return children[0] if len(children) == 1 else Or( children )
+
+
+    def _parse_and(self):
+        children = [ self._parse_not() ]
+        while self._peek() not in (None, 'OR', ')'):
+            if self._peek() == 'AND':
+                self._next()
+            children.append( self._parse_not() )
+        return children[0] if len(children) == 1 else And( children )
+
+
+    def _parse_not(self):
+        token = self._next()
+        if token == 'NOT':
+            return Not( self._parse_not() )
+        elif token == '(':
+            node = self._parse_or()
+            if self._next() != ')':
+                raise ValueError( "Missing ')' in query." )
+            return node
+        elif token in OPERATORS:
+            raise ValueError( "Unexpected '%s' in query." % token )
+
+        field_term = get_field_term( token )
+        if field_term:
+            return FieldTerm( *field_term )
+        return TextTerm( token )
+
+
+    def search(self, index, get_entries):
+        """ returns the sorted positions of all entries matching the query
+            @param[in] index        the FieldIndex of the entries
+            @param[in] get_entries  returns the list of entries; only called if
+                                    the query contains terms which are not indexed
+        """
+        entries = []
+        def get_cached_entries():
+            if not entries:
+                entries.append( get_entries() )
+            return entries[0]
+
+        return sorted( self.root.evaluate( index, get_cached_entries, None ) )
+
+
+    def getKey(self):
+        """ returns a key identifying the query (e.g. for caching its results) """
+        return tuple( self._tokens )
+
+
+def fieldIndexRetrieve( cachedir, fname, fn ):
+    """ returns the (cached) field index of fname
+        - fn is called with fname to obtain the bibtex entries, if the index
+          needs to be rebuilt """
+    return cacheRetrieve( cachedir, fname, lambda f: FieldIndex( fn(f) ), FIELD_INDEX_SUFFIX )
+
+
+
+class TestQuery(object):
+
+    class Entry(object):
+        def __init__(self, key, type, **entry):
+            self.key, self.type, self.entry = key, type, entry
+        def getTextRepresentation(self):
+            return " ".join( self.entry.values() ).lower() + self.key
+
+    def setUp(self):
+        self.entries = [ self.Entry('weichselbraun2011', 'ARTICLE', author='Weichselbraun, Albert', title='Optimizing Queries', year='2011', pages='2009--2015'),
+                         self.Entry('mueller2005', 'inproceedings', author='M{\\"u}ller, Hans', title='On Search', year='2005'),
+                         self.Entry('scharl2009', 'article', author='Scharl, Arno and Weichselbraun, Albert', title='Games', year='2009') ]
+        self.index = FieldIndex( self.entries )
+
+    def _search(self, *args):
+        return Query( args ).search( self.index, lambda: self.entries )
+
+    def testTokenize(self):
+        """ tests the tokenization of command line arguments """
+        assert tokenize( ['(author:a', 'OR', 'title:f(x))', '-type:misc'] ) == ['(', 'author:a', 'OR', 'title:f(x)', ')', 'NOT', 'type:misc']
+        assert is_query( ['year:2009'] ) and is_query( ['a', 'OR', 'b'] )
+        assert not is_query( ['weichselbraun', '2009'] )
+        assert not is_query( ['doi:10.1000/182'] ) and not is_query( ['http://www.semanticlab.net'] )
+        assert Query( ['(a', 'b)'] ).getKey() == Query( ['(', 'a', 'b', ')'] ).getKey()
+        assert Query( ['a', 'b'] ).getKey() != Query( ['a', 'OR', 'b'] ).getKey()
+
+    def testFieldTerms(self):
+        """ tests field scoped terms """
+        assert self._search( 'year:2009' ) == [2]
+        assert self._search( 'year:2005..2010' ) == [1, 2]
+        assert self._search( 'year:2006..' ) == [0, 2]
+        assert self._search( 'author:weichsel' ) == [0, 2]
+        assert self._search( 'author:muller hans' ) == [1]
+        assert self._search( 'type:article' ) == [0, 2]
+        assert self._search( 'key:scharl' ) == [2]
+        assert self._search( 'publisher:acm' ) == []
+        # unknown fields are plain text terms
+        self.entries[0].entry['doi'] = 'doi:10.1000/182'
+        assert self._search( 'doi:10.1000/182', 'OR', 'year:2005' ) == [0, 1]
+
+    def testOperators(self):
+        """ tests the operators AND, OR, NOT and parentheses """
+        assert self._search( 'author:weichselbraun', 'NOT', 'year:2009' ) == [0]
+        assert self._search( 'author:weichselbraun', '-year:2009' ) == [0]
+        assert self._search( 'year:2005', 'OR', 'key:scharl' ) == [1, 2]
+        assert self._search( '(year:2005', 'OR', 'year:2011)', 'AND', 'type:article' ) == [0]
+        assert self._search( 'queries', 'OR', 'games' ) == [0, 2]
+
+    def testMalformedQuery(self):
+        """ tests whether malformed queries are rejected """
+        for args in ( ['(year:2009'], ['year:2009', 'OR'], ['year:2009)'], [] ):
+            try:
+                Query( args )
+            except ValueError:
+                continue
+            assert False, args
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+""" resolves @string macros and crossref'd fields of bibtex entries
+    - macros and crossrefs within a file are resolved when the file is parsed
+      (and cached together with its entries)
+    - references to macros and entries of other files are resolved in bulk
+      once all files have been loaded """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from re import compile as re_compile, I
+
+from bibtex import BibTex, split_value, is_macro
+
+MACRO_SUFFIX = ".macros"
+MONTH_MACROS = dict( zip( ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'),
+                          ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+                           'September', 'October', 'November', 'December') ) )
+
+RE_STRING = re_compile( r"@string\s*([{(])", I )
+
+# fields which are not inherited from crossref'd entries
+NOT_INHERITED = ('crossref', 'title')
+
+
+def expand_value( native, macros ):
+    """ expands the macros in the given native bibtex value
+        @returns a tuple (value, resolved); unknown macros are kept and
+                 resolved is False
+    """
+    result, resolved = [], True
+    for part in split_value( native ):
+        if is_macro( part ):
+            if part.lower() in macros:
+                part = macros[ part.lower() ]
+            else:
+                resolved = False
+        elif part[:1] in ('{', '"'):
+            part = part[1:-1]
+        result.append( part )
+    return "".join( result ), resolved
+
+
+def read_macros( fname ):
+    """ returns a dictionary of the @string macros defined in fname
+        (macro names are lower case) """
+    text, macros = open( fname ).read(), {}
+    for m in RE_STRING.finditer( text ):
+        closing, depth = '}' if m.group(1) == '{' else ')', 0
+        for pos in xrange( m.end(), len(text) ):
+            if text[pos] == closing and depth == 0:
+                break
+            depth += { '{': 1, '}': -1 }.get( text[pos], 0 )
+        else:
+            continue
+
+        definition = text[ m.end():pos ]
+        if "=" in definition:
+            name, value = definition.split( "=", 1 )
+            macros[ name.strip().lower() ] = expand_value( value.strip(), dict(MONTH_MACROS, **macros) )[0]
+    return macros
+
+
+def inherit_fields( bibtex_entry, parent ):
+    """ copies the fields missing in bibtex_entry from the crossref'd parent
+        (the parent's title becomes the entry's booktitle) """
+    for field, value in parent.orig_entry.iteritems():
+        if not field in bibtex_entry.entry and not field in NOT_INHERITED:
+            bibtex_entry.setField( field, value )
+    if not 'booktitle' in bibtex_entry.entry and 'title' in parent.orig_entry:
+        bibtex_entry.setField( 'booktitle', parent.orig_entry['title'] )
+
+
+def resolve_entries( bibtex_entries, macros=None, get_parent=None ):
+    """ expands the macros and inherits the crossref'd fields of all entries
+        - macros which are not found are kept in the entry's macros, so that
+          they can be resolved later on (e.g. with the macros of other files)
+        @param[in] macros      (optional dictionary of @string macros)
+        @param[in] get_parent  (optional function returning the crossref'd
+                               entry for keys not contained in bibtex_entries)
+        @returns bibtex_entries
+    """
+    macros = dict( MONTH_MACROS, **(macros or {}) )
+    for b in bibtex_entries:
+        for field, native in b.macros.items():
+            value, resolved = expand_value( native, macros )
+            b.setField( field, value )
+            if resolved:
+                del b.macros[field]
+
+    parents = dict( [ (b.key.lower(), b) for b in bibtex_entries ] )
+    for b in bibtex_entries:
+        # orig_entry does not trigger the normalization of the entry's authors
+        crossref = b.orig_entry.get( 'crossref', '' ).strip()
+        if not crossref:
+            continue
+        parent = parents.get( crossref.lower() )
+        if parent is None and get_parent is not None:
+            parent = get_parent( crossref )
+        if parent is not None and parent is not b:
+            inherit_fields( b, parent )
+    return bibtex_entries
+
+
+def get_resolved_entries( fname ):
+    """ returns the entries of fname with the file's macros and crossrefs resolved """
+    return resolve_entries( BibTex(fname).getEntries(), read_macros(fname) )
+
+
+def resolve_corpus( bibtex_entries, bibtex_files, get_macros=read_macros, get_parent=None ):
+    """ resolves references to macros and crossref'd entries defined in any of
+        the bibtex_files
+        - the macro tables are only read if entries contain unresolved macros
+        @returns bibtex_entries
+    """
+    macros = {}
+    if [ b for b in bibtex_entries if b.macros ]:
+        for fname in bibtex_files:
+            macros.update( get_macros(fname) )
+    return resolve_entries( bibtex_entries, macros, get_parent )
+
+
+
+class TestResolve(object):
+
+    class Entry(object):
+        def __init__(self, key, macros=None, **entry):
+            self.key, self.entry, self.orig_entry, self.macros = key, entry, dict(entry), macros or {}
+        def setField(self, field, value):
+            self.entry[field] = self.orig_entry[field] = value.replace("{", "").replace("}", "")
+
+    def setUp(self):
+        from tempfile import mkstemp
+        from os import write, close
+        fd, self.bib = mkstemp( suffix=".bib" )
+        write( fd, '@string{ieee = "IEEE"}\n@STRING( tkde = ieee # " Transactions on {Knowledge} and Data Engineering" )\n@article{a, journal=tkde}\n' )
+        close( fd )
+
+    def tearDown(self):
+        from os import remove
+        remove( self.bib )
+
+    def testReadMacros(self):
+        """ tests the parsing of @string definitions """
+        assert read_macros( self.bib ) == { 'ieee': 'IEEE', 'tkde': 'IEEE Transactions on {Knowledge} and Data Engineering' }
+
+    def testExpandValue(self):
+        """ tests the expansion of macros and concatenations """
+        assert expand_value( 'jan', MONTH_MACROS ) == ('January', True)
+        assert expand_value( '{Proc. of } # conf # " 2012"', {'conf': 'ICWE'} ) == ('Proc. of ICWE 2012', True)
+        assert expand_value( 'unknown # {x}', {} ) == ('unknownx', False)
+
+    def testResolveEntries(self):
+        """ tests the resolution of macros and crossrefs """
+        proc  = self.Entry( 'icwe2012', title='ICWE 2012', publisher='Springer', year='2012' )
+        paper = self.Entry( 'a', {'month': 'jun', 'journal': 'tkde'}, title='Paper', crossref='ICWE2012', month='jun', journal='tkde' )
+        other = self.Entry( 'b', crossref='missing' )
+        resolve_entries( [paper, proc, other] )
+        assert paper.entry['month'] == 'June' and paper.macros == {'journal': 'tkde'}
+        assert paper.entry['booktitle'] == 'ICWE 2012' and paper.entry['publisher'] == 'Springer'
+        assert paper.entry['title'] == 'Paper'
+
+        # macros and parents of other files
+        resolve_corpus( [paper, other], [self.bib], get_parent=lambda key: proc if key == 'missing' else None )
+        assert paper.entry['journal'] == 'IEEE Transactions on Knowledge and Data Engineering' and paper.macros == {}
+        assert other.entry['year'] == '2012'
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+""" caches computed results (e.g. the entries matching a query or the html
+    rendered for an entry) between runs
+    - results are keyed by the version of the data they have been computed
+      from (see get_corpus_version), so changes of the underlying data never
+      return outdated results; outdated results are evicted eventually
+    - every result cache is a single file holding at most max_entries results
+      and evicting the least recently used ones """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import atexit
+from os.path import exists, join
+from cPickle import load
+from collections import OrderedDict
+from hashlib import md5
+from threading import Lock
+from time import time
+from warnings import warn
+
+from bibconfig import RESULT_CACHE_MAX_ENTRIES
+from cache import getValidator, dumpAtomic, FileLock, LOAD_ERRORS, CACHE_VERSION
+
+QUERY_RESULT_CACHE  = "query-results"     # search terms -> positions of the matching entries
+RENDER_RESULT_CACHE = "rendered-entries"  # entry and template -> html
+
+_result_caches = {}
+_result_caches_lock = Lock()
+
+
+def get_corpus_version( bibtex_files, validation, validators=None ):
+    """ returns a digest of the validators (see cache.getValidator) of all
+        bibtex files; the digest changes whenever a file is added, removed or
+        modified
+        @param[in] validators  (optional dictionary of the files' precomputed
+                               validators, e.g. computed concurrently)
+    """
+    validators = validators or {}
+    h = md5()
+    for fname in bibtex_files:
+        validator = validators[fname] if fname in validators else getValidator(fname, validation)
+        h.update( "%s %s\n" % (fname, validator) )
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """ a persistent cache of results with a least recently used eviction
+        - the cache file is read on the first access and the results added or
+          accessed are merged into it on flush (concurrent processes do not
+          overwrite each other's results)
+        - at most max_entries results are kept in memory, i.e. results are
+          evicted as soon as new results exceed the budget
+    """
+
+    def __init__(self, fname, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.fname       = fname
+        self.max_entries = max_entries
+        self._results    = None          # key -> [atime, result] (least recently used first)
+        self._touched    = set()
+        self._lock       = Lock()
+
+
+    def _read(self):
+        """ returns the results stored in the cache file """
+        try:
+            version, results = load( open(self.fname, "rb") )
+            if version == CACHE_VERSION:
+                return results
+        except LOAD_ERRORS:
+            pass
+        return {}
+
+
+    @staticmethod
+    def _get_lru_order(results):
+        """ returns the results ordered by their last access """
+        return OrderedDict( sorted( results.iteritems(), key=lambda x: x[1][0] ) )
+
+
+    def _get_results(self):
+        if self._results is None:
+            self._results = self._get_lru_order( self._read() )
+        return self._results
+
+
+    def get(self, key, default=None):
+        """ returns the result stored for key or default """
+        with self._lock:
+            results = self._get_results()
+            if not key in results:
+                return default
+            entry = results.pop( key )
+            entry[0] = time()
+            results[key] = entry
+            self._touched.add( key )
+            return entry[1]
+
+
+    def put(self, key, result):
+        """ stores the result for key (results need to be picklable) """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            results = self._get_results()
+            results.pop( key, None )
+            results[key] = [time(), result]
+            self._touched.add( key )
+            while len(results) > self.max_entries:
+                evicted, _ = results.popitem( last=False )
+                self._touched.discard( evicted )
+
+
+    def __len__(self):
+        return len( self._results or () )
+
+
+    def _evict(self, results):
+        """ removes the least recently used results exceeding max_entries """
+        if len(results) > self.max_entries:
+            for key, _ in sorted( results.items(), key=lambda x: x[1][0] )[:len(results)-self.max_entries]:
+                del results[key]
+
+
+    def flush(self):
+        """ merges the added and accessed results into the cache file """
+        with self._lock:
+            if not self._touched:
+                return
+            with FileLock( self.fname + ".lock" ):
+                results = self._read()
+                for key in self._touched:
+                    if key in self._results:
+                        results[key] = self._results[key]
+                self._evict( results )
+                dumpAtomic( (CACHE_VERSION, results), self.fname )
+            self._results, self._touched = self._get_lru_order( results ), set()
+
+
+
+def getResultCache( cachedir, name ):
+    """ returns the result cache name in cachedir
+        - the cache's size is configured in cacheconfig.py (RESULT_CACHE_MAX_ENTRIES;
+          0 disables the result caches)
+    """
+    with _result_caches_lock:
+        fname = join( cachedir, name )
+        if not fname in _result_caches:
+            try:
+                import cacheconfig
+            except ImportError:
+                cacheconfig = None
+
+            if not exists(cachedir):
+                os.makedirs(cachedir)
+            _result_caches[fname] = ResultCache( fname, getattr(cacheconfig, 'RESULT_CACHE_MAX_ENTRIES', RESULT_CACHE_MAX_ENTRIES) )
+        return _result_caches[fname]
+
+
+def flushResultCaches():
+    """ writes the changes of all result caches """
+    for fname, result_cache in _result_caches.iteritems():
+        try:
+            result_cache.flush()
+        except (IOError, OSError), e:
+            warn("Cannot update the result cache '%s': %s" % (fname, e))
+
+atexit.register( flushResultCaches )
+
+
+
+class TestResultCache(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.fname  = join( self.tmpdir, "results" )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def testPersistence(self):
+        """ tests whether results are stored and merged between cache instances """
+        cache, concurrent = ResultCache( self.fname ), ResultCache( self.fname )
+        assert cache.get( 'a' ) is None and cache.get( 'a', 'default' ) == 'default'
+        cache.put( 'a', [1, 2] )
+        concurrent.put( 'b', "<li>b</li>" )
+        cache.flush()
+        concurrent.flush()
+
+        cache = ResultCache( self.fname )
+        assert cache.get( 'a' ) == [1, 2] and cache.get( 'b' ) == "<li>b</li>"
+
+    def testEviction(self):
+        """ tests whether the least recently used results are evicted """
+        cache = ResultCache( self.fname, max_entries=2 )
+        cache.put( 'a', 1 )
+        cache.put( 'b', 2 )
+        cache.get( 'a' )
+        cache.put( 'c', 3 )
+        # results are evicted before they are flushed
+        assert len( cache ) == 2 and cache.get( 'b' ) is None
+        cache.flush()
+        assert ResultCache( self.fname ).get( 'b' ) is None and ResultCache( self.fname ).get( 'a' ) == 1
+
+    def testCorpusVersion(self):
+        """ tests whether the corpus version reflects modified files """
+        fname = join( self.tmpdir, "lit.bib" )
+        open( fname, "w" ).write( "@misc{a, title={A}}" )
+        version = get_corpus_version( [fname], 'content' )
+        assert version == get_corpus_version( [fname], 'content' )
+        open( fname, "w" ).write( "@misc{a, title={Bb}}" )
+        assert version != get_corpus_version( [fname], 'content' )
+        assert version != get_corpus_version( [], 'content' )
+        validators = { fname: getValidator(fname, 'content') }
+        assert get_corpus_version( [fname], 'content', validators ) == get_corpus_version( [fname], 'content' )
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+""" searches the bibtex files of the search path concurrently
+    - directories are globbed and their files are searched in a pool of
+      threads, so that the latency of slow (e.g. network) file systems does
+      not add up
+    - results are returned as soon as they are available or (optionally) in
+      the order of the search path
+    - directories which do not respond within a timeout are skipped """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from glob import glob
+from Queue import Queue, Empty
+from sys import exc_info
+from threading import Thread
+from time import time
+from warnings import warn
+
+DEFAULT_THREADS = 8
+POLL_INTERVAL   = 0.5   # maximum time the main thread blocks (keeps it responsive to signals)
+
+
+class ScatterGather(object):
+    """ globs the directories of a search path and searches their files in a
+        pool of threads
+        - directories whose glob or file searches do not complete within
+          timeout seconds (measured from the start of the operation) are
+          skipped for the rest of the run and their results are discarded
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS, timeout=None, ordered=False, pattern="*.bib"):
+        """ @param[in] threads  number of worker threads
+            @param[in] timeout  (optional) seconds per directory
+            @param[in] ordered  return results in the order of the search path
+                                rather than as they complete
+        """
+        self.threads   = max( threads, 1 )
+        self.timeout   = timeout
+        self.ordered   = ordered
+        self.pattern   = pattern
+        self.timed_out = set()     # directories skipped due to a timeout
+        self._files    = {}        # directory -> files
+
+
+    def _glob(self, bibdir):
+        """ returns the (memoized) sorted files of bibdir matching the pattern """
+        if not bibdir in self._files:
+            self._files[bibdir] = sorted( glob( bibdir + "/" + self.pattern ) )
+        return self._files[bibdir]
+
+
+    @staticmethod
+    def _work(tasks, results, running, cancelled):
+        """ executes tasks (dir_pos, file_pos, name, fn) until it receives None
+            - running tasks are recorded together with their start time """
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            if task[0] in cancelled:
+                continue
+            running[task] = time()
+            try:
+                results.put( (task, task[3](), None) )
+            except Exception:
+                results.put( (task, None, exc_info()) )
+            del running[task]
+
+
+    def _start_workers(self, num_workers, *args):
+        for _ in xrange( num_workers ):
+            worker = Thread( target=self._work, args=args )
+            # workers blocked by unresponsive file systems must not keep the process alive
+            worker.daemon = True
+            worker.start()
+
+
+    def _scatter(self, search_path, search_file=None):
+        """ yields the events ('files', dir_pos, bibdir, files),
+            ('result', dir_pos, file_pos, fname, result) and
+            ('timeout', dir_pos, bibdir) as they occur
+            - files are only searched if search_file is given
+        """
+        tasks, results, running, cancelled = Queue(), Queue(), {}, set()
+        pending = {}     # dir_pos -> number of outstanding tasks
+        for dir_pos, bibdir in enumerate( search_path ):
+            if bibdir in self.timed_out:
+                continue
+            pending[dir_pos] = 1
+            tasks.put( (dir_pos, None, bibdir, lambda bibdir=bibdir: self._glob(bibdir)) )
+
+        num_workers = min( self.threads, len(pending) or 1 )
+        self._start_workers( num_workers, tasks, results, running, cancelled )
+        try:
+            while pending:
+                wait = POLL_INTERVAL
+                if self.timeout:
+                    now = time()
+                    for dir_pos in set( [ task[0] for task, start in running.items() if start + self.timeout <= now and task[0] in pending ] ):
+                        del pending[dir_pos]
+                        cancelled.add( dir_pos )
+                        self.timed_out.add( search_path[dir_pos] )
+                        warn( "Skipping '%s' (no response within %s seconds)." % (search_path[dir_pos], self.timeout) )
+                        # replace the blocked workers
+                        blocked = len( [ task for task in running.keys() if task[0] == dir_pos ] )
+                        self._start_workers( blocked, tasks, results, running, cancelled )
+                        num_workers += blocked
+                        yield ('timeout', dir_pos, search_path[dir_pos])
+                    if not pending:
+                        break
+                    wait = min( [ wait ] + [ start + self.timeout - now for start in running.values() ] )
+
+                try:
+                    (dir_pos, file_pos, name, _), result, error = results.get( True, max(wait, 0.01) )
+                except Empty:
+                    continue
+                if not dir_pos in pending:
+                    continue
+                if error:
+                    raise error[0], error[1], error[2]
+
+                pending[dir_pos] -= 1
+                if file_pos is None:
+                    if search_file is not None:
+                        for file_pos, fname in enumerate( result ):
+                            tasks.put( (dir_pos, file_pos, fname, lambda fname=fname: search_file(fname)) )
+                        pending[dir_pos] += len( result )
+                    yield ('files', dir_pos, name, result)
+                else:
+                    yield ('result', dir_pos, file_pos, name, result)
+                if not pending[dir_pos]:
+                    del pending[dir_pos]
+        finally:
+            cancelled.update( xrange(len(search_path)) )
+            for _ in xrange( num_workers ):
+                tasks.put( None )
+
+
+    def glob(self, search_path):
+        """ returns the files of all directories in the search path (in the
+            order of the search path) """
+        for event in self._scatter( search_path ):
+            pass
+        return [ fname for bibdir in search_path if not bibdir in self.timed_out for fname in self._glob(bibdir) ]
+
+
+    def search(self, search_path, search_file):
+        """ calls search_file for every file in the search path and yields
+            (fname, result) tuples
+            - search_file is called concurrently by multiple threads
+        """
+        if not self.ordered:
+            for event in self._scatter( search_path, search_file ):
+                if event[0] == 'result':
+                    yield event[3:]
+            return
+
+        # results are buffered until all results of the preceding files are available
+        files, buffered, done = {}, {}, set()
+        dir_pos, file_pos = 0, 0
+        for event in self._scatter( search_path, search_file ):
+            if event[0] == 'files':
+                files[ event[1] ] = event[3]
+            elif event[0] == 'result':
+                buffered[ event[1:3] ] = event[3:]
+            else:
+                done.add( event[1] )
+
+            while dir_pos < len( search_path ):
+                if dir_pos in done or search_path[dir_pos] in self.timed_out or file_pos == len( files.get(dir_pos, ()) ) and dir_pos in files:
+                    dir_pos, file_pos = dir_pos + 1, 0
+                elif (dir_pos, file_pos) in buffered:
+                    yield buffered.pop( (dir_pos, file_pos) )
+                    file_pos += 1
+                else:
+                    break
+
+
+
+class TestScatterGather(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        from os import mkdir
+        from os.path import join
+        self.tmpdir = mkdtemp()
+        self.search_path = []
+        for d in ("a", "b", "c"):
+            mkdir( join(self.tmpdir, d) )
+            self.search_path.append( join(self.tmpdir, d) )
+            for i in range(5):
+                open( join(self.tmpdir, d, "%s%d.bib" % (d, i)), "w" ).write( "" )
+        self.search_path.append( join(self.tmpdir, "missing") )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    @staticmethod
+    def _search(fname, delay=0.05):
+        """ returns the file's basename (files of directory 'a' take longer) """
+        from os.path import basename
+        from time import sleep
+        if basename(fname).startswith("a"):
+            sleep( delay )
+        return basename( fname )
+
+    def testGlob(self):
+        """ tests the concurrent globbing of the search path """
+        from os.path import basename
+        assert [ basename(f) for f in ScatterGather().glob( self.search_path ) ] == [ "%s%d.bib" % (d, i) for d in "abc" for i in range(5) ]
+
+    def testSearch(self):
+        """ tests whether all files are searched and results are ordered on request """
+        expected = [ "%s%d.bib" % (d, i) for d in "abc" for i in range(5) ]
+        unordered = [ result for fname, result in ScatterGather( threads=4 ).search( self.search_path, self._search ) ]
+        assert sorted( unordered ) == expected
+        ordered = [ result for fname, result in ScatterGather( threads=4, ordered=True ).search( self.search_path, self._search ) ]
+        assert ordered == expected
+
+    def testTimeout(self):
+        """ tests whether slow directories are skipped """
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter( "ignore" )
+            executor = ScatterGather( threads=1, timeout=0.2, ordered=True )
+            results  = [ result for fname, result in executor.search( self.search_path, lambda fname: self._search(fname, 1.0) ) ]
+        assert results == [ "%s%d.bib" % (d, i) for d in "bc" for i in range(5) ]
+        assert executor.timed_out == set( self.search_path[:1] )
+
+    def testError(self):
+        """ tests whether errors of the search function are raised """
+        def fail(fname):
+            raise ValueError( fname )
+        try:
+            list( ScatterGather().search( self.search_path, fail ) )
+        except ValueError:
+            return
+        assert False
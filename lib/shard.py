@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+""" publishes large corpora as several pages (shards) and a small index page
+    - entries are sharded by type, by year or into pages of a fixed size
+    - shards are rendered independently (in parallel, if possible) and only
+      shards whose template or entries changed are regenerated """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import join, exists
+from collections import defaultdict
+from hashlib import md5
+from json import dumps, loads
+
+from batch import run_forked
+from bibtex import get_number
+from cache import writeAtomic
+from template import get_template_digest, get_entry_digest
+
+SHARD_MODES        = ('type', 'year', 'size')
+DEFAULT_SHARD_SIZE = 100
+SHARD_DIGEST_FILE  = ".shards"    # digests of the published shards
+
+
+def get_shards( listing, mode, size=DEFAULT_SHARD_SIZE ):
+    """ splits the published entries into shards
+        @param[in] listing  list of (type, bibtex entries) tuples in publishing
+                            order (see Template.getListing)
+        @param[in] mode     'type', 'year' or 'size'
+        @param[in] size     number of entries per shard (mode 'size')
+        @returns a list of (file, label, bibtex entries) tuples
+    """
+    if mode == 'type':
+        return [ ("type-%s.html" % tp, tp, bibtex_entries) for tp, bibtex_entries in listing ]
+
+    bibtex_entries = [ b for _, type_entries in listing for b in type_entries ]
+    if mode == 'year':
+        years = defaultdict( list )
+        for b in bibtex_entries:
+            years[ get_number( b.entry.get('year', '') ) ].append( b )
+        return [ ("year-%d.html" % year, str(year) if year else "unknown", years[year]) for year in sorted(years, reverse=True) ]
+    elif mode == 'size':
+        return [ ("page-%d.html" % (pos/size+1), "%d-%d" % (pos+1, min(pos+size, len(bibtex_entries))), bibtex_entries[pos:pos+size])
+                 for pos in xrange(0, len(bibtex_entries), size) ]
+    raise ValueError( "Unknown shard mode '%s'." % mode )
+
+
+def get_shard_digest( template_digest, bibtex_entries, artifacts ):
+    """ returns a digest of all data used for rendering the given entries """
+    h = md5( template_digest )
+    for b in bibtex_entries:
+        h.update( get_entry_digest( b, artifacts.get(b.key, {}) ) )
+    return h.hexdigest()
+
+
+def read_shard_digests( publish_dir ):
+    """ returns the digests of the shards published in publish_dir """
+    try:
+        return loads( open( join(publish_dir, SHARD_DIGEST_FILE) ).read() )
+    except (IOError, ValueError):
+        return {}
+
+
+def publish_shards( publish_dir, template, template_path, bibtex_entries, artifacts, mode, size=DEFAULT_SHARD_SIZE, processes=1 ):
+    """ publishes the bibtex_entries as shards and an index page (index.html)
+        - shards whose digest did not change since the last run are kept
+        @param[in] processes  number of processes rendering shards (None: one per CPU)
+        @returns the list of rendered shards
+    """
+    digests = read_shard_digests( publish_dir )
+    shards  = get_shards( template.getListing(bibtex_entries), mode, size )
+
+    template_digest = get_template_digest( template_path )
+    new_digests = dict( [ (fname, get_shard_digest(template_digest, shard_entries, artifacts)) for fname, _, shard_entries in shards ] )
+    outdated = [ shard for shard in shards if digests.get(shard[0]) != new_digests[shard[0]] or not exists( join(publish_dir, shard[0]) ) ]
+
+    def render_shard( pos ):
+        fname, _, shard_entries = outdated[pos]
+        writeAtomic( join(publish_dir, fname), template.getHtmlFile(shard_entries) )
+    run_forked( render_shard, xrange(len(outdated)), processes )
+
+    for fname in set(digests) - set(new_digests):
+        if exists( join(publish_dir, fname) ):
+            os.remove( join(publish_dir, fname) )
+    open( join(publish_dir, "index.html"), "w" ).write( template.getShardIndex(shards) )
+    writeAtomic( join(publish_dir, SHARD_DIGEST_FILE), dumps(new_digests, sort_keys=True) )
+    return [ fname for fname, _, _ in outdated ]
+
+
+
+class _Entry(object):
+    def __init__(self, key, type, year):
+        self.key, self.type, self.entry = key, type, {'year': year, 'title': key}
+
+
+class _Template(object):
+    def getListing(self, bibtex_entries):
+        types = sorted( set( [ b.type for b in bibtex_entries ] ) )
+        return [ (tp, [ b for b in bibtex_entries if b.type == tp ]) for tp in types ]
+    def getHtmlFile(self, bibtex_entries):
+        return " ".join( [ b.key for b in bibtex_entries ] )
+    def getShardIndex(self, shards):
+        return " ".join( [ fname for fname, _, _ in shards ] )
+
+
+class TestShard(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.template_path, self.publish_dir = join(self.tmpdir, "template"), join(self.tmpdir, "publish")
+        os.mkdir( self.template_path )
+        os.mkdir( self.publish_dir )
+        open( join(self.template_path, "head.html"), "w" ).write( "<html>" )
+        self.entries = [ _Entry('a2012', 'article', '2012'), _Entry('b2011', 'book', '2011'),
+                         _Entry('c2012', 'article', '2012'), _Entry('d', 'misc', '') ]
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def _get_shards(self, mode, size=DEFAULT_SHARD_SIZE):
+        return [ (fname, label, [ b.key for b in bibtex_entries ]) for fname, label, bibtex_entries in get_shards( _Template().getListing(self.entries), mode, size ) ]
+
+    def testGetShards(self):
+        """ tests the sharding by type, year and size """
+        assert self._get_shards( 'type' ) == [ ('type-article.html', 'article', ['a2012', 'c2012']), ('type-book.html', 'book', ['b2011']), ('type-misc.html', 'misc', ['d']) ]
+        assert self._get_shards( 'year' ) == [ ('year-2012.html', '2012', ['a2012', 'c2012']), ('year-2011.html', '2011', ['b2011']), ('year-0.html', 'unknown', ['d']) ]
+        assert self._get_shards( 'size', 3 ) == [ ('page-1.html', '1-3', ['a2012', 'c2012', 'b2011']), ('page-2.html', '4-4', ['d']) ]
+
+    def testPublishShards(self):
+        """ tests whether only changed shards are regenerated """
+        publish = lambda: publish_shards( self.publish_dir, _Template(), self.template_path, self.entries, {}, 'type' )
+        assert publish() == [ 'type-article.html', 'type-book.html', 'type-misc.html' ]
+        assert open( join(self.publish_dir, "type-article.html") ).read() == "a2012 c2012"
+        assert open( join(self.publish_dir, "index.html") ).read() == "type-article.html type-book.html type-misc.html"
+        assert publish() == []
+
+        self.entries[1].entry['title'] = 'changed'
+        self.entries.pop()
+        assert publish() == [ 'type-book.html' ]
+        assert not exists( join(self.publish_dir, "type-misc.html") )
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+""" compact per-file summaries which allow skipping bibtex files that
+    cannot match a search query """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from hashlib import md5
+from struct import unpack
+
+from cache import cacheRetrieve
+
+SUMMARY_SUFFIX = ".summary"
+NGRAM_SIZE     = 3
+BITS_PER_ITEM  = 10
+NUM_HASHES     = 4
+
+
+def get_ngrams( text, n=NGRAM_SIZE ):
+    """ returns the set of all character n-grams in text """
+    return set( [ text[i:i+n] for i in xrange(len(text)-n+1) ] )
+
+
+class BloomFilter(object):
+    """ a simple bloom filter for strings """
+
+    def __init__(self, capacity, bits_per_item=BITS_PER_ITEM, num_hashes=NUM_HASHES):
+        self.size       = max( 64, capacity*bits_per_item )
+        self.num_hashes = num_hashes
+        self.bits       = bytearray( (self.size+7) // 8 )
+
+    def _get_positions(self, item):
+        """ returns the bit positions of the given item (double hashing) """
+        h1, h2 = unpack( "<II", md5(item).digest()[:8] )
+        return [ (h1 + i*h2) % self.size for i in xrange(self.num_hashes) ]
+
+    def add(self, item):
+        for pos in self._get_positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        for pos in self._get_positions(item):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class BibSummary(object):
+    """ summarizes a bibtex file by
+        - a bloom filter over the n-grams of all entries' searchable text and
+        - the list of the file's bibtex keys (in the order of the entries)
+    """
+
+    def __init__(self, bibtex_entries):
+        ngrams = set()
+        for b in bibtex_entries:
+            ngrams.update( get_ngrams( b.getTextRepresentation() ) )
+
+        self.bloom = BloomFilter( len(ngrams) )
+        for ngram in ngrams:
+            self.bloom.add( ngram )
+        self.keys = [ b.key for b in bibtex_entries ]
+
+
+    def mayContain(self, search_terms):
+        """ returns False if no entry of the summarized file can contain all
+            search terms (terms shorter than NGRAM_SIZE are never pruned) """
+        for needle in search_terms:
+            for ngram in get_ngrams( needle.lower() ):
+                if not ngram in self.bloom:
+                    return False
+        return True
+
+
+def summaryRetrieve( cachedir, fname, fn ):
+    """ returns the (cached) summary of fname
+        - fn is called with fname to obtain the bibtex entries, if the summary
+          needs to be rebuilt """
+    return cacheRetrieve( cachedir, fname, lambda f: BibSummary( fn(f) ), SUMMARY_SUFFIX )
+
+
+
+class TestBibSummary(object):
+
+    class Entry(object):
+        def __init__(self, key, text):
+            self.key, self.text = key, text
+        def getTextRepresentation(self):
+            return self.text
+
+    def setUp(self):
+        self.summary = BibSummary( [ self.Entry("scharl2012", "games with a purpose scharl2012"),
+                                     self.Entry("lang2012",   "textsweeper content extraction lang2012") ] )
+
+    def testBloomFilter(self):
+        """ tests whether added items are always found """
+        b = BloomFilter( 1000 )
+        items = [ str(i) for i in xrange(1000) ]
+        for item in items:
+            b.add( item )
+        assert all( [ item in b for item in items ] )
+        assert len( [ i for i in xrange(1000, 2000) if str(i) in b ] ) < 100
+
+    def testMayContain(self):
+        """ tests whether the summary prunes only non matching queries """
+        assert self.summary.mayContain( ('Purpose', ) )
+        assert self.summary.mayContain( ('games', 'extraction') )
+        assert self.summary.mayContain( ('ab', ) )
+        assert not self.summary.mayContain( ('weichselbraun', ) )
+        assert self.summary.keys == ['scharl2012', 'lang2012']
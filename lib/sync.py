@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+""" synchronizes directory trees (e.g. the assets of publishing themes)
+    - files are only transferred if their size or modification time differs
+    - files are hardlinked (if requested and possible) or copied """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import join, exists, isdir, islink
+from shutil import copy2, rmtree
+
+
+def is_modified( src, dest ):
+    """ returns True if dest is missing or differs from src in size or
+        modification time """
+    try:
+        src_stat, dest_stat = os.stat( src ), os.stat( dest )
+    except OSError:
+        return True
+    return src_stat.st_size != dest_stat.st_size or int(src_stat.st_mtime) != int(dest_stat.st_mtime)
+
+
+def transfer_file( src, dest, link=False ):
+    """ hardlinks (if link is set and src and dest share a file system) or
+        copies src to dest (preserving its modification time) """
+    if exists( dest ) or islink( dest ):
+        os.remove( dest )
+    if link:
+        try:
+            os.link( src, dest )
+            return
+        except OSError:
+            pass
+    copy2( src, dest )
+
+
+def _remove( path ):
+    if isdir( path ) and not islink( path ):
+        rmtree( path )
+    else:
+        os.remove( path )
+
+
+def sync_tree( src_dir, dest_dir, link=False, threads=1 ):
+    """ makes dest_dir a copy of src_dir
+        - only missing and modified files are transferred (see is_modified)
+        - files and directories which are not present in src_dir are removed
+        @param[in] link     hardlink rather than copy files (if possible)
+        @param[in] threads  number of threads transferring files
+        @returns the list of transferred files (relative to dest_dir)
+    """
+    transfers = []
+    for root, dirs, files in os.walk( src_dir ):
+        rel_root  = os.path.relpath( root, src_dir )
+        dest_root = os.path.normpath( join(dest_dir, rel_root) )
+        if exists( dest_root ) and not isdir( dest_root ):
+            os.remove( dest_root )
+        if not exists( dest_root ):
+            os.makedirs( dest_root )
+
+        for name in set( os.listdir(dest_root) ) - set( dirs ) - set( files ):
+            _remove( join(dest_root, name) )
+        for name in files:
+            src, dest = join(root, name), join(dest_root, name)
+            if isdir( dest ) and not islink( dest ):
+                rmtree( dest )
+            if is_modified( src, dest ):
+                transfers.append( (src, dest) )
+
+    if threads > 1 and len(transfers) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool( threads )
+        try:
+            pool.map( lambda (src, dest): transfer_file(src, dest, link), transfers )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for src, dest in transfers:
+            transfer_file( src, dest, link )
+
+    return [ os.path.relpath(dest, dest_dir) for _, dest in transfers ]
+
+
+
+class TestSync(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.src, self.dest = join(self.tmpdir, "src"), join(self.tmpdir, "dest")
+        os.makedirs( join(self.src, "icons", "large") )
+        for fname in ("style.css", join("icons", "pdf.png"), join("icons", "large", "pdf.png")):
+            open( join(self.src, fname), "w" ).write( fname )
+
+    def tearDown(self):
+        rmtree( self.tmpdir )
+
+    def _check(self, link=False, threads=1):
+        assert sorted( sync_tree(self.src, self.dest, link, threads) ) == [ join("icons", "large", "pdf.png"), join("icons", "pdf.png"), "style.css" ]
+        assert open( join(self.dest, "icons", "large", "pdf.png") ).read() == join("icons", "large", "pdf.png")
+        # nothing to do for unchanged trees
+        assert sync_tree( self.src, self.dest, link, threads ) == []
+
+        # modified (replaced, as by most editors), removed and additional files
+        os.remove( join(self.src, "style.css") )
+        open( join(self.src, "style.css"), "w" ).write( "body {}" )
+        os.remove( join(self.src, "icons", "pdf.png") )
+        open( join(self.dest, "stale.css"), "w" ).write( "" )
+        assert sync_tree( self.src, self.dest, link, threads ) == [ "style.css" ]
+        assert open( join(self.dest, "style.css") ).read() == "body {}"
+        assert sorted( os.listdir(self.dest) ) == [ "icons", "style.css" ]
+        assert os.listdir( join(self.dest, "icons") ) == [ "large" ]
+
+    def testCopy(self):
+        """ tests the synchronization of copied trees """
+        self._check()
+
+    def testLink(self):
+        """ tests the synchronization of hardlinked trees using multiple threads """
+        self._check( link=True, threads=4 )
+        assert os.stat( join(self.src, "style.css") ).st_ino == os.stat( join(self.dest, "style.css") ).st_ino
@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
-import shutil, os, sys, re
+import shutil, os, re
 from os.path import join, exists
 from csv import reader
-from bibtex import NameFormatter
+from hashlib import md5
+from imp import load_source
+from bibtex import NameFormatter, DEFAULT_SORT_ORDER, sort_entries, get_sort_key
 from collections import defaultdict
+from sync import sync_tree
 
 EMPTY_ELEMENT_REGEXP=re.compile("""<span class="\w+">[ ,.]+</span>""", re.I)
 RE_PYTHON_CODE=re.compile("===(.*?)===")
+# directories copied from the template to the output directory
+THEME_ASSETS = ('icons', 'css')
+# default entry of the index page of sharded output (see getShardIndex)
+SHARD_INDEX_ENTRY = """<li><a href="%(file)s">%(label)s</a> (%(count)d)</li>"""
 
 def cleanup( txt ):
     """ basic cleanup's to prevent formatting errors """
@@ -16,51 +23,130 @@ def cleanup( txt ):
     txt = txt.replace(", :", ", ")
     return txt
 
+def get_artifacts( bibtex_entry ):
+    """ returns the template independent artifacts of the given entry """
+    return { 'citation': bibtex_entry.getCitation().replace("\n", "<br/>"),
+             'coins'   : bibtex_entry.getCoinsCitation(),
+             'bibtex'  : bibtex_entry.getBibTexCitation() }
+
+def get_template_digest( template_path ):
+    """ returns a digest identifying the current version of the template's files """
+    h = md5()
+    for fname in sorted( os.listdir(template_path) ):
+        st = os.stat( join(template_path, fname) )
+        h.update( "%s %d %d\n" % (fname, st.st_size, st.st_mtime) )
+    return h.hexdigest()
+
+def get_entry_digest( bibtex_entry, artifacts ):
+    """ returns a digest of the data used for rendering the given entry """
+    return md5( repr( (bibtex_entry.key, bibtex_entry.type, sorted(bibtex_entry.entry.items()),
+                       artifacts.get('citation'), artifacts.get('coins')) ) ).hexdigest()
+
 class Template(object):
     """ creates an HTML file using a given template """
 
-    def __init__(self, template_path):
+    def __init__(self, template_path, artifacts=None):
+        """ @param[in] template_path
+            @param[in] artifacts      (optional dictionary of precomputed artifacts per bibtex key)
+        """
+        self._template_path = template_path
         self._get_file_name = lambda x: join(template_path, x)
-        self._get_content   = lambda x: open(self._get_file_name(x)).read()
-        # import preferences
-        sys.path.append(template_path)
-        try:
-            from templateconfig import DEFAULT_TYPE_ORDER, ATTR_TRANSLATION_TABLE, STR_TRANSLATION_TABLE, FILE_TRANSLATION_TABLE, PUBLICATION_BLACKLIST
-            self._default_order = DEFAULT_TYPE_ORDER
-            self._attr_translation_tbl  = ATTR_TRANSLATION_TABLE
-            self._str_translation_tbl   = STR_TRANSLATION_TABLE
-            self._file_translation_tbl  = FILE_TRANSLATION_TABLE
-            self._publication_blacklist = PUBLICATION_BLACKLIST   # a list of publications to ignore in the publishing process
-        except ImportError: # use old schema
+        self._contents      = {}
+        self._artifacts     = artifacts if artifacts is not None else {}
+        self._render_cache  = None
+        # import preferences (every template gets its own config module)
+        config_file = self._get_file_name("templateconfig.py")
+        if exists(config_file):
+            tc = load_source( "templateconfig_%s" % md5(template_path).hexdigest(), config_file )
+            self._default_order = tc.DEFAULT_TYPE_ORDER
+            self._attr_translation_tbl  = tc.ATTR_TRANSLATION_TABLE
+            self._str_translation_tbl   = tc.STR_TRANSLATION_TABLE
+            self._file_translation_tbl  = tc.FILE_TRANSLATION_TABLE
+            self._publication_blacklist = frozenset( tc.PUBLICATION_BLACKLIST )   # publications to ignore in the publishing process
+            self._sort_order            = getattr(tc, 'ENTRY_SORT_ORDER', DEFAULT_SORT_ORDER)
+        else: # use old schema
             from publishconfig import DEFAULT_TYPE_ORDER
             self._default_order         = DEFAULT_TYPE_ORDER
             self._attr_translation_tbl  = self._get_translation_table( "attr.csv" )
             self._str_translation_tbl   = self._get_translation_table( "str.csv" )
             self._file_translation_tbl  = self._get_translation_table( "files.csv")
-            self._publication_blacklist = ()
+            self._publication_blacklist = frozenset()
+            self._sort_order            = DEFAULT_SORT_ORDER
 
 
 
-    def getHtmlFile(self, bibtex_entry_list, publish_types=None):
-        """ returns a bibtex file describing the given list
-            of bibtex_entries """
+    def setArtifacts(self, artifacts):
+        """ sets the precomputed artifacts used for subsequent calls """
+        self._artifacts = artifacts
+
+
+    def setRenderCache(self, render_cache):
+        """ looks up rendered entries in the given result cache (see
+            resultcache.ResultCache); entries are keyed by their data and the
+            current version of the template's files """
+        self._render_cache    = render_cache
+        self._template_digest = get_template_digest( self._template_path )
+
 
-        html = []
-        html.append( self._get_head() )
+    def _get_content(self, fname):
+        """ returns the (memoized) content of the given template file """
+        if not fname in self._contents:
+            self._contents[fname] = open(self._get_file_name(fname)).read()
+        return self._contents[fname]
 
+
+    def getListing(self, bibtex_entry_list, publish_types=None):
+        """ returns a list of (type, bibtex entries) tuples in the order in
+            which the entries are published """
         bd = self._get_per_type_listing( bibtex_entry_list )
-        for tp in self._default_order:
-            if not bd.has_key( tp ):
-                continue
-            if publish_types is not None and tp not in publish_types:
-                continue
+        return [ (tp, bd[tp]) for tp in self._default_order if tp in bd and (publish_types is None or tp in publish_types) ]
+
+
+    def isPublished(self, bibtex_entry):
+        """ returns True if the template publishes the given entry """
+        return bibtex_entry.type in self._default_order and not bibtex_entry.key in self._publication_blacklist
+
+
+    def getSortKey(self, bibtex_entry):
+        """ returns the key ordering the entries of a type (see getListing) """
+        return get_sort_key( bibtex_entry, self._sort_order )
+
 
-            html.append(self._get_bibtex_type_head( tp ) )
-            html += [ cleanup(self._get_bibtex_entry_content(b)) for b in reversed(sorted(bd.get(tp))) ]
-            html.append(self._get_bibtex_type_foot( tp ) )
+    def getTypeOrder(self):
+        """ returns the order in which the bibtex types are published """
+        return self._default_order
 
-        html.append( self._get_foot() )
-        return "\n".join(html)
+
+    def getHtmlFile(self, bibtex_entry_list, publish_types=None):
+        """ returns a bibtex file describing the given list
+            of bibtex_entries """
+        return "\n".join( self.iterHtml( self.getListing(bibtex_entry_list, publish_types) ) )
+
+
+    def iterHtml(self, listing):
+        """ yields the parts of the html file for the given listing
+            @param[in] listing  list of (type, bibtex entries) tuples in
+                                publishing order (see getListing); the entries
+                                may be provided by an iterator
+        """
+        yield self._get_head()
+        for tp, bibtex_entries in listing:
+            yield self._get_bibtex_type_head( tp )
+            for b in bibtex_entries:
+                yield self._get_entry_html(b)
+            yield self._get_bibtex_type_foot( tp )
+        yield self._get_foot()
+
+
+    def getShardIndex(self, shards):
+        """ returns the index page linking the given (file, label, bibtex entries)
+            shards (formatted with the template's shard-entry.html, if available) """
+        if exists( self._get_file_name("shard-entry.html") ):
+            entry_template = self._get_content("shard-entry.html")
+        else:
+            entry_template = SHARD_INDEX_ENTRY
+        html = [ entry_template % {'file': fname, 'label': label, 'count': len(bibtex_entries)} for fname, label, bibtex_entries in shards ]
+        return "\n".join( [self._get_head(), "<ul class=\"shards\">"] + html + ["</ul>", self._get_foot()] )
 
     def _evalTemplate(self, template, d):
         """ evaluates python expressions in a template
@@ -101,21 +187,30 @@ class Template(object):
             bibtex_entry.entry['_title'] = bibtex_entry.entry['title']
 
 
-    def recreateTheme(self, dest_dir):
-        """ recreates the theme infrastructure at dest_dir (deleting all files
-            present in this directory """
-
+    def recreateTheme(self, dest_dir, link=False, threads=1, keep=()):
+        """ recreates the theme infrastructure at dest_dir
+            - generated files (except for the ones listed in keep) are deleted
+            - the theme's assets (icons, css) are synchronized, i.e. only
+              missing or modified files are hardlinked (if link is set) or
+              copied using up to threads threads
+        """
+        assets = [ asset for asset in THEME_ASSETS if exists(self._get_file_name(asset)) ]
         if exists(dest_dir):
-           shutil.rmtree(dest_dir)
+            for name in os.listdir(dest_dir):
+                if not name in assets and not name in keep:
+                    path = os.path.join(dest_dir, name)
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+        else:
+            os.mkdir( dest_dir )
 
-        os.mkdir( dest_dir )
         os.mkdir( os.path.join(dest_dir, "abstract") )
         os.mkdir( os.path.join(dest_dir, "bibtex") )
         os.mkdir( os.path.join(dest_dir, "pdf") )
-        if exists(self._get_file_name('icons')):
-            shutil.copytree( self._get_file_name('icons'), os.path.join(dest_dir, 'icons') )
-        if exists(self._get_file_name('css')):
-            shutil.copytree( self._get_file_name('css'), os.path.join(dest_dir, 'css') )
+        for asset in assets:
+            sync_tree( self._get_file_name(asset), os.path.join(dest_dir, asset), link, threads )
 
 
     def _get_translation_table(self, fname):
@@ -131,11 +226,19 @@ class Template(object):
         return s
 
 
+    def _get_artifacts( self, bibtex_entry ):
+        """ returns the (precomputed) artifacts of the given entry """
+        if not bibtex_entry.key in self._artifacts:
+            self._artifacts[bibtex_entry.key] = get_artifacts( bibtex_entry )
+        return self._artifacts[bibtex_entry.key]
+
+
     def _get_entry_dict( self, bibtex_entry, keys ):
         """ formats optional items and sets missing items to '' """
         data = { k: self._translate_str(v) for k,v in bibtex_entry.entry.iteritems() }
-        data['citation'] = bibtex_entry.getCitation().replace("\n", "<br/>")
-        data['coins']    = bibtex_entry.getCoinsCitation()
+        artifacts = self._get_artifacts( bibtex_entry )
+        data['citation'] = artifacts['citation']
+        data['coins']    = artifacts['coins']
         if 'author' in data:
             data['author'] = NameFormatter( data['author'] ).getAuthors()
         for k in keys:
@@ -147,9 +250,10 @@ class Template(object):
 
 
     def _get_per_type_listing( self, bibtex_entry_list ):
-        """ returns a dictinary with the publication_type + publications """
+        """ returns a dictinary with the publication_type + publications
+            (sorted according to the template's sort order) """
         bd = defaultdict( list )
-        for b in bibtex_entry_list:
+        for b in sort_entries( bibtex_entry_list, self._sort_order ):
             # ignore blacklisted items
             if b.key in self._publication_blacklist:
                 continue
@@ -175,6 +279,20 @@ class Template(object):
         return self.cleanupCitation( template_string % d )
 
 
+    def _get_entry_html(self, bibtex_entry):
+        """ returns the cleaned up html snippet for the given entry (from the
+            render cache, if the entry and the template did not change) """
+        if self._render_cache is None:
+            return cleanup(self._get_bibtex_entry_content(bibtex_entry))
+
+        key  = self._template_digest + get_entry_digest( bibtex_entry, self._get_artifacts(bibtex_entry) )
+        html = self._render_cache.get( key )
+        if html is None:
+            html = cleanup(self._get_bibtex_entry_content(bibtex_entry))
+            self._render_cache.put( key, html )
+        return html
+
+
     def _get_bibtex_type_head(self, tp ):
         """ returns the head for the given bibtex type """
         return self._get_content("%s-head.html" % tp )
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+""" watches files and directories for changes
+    - uses inotify (pyinotify), if available
+    - otherwise polls the files' modification times """
+
+# (C)opyrights 2008-2012 by Albert Weichselbraun <albert@weichselbraun.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from os.path import abspath, dirname, isdir, join, sep
+from time import sleep
+
+POLL_INTERVAL = 2.0     # seconds between two polls
+SETTLE_TIME   = 0.5     # seconds without further changes before a change is reported
+
+
+class PollingWatcher(object):
+    """ detects changes by comparing the size and mtime of all watched files
+        (directories are watched recursively) """
+
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.paths    = [ abspath(p) for p in paths ]
+        self.interval = interval
+        self._state   = self._get_state()
+
+
+    def _get_state(self):
+        """ returns a dictionary file -> (size, mtime) of all watched files """
+        state = {}
+        for path in self.paths:
+            if isdir( path ):
+                files = [ join(root, fname) for root, _, fnames in os.walk(path) for fname in fnames ]
+            else:
+                files = [ path ]
+            for fname in files:
+                try:
+                    st = os.stat( fname )
+                    state[fname] = (st.st_size, st.st_mtime)
+                except OSError:
+                    pass
+        return state
+
+
+    def poll(self):
+        """ returns the set of files changed, created or removed since the last poll """
+        state, previous = self._get_state(), self._state
+        self._state = state
+        return set( [ fname for fname in set(state) | set(previous) if state.get(fname) != previous.get(fname) ] )
+
+
+    def wait(self):
+        """ blocks until watched files change and returns them """
+        while True:
+            sleep( self.interval )
+            changed = self.poll()
+            if changed:
+                return changed
+
+
+
+class InotifyWatcher(object):
+    """ detects changes using inotify
+        - files are watched through their directories, so that files replaced
+          by editors (written to a temporary file and renamed) are detected
+    """
+
+    def __init__(self, paths, settle_time=SETTLE_TIME):
+        import pyinotify
+        self.paths       = [ abspath(p) for p in paths ]
+        self.settle_time = settle_time
+        self._changed    = set()
+
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM | pyinotify.IN_CREATE | pyinotify.IN_DELETE
+        self._wm = pyinotify.WatchManager()
+        for path in self.paths:
+            if isdir( path ):
+                self._wm.add_watch( path, mask, rec=True, auto_add=True )
+            else:
+                self._wm.add_watch( dirname(path), mask )
+        self._notifier = pyinotify.Notifier( self._wm, self._add_event )
+
+
+    def _is_watched(self, fname):
+        return [ path for path in self.paths if fname == path or fname.startswith(path + sep) ] != []
+
+
+    def _add_event(self, event):
+        if self._is_watched( event.pathname ):
+            self._changed.add( event.pathname )
+
+
+    def _read_events(self, timeout):
+        """ processes all events which arrive within timeout (milliseconds)
+            @returns False if no events arrived """
+        if not self._notifier.check_events( timeout ):
+            return False
+        self._notifier.read_events()
+        self._notifier.process_events()
+        return True
+
+
+    def wait(self):
+        """ blocks until watched files change and returns them """
+        while not self._changed:
+            self._read_events( None )
+        # collect the changes belonging to the same save operation
+        while self._read_events( int(self.settle_time*1000) ):
+            pass
+        changed, self._changed = self._changed, set()
+        return changed
+
+
+def get_watcher( paths ):
+    """ returns an inotify based watcher for the given paths or a polling
+        watcher, if pyinotify is not available """
+    try:
+        return InotifyWatcher( paths )
+    except ImportError:
+        return PollingWatcher( paths )
+
+
+def watch( paths, callback ):
+    """ calls callback with the set of changed files whenever watched files change """
+    watcher = get_watcher( paths )
+    while True:
+        callback( watcher.wait() )
+
+
+
+class TestPollingWatcher(object):
+
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.tmpdir = mkdtemp()
+        self.bib    = join( self.tmpdir, "lit.bib" )
+        self.theme  = join( self.tmpdir, "theme" )
+        os.mkdir( self.theme )
+        open( self.bib, "w" ).write( "@article{a}" )
+        open( join(self.theme, "head.html"), "w" ).write( "<html>" )
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree( self.tmpdir )
+
+    def testPoll(self):
+        """ tests the detection of changed, created and removed files """
+        watcher = PollingWatcher( (self.bib, self.theme) )
+        assert watcher.poll() == set()
+        open( self.bib, "a" ).write( "@article{b}" )
+        open( join(self.theme, "foot.html"), "w" ).write( "</html>" )
+        os.remove( join(self.theme, "head.html") )
+        open( join(self.tmpdir, "unwatched.bib"), "w" ).write( "" )
+        assert watcher.poll() == set( [self.bib, join(self.theme, "foot.html"), join(self.theme, "head.html")] )
+        assert watcher.poll() == set()
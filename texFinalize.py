@@ -18,81 +18,56 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from re import compile as re_compile
-from sys import argv
-from os.path import splitext, exists
-
-RE_INPUT  = re_compile( r"\input{([^}]+)}" )
-RE_FIGURE = re_compile( r"newlabel{fig:(\S+)}{{(\d+)}" )
-RE_HREF   = re_compile( ".href{[^}]+?}{([^}]+?)}" )
-
-FIG_NUM_TABLE = {}
-
-latexComand = lambda x: "\n"+x if x.startswith("\\") else x
-
-def get_bbl_file( fname ):
-    """ reads the bbl file and removes links from the file """
-    fname = splitext( fname )[0]+".bbl"
-    result = "".join( [ latexComand( line.strip()+" " if not line.strip().endswith("%") else line.strip()[:-1] ) for line in open(fname) ] )
-    getLinkText = lambda x: x.group(1)
-    return "\n".join( [ RE_HREF.sub(getLinkText, line) for line in result.split("\n") ] )
-
-
-def read_aux_file( fname ):
-    """ reads the aux file required to replace labels with figure numbers """
-    fname = splitext( fname )[0]+".aux"
-    if not exists( fname ):
-        return
-
-    for line in open( fname ):
-        m = RE_FIGURE.search(line)
-        if m:
-            key = r"\ref{fig:%s}" % m.group(1)
-            FIG_NUM_TABLE[ key ] = m.group(2)
-
-
-def replace_items( line ):
-    """ replaces mode and figure references """
-    return line
-
-    """ no longer used """
-
-    line = line.replace(r"\def\mode{0} %", r"\def\mode{1} %")
-    for key, reference in FIG_NUM_TABLE.items():
-        line = line.replace(key, reference)
-    return line
-
-
-def read_file( fname ):
-    result = []
-    if not splitext( fname )[1] and not exists( fname ):
-        fname += ".tex"
-
-    read_aux_file( fname )
-
-    for line in open( fname ):
-        # skip results
-        if line.startswith("%"):
-            continue
-
-        line = replace_items( line )
-        # expand input statements
-        m = RE_INPUT.search(line)
-        if m:
-            line = read_file( m.group(1) )
-
-        # expand literature
-        if line.startswith(r"\bibliographystyle"):
-            continue
-        if line.startswith(r"\bibliography"):
-            line = get_bbl_file(argv[1])
-
-        result.append( line )
-
-
-    return "".join(result)
-
-
-print read_file( argv[1] )
-
-
+import os.path
+from sys import path, stdout, stderr, exit
+from optparse import OptionParser
+
+if os.path.islink(__file__):
+    LIB_DIR       = os.path.join(os.path.dirname( os.readlink(__file__)), "lib")
+else:
+    LIB_DIR       = os.path.join(os.path.dirname(__file__), "lib")
+path.append( LIB_DIR )
+from bibconfig import USER_CACHE
+from latex import TexFinalizer, finalize
+from batch import read_manifest, run_batch
+
+
+def parse_options():
+    """ parses the options specified by the user """
+    parser = OptionParser(usage="%prog [options] document.tex [document.tex ...]")
+    parser.add_option("-n", "--no-cache", dest="cache", action="store_false", default=True,
+                      help="do not cache scanned input files between runs.")
+    parser.add_option("-o", "--output-dir", dest="output_dir", default=None,
+                      help="write every finalized document to its own file in this directory.")
+    parser.add_option("-m", "--manifest", dest="manifest", default=None,
+                      help="file listing the documents to finalize (one per line).")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None,
+                      help="number of documents to process concurrently (default: number of CPUs).")
+
+    (options, args) = parser.parse_args()
+    if options.manifest:
+        args += read_manifest( options.manifest )
+    if not args:
+        parser.error("please specify the latex document(s) to finalize.")
+    if len(args) > 1 and not options.output_dir:
+        parser.error("please specify an output directory for finalizing multiple documents.")
+    return options, args
+
+
+# ===============================================================================
+# =
+# = M A I N 
+# =
+# ===============================================================================
+
+options, documents = parse_options()
+cachedir = USER_CACHE if options.cache else None
+
+if not options.output_dir:
+    stdout.writelines( TexFinalizer( documents[0], cachedir ) )
+    stdout.write( "\n" )
+else:
+    errors = run_batch( finalize, documents, options.output_dir, ".tex", (cachedir, ), options.jobs )
+    for error in errors:
+        stderr.write( "Cannot finalize %s\n" % error )
+    exit( 1 if errors else 0 )
@@ -17,41 +17,80 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from re import compile
-from sys import argv
-from collections import defaultdict
+import os.path
+from sys import path, stdout, stderr, exit
+from optparse import OptionParser
 
-RE_LABEL = compile("\\label\{([^\}]+)\}")
-LABEL_GROUPS = { 'sec': 'Sections', 'eq': 'Equations', 'fig': 'Figures', 'tab': 'Tables' }
+if os.path.islink(__file__):
+    LIB_DIR       = os.path.join(os.path.dirname( os.readlink(__file__)), "lib")
+else:
+    LIB_DIR       = os.path.join(os.path.dirname(__file__), "lib")
+path.append( LIB_DIR )
+from bibconfig import USER_CACHE
+from latex import extract_labels, get_label_listing, write_label_listing
+from batch import read_manifest, run_batch
+from labelindex import LabelIndex
 
-def extract_labels( fname ):
-    """ extract all labels from the text """
-    labels=[]
-    for line in open( fname ):
-        labels.extend( RE_LABEL.findall(line) )
 
-    return labels
+def parse_options():
+    """ parses the options specified by the user """
+    parser = OptionParser(usage="%prog [options] document.tex [document.tex ...]")
+    parser.add_option("-o", "--output-dir", dest="output_dir", default=None,
+                      help="write the labels of every document to its own .labels file in this directory.")
+    parser.add_option("-m", "--manifest", dest="manifest", default=None,
+                      help="file listing the documents to process (one per line).")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None,
+                      help="number of documents to process concurrently (default: number of CPUs).")
+    parser.add_option("-r", "--recursive", dest="recursive", action="store_true", default=False,
+                      help="list the labels of the whole project (follows \\input and \\include).")
+    parser.add_option("-u", "--unused", dest="unused", action="store_true", default=False,
+                      help="list labels which are never referenced in the project.")
+    parser.add_option("-d", "--dangling", dest="dangling", action="store_true", default=False,
+                      help="list references to labels which are not defined in the project.")
+    parser.add_option("--duplicates", dest="duplicates", action="store_true", default=False,
+                      help="list labels which are defined more than once in the project.")
 
-def group_labels( labels ):
-    """ groups labels based on their qualifiers """
-    res = defaultdict( list )
-    for label in labels:
-        if ":" in label:
-            grp, lbl = label.split(":", 1) 
-        else:
-            grp, lbl = '', label
+    (options, args) = parser.parse_args()
+    if options.manifest:
+        args += read_manifest( options.manifest )
+    if not args:
+        parser.error("please specify the latex document(s) to search.")
+    if len(args) > 1 and not options.output_dir:
+        parser.error("please specify an output directory for processing multiple documents.")
+    options.project = options.recursive or options.unused or options.dangling or options.duplicates
+    if options.project and len(args) > 1:
+        parser.error("project wide queries only support a single (main) document.")
+    return options, args
 
-        if grp in LABEL_GROUPS:
-            res[ LABEL_GROUPS[grp] ].append(label)
-        else:
-            res['Unknown'].append(label)
 
-    return res
+def get_positions( positions ):
+    """ returns a string representation of the given (file, line) positions """
+    return ", ".join( [ "%s:%d" % pos for pos in positions ] )
 
 
-labels = extract_labels( argv[1] )
+# ===============================================================================
+# =
+# = M A I N 
+# =
+# ===============================================================================
 
-for group, label in group_labels( labels ).iteritems():
-    print group.upper()+":"
-    print "  "+"\n  ".join( sorted(label) )
+options, documents = parse_options()
 
+if options.project:
+    index = LabelIndex( documents[0], USER_CACHE )
+    if options.recursive:
+        stdout.write( get_label_listing( index.labels.keys() ) )
+    for query, title, results in ( (options.unused,     "UNUSED LABELS",       index.getUnusedLabels),
+                                   (options.dangling,   "DANGLING REFERENCES", index.getDanglingRefs),
+                                   (options.duplicates, "DUPLICATE LABELS",    index.getDuplicateLabels) ):
+        if query:
+            print title+":"
+            for label, positions in results():
+                print "  %s (%s)" % (label, get_positions(positions))
+elif not options.output_dir:
+    stdout.write( get_label_listing( extract_labels(documents[0]) ) )
+else:
+    errors = run_batch( write_label_listing, documents, options.output_dir, ".labels", (), options.jobs )
+    for error in errors:
+        stderr.write( "Cannot process %s\n" % error )
+    exit( 1 if errors else 0 )